@@ -0,0 +1,126 @@
+import pandas as pd
+
+RANK_PREFIX = "%Rank_"
+
+
+def read_mix_table(output_file):
+    """
+    Read a MixMHC2pred output file.
+
+    Returns:
+        tuple: (preamble, header, rows) where preamble holds the leading '#' metadata
+        lines (with line breaks), header the column names and rows lists of fields.
+    """
+    preamble = []
+    with open(output_file, "r") as f:
+        line = f.readline()
+        while line.startswith("#"):
+            preamble.append(line)
+            line = f.readline()
+        header = line.rstrip("\n").split("\t")
+        rows = [line.rstrip("\n").split("\t") for line in f if line.strip()]
+    return preamble, header, rows
+
+
+def mix_alleles(header):
+    """Return the alleles of a MixMHC2pred header, from its %Rank_<allele> columns."""
+    return [col[len(RANK_PREFIX):] for col in header if col.startswith(RANK_PREFIX) and col != "%Rank_best"]
+
+
+def split_mix_header(header):
+    """
+    Split a MixMHC2pred header into its column groups.
+
+    Returns:
+        tuple: (common, best, group) where common are the per-peptide columns before
+        'BestAllele' (e.g. Peptide, Context), best the '<field>_best' columns and group
+        the field prefixes repeated for every allele (e.g. Core, CoreP1, %Rank).
+    """
+    alleles = mix_alleles(header)
+    if not alleles:
+        raise ValueError("No %Rank_<allele> columns found in the MixMHC2pred output.")
+
+    common = header[:header.index("BestAllele")] if "BestAllele" in header else header[:1]
+    best = [col for col in header if col.endswith("_best")]
+    suffix = f"_{alleles[0]}"
+    group = [col[:-len(suffix)] for col in header if col.endswith(suffix) and col not in best]
+    return common, best, group
+
+
+def write_mix_table(output_file, preamble, common, best, group, alleles, rows):
+    """Write rows in MixMHC2pred's layout: metadata lines, header, then tab-separated rows."""
+    header = common + ["BestAllele"] + best + [f"{field}_{allele}" for allele in alleles for field in group]
+    with open(output_file, "w") as f:
+        f.writelines(preamble)
+        f.write("\t".join(header) + "\n")
+        for row in rows:
+            f.write("\t".join(row) + "\n")
+
+
+def read_mix_header(output_file):
+    """
+    Read only the header of a MixMHC2pred output file.
+
+    Returns:
+        tuple: (n_preamble, header) with the number of leading '#' metadata lines
+        and the column names that follow them.
+    """
+    n_preamble = 0
+    with open(output_file, "r") as f:
+        for line in f:
+            if not line.startswith("#"):
+                return n_preamble, line.rstrip("\n").split("\t")
+            n_preamble += 1
+    raise ValueError(f"No header line found in the MixMHC2pred output: {output_file}")
+
+
+def iter_mix_long(output_file, rank_threshold=5, chunksize=200000):
+    """
+    Stream a MixMHC2pred output as long (one row per peptide and allele) record batches.
+
+    The metadata lines are counted instead of assuming a fixed number, and for each
+    allele only rows with %Rank <= rank_threshold are kept before melting.
+
+    Yields:
+        pd.DataFrame: Columns Peptide, Allele and the allele's fields with '%Rank'
+        renamed to 'Rank' (e.g. Peptide, Allele, Core, CoreP1, Rank).
+    """
+    skiprows, header = read_mix_header(output_file)
+    alleles = mix_alleles(header)
+    _, _, group = split_mix_header(header)
+    fields = ["Rank" if field == RANK_PREFIX.rstrip("_") else field for field in group]
+
+    for chunk in pd.read_csv(output_file, sep="\t", skiprows=skiprows, chunksize=chunksize):
+        frames = []
+        for allele in alleles:
+            binding = chunk.loc[chunk[f"{RANK_PREFIX}{allele}"] <= rank_threshold,
+                                ["Peptide"] + [f"{field}_{allele}" for field in group]]
+            if binding.empty:
+                continue
+            binding.columns = ["Peptide"] + fields
+            binding.insert(1, "Allele", allele)
+            frames.append(binding)
+        if frames:
+            yield pd.concat(frames, ignore_index=True)
+
+
+def read_mix_long(output_file, rank_threshold=5, chunksize=200000):
+    """
+    Read the binding (%Rank <= rank_threshold) rows of a MixMHC2pred output in long format.
+
+    Returns:
+        tuple: (alleles, long DataFrame) with rows grouped by allele in file order.
+    """
+    skiprows, header = read_mix_header(output_file)
+    alleles = mix_alleles(header)
+    _, _, group = split_mix_header(header)
+    fields = ["Rank" if field == RANK_PREFIX.rstrip("_") else field for field in group]
+
+    batches = list(iter_mix_long(output_file, rank_threshold, chunksize))
+    if not batches:
+        return alleles, pd.DataFrame(columns=["Peptide", "Allele"] + fields)
+
+    long_df = pd.concat(batches, ignore_index=True)
+    order = {allele: i for i, allele in enumerate(alleles)}
+    long_df = long_df.sort_values("Allele", key=lambda col: col.map(order), kind="stable", ignore_index=True)
+    return alleles, long_df
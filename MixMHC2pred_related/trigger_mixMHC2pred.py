@@ -1,14 +1,111 @@
 import os
-import subprocess
 
+from MixMHC2pred_related.mixMHC2pred_output import read_mix_table, mix_alleles, split_mix_header, write_mix_table
+from pipeline_related.metrics import run_command
+from pipeline_related.prediction_cache import check_all_predicted, partition_cached, tool_version
 
-def trigger_MixMHC2pred(mixmhc2pred_path, annovar_outputs_dir):
+# Preamble lines describing one run (its command line and files) rather than the tool
+RUN_PREAMBLE_KEYWORDS = ("command", "input file", "output file")
+
+
+def _as_rank(value):
+    """Parse a %Rank value, treating anything non-numeric as the worst rank."""
+    try:
+        return float(value)
+    except ValueError:
+        return float("inf")
+
+
+def _tool_preamble(preamble, run_files=()):
+    """Keep the preamble lines that describe the tool, dropping those naming one run's command or files."""
+    return [line for line in preamble
+            if not any(keyword in line.lower() for keyword in RUN_PREAMBLE_KEYWORDS)
+            and not any(run_file in line for run_file in run_files)]
+
+
+def _rebuilt_preamble(preamble, pep_file):
+    """The cached tool preamble with a line naming the .pep file this output was rebuilt for."""
+    # Keep a closing '####' rule (if any) after the added line
+    end = len(preamble) - 1 if preamble and not preamble[-1].strip().strip("#") else len(preamble)
+    return preamble[:end] + [f"# Input file: {pep_file} (rebuilt from the prediction cache)\n"] + preamble[end:]
+
+
+def run_MixMHC2pred_cached(cache, version, pep_file, alleles, output_file, run_predictions):
+    """
+    Serve MixMHC2pred results from the prediction cache and predict only the misses.
+
+    Parameters:
+    - cache: PredictionCache instance.
+    - version: Tool version key (see tool_version).
+    - pep_file: Input .pep file.
+    - alleles: List of alleles to predict.
+    - output_file: Path of the rebuilt output covering every peptide.
+    - run_predictions: Function (pep_file, output_file) running MixMHC2pred on a .pep file.
+    """
+    tool = "MixMHC2pred"
+    with open(pep_file, "r") as f:
+        peptides = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+    cached, missing = partition_cached(cache, tool, version, alleles, peptides)
+
+    if missing:
+        work_dir = os.path.join(os.path.dirname(output_file), "cache_misses")
+        os.makedirs(work_dir, exist_ok=True)
+        miss_pep_file = os.path.join(work_dir, "cache_misses.pep")
+        miss_output_file = os.path.join(work_dir, "cache_misses_mix_out.txt")
+        with open(miss_pep_file, "w") as f:
+            f.writelines(f"{peptide}\n" for peptide in missing)
+        run_predictions(miss_pep_file, miss_output_file)
+
+        # Cache (common fields, allele group fields) per peptide and allele
+        preamble, header, rows = read_mix_table(miss_output_file)
+        common, best, group = split_mix_header(header)
+        cache.set_metadata(tool, version, "layout", [common, best, group])
+        cache.set_metadata(tool, version, "preamble", _tool_preamble(preamble, (miss_pep_file, miss_output_file)))
+        for allele in mix_alleles(header):
+            columns = [header.index(col) for col in common[1:]] + [header.index(f"{field}_{allele}") for field in group]
+            payloads = {row[0]: "\t".join(row[i] for i in columns) for row in rows}
+            cache.store(tool, version, allele, payloads)
+            cached.setdefault(allele, {}).update(payloads)
+
+    check_all_predicted(tool, cached, alleles, peptides)
+    layout = cache.get_metadata(tool, version, "layout")
+    if layout is None:
+        raise ValueError("The prediction cache has no MixMHC2pred output layout; run once without the cache.")
+    common, best, group = layout
+    preamble = _rebuilt_preamble(_tool_preamble(cache.get_metadata(tool, version, "preamble") or []), pep_file)
+
+    # Rebuild the full table in .pep order; the best-allele columns are recomputed
+    rank_index = group.index("%Rank")
+    rows = []
+    for peptide in peptides:
+        payloads = [cached[allele][peptide].split("\t") for allele in alleles]
+        group_values = [fields[len(common) - 1:] for fields in payloads]
+        best_index = min(range(len(alleles)), key=lambda i: _as_rank(group_values[i][rank_index]))
+        best_values = [group_values[best_index][group.index(col[:-len("_best")])]
+                       if col[:-len("_best")] in group else "NA" for col in best]
+
+        row = [peptide] + payloads[0][:len(common) - 1] + [alleles[best_index]] + best_values
+        for fields in group_values:
+            row.extend(fields)
+        rows.append(row)
+    write_mix_table(output_file, preamble, common, best, group, alleles, rows)
+
+
+def trigger_MixMHC2pred(mixmhc2pred_path, annovar_outputs_dir, cache=None, alleles=None, pep_file=None, output_dir=None):
     """
     Function to trigger MixMHC2pred with the .pep file generated from ANNOVAR output.
 
     Parameters:
     - mixmhc2pred_path: Path to the MixMHC2pred executable.
     - annovar_outputs_dir: Path to the 'annovar_outputs' directory where .pep file is located.
+    - cache: Optional PredictionCache; only peptides missing from it are sent to MixMHC2pred.
+    - alleles: Alleles to predict (default: read from alleleList_mix.txt).
+    - pep_file: Input .pep file (default: 'mutated_peptide_sequences.pep' in annovar_outputs_dir).
+    - output_dir: Output folder (default: 'MixMHC2pred_outputs' next to annovar_outputs_dir).
+
+    Returns:
+        str: Path of the MixMHC2pred output file.
     """
     # Validate MixMHC2pred path
     mixmhc2pred_executable = os.path.join(mixmhc2pred_path, "MixMHC2pred_unix")
@@ -16,24 +113,28 @@ def trigger_MixMHC2pred(mixmhc2pred_path, annovar_outputs_dir):
         raise ValueError(f"MixMHC2pred executable not found in folder: {mixmhc2pred_path}")
 
     # Define the .pep file and validate its existence
-    pep_file = os.path.join(annovar_outputs_dir, "mutated_peptide_sequences.pep")
+    if pep_file is None:
+        pep_file = os.path.join(annovar_outputs_dir, "mutated_peptide_sequences.pep")
     if not os.path.isfile(pep_file):
-        raise FileNotFoundError(f"No file named 'mutated_peptide_sequences.pep' found in {annovar_outputs_dir}")
+        raise FileNotFoundError(f"No file named '{os.path.basename(pep_file)}' found in {os.path.dirname(pep_file)}")
 
     # Create the MixMHC2pred_outputs folder
-    base_dir = os.path.dirname(annovar_outputs_dir)  # Parent directory of annovar_outputs
-    mixmhc2pred_outputs_dir = os.path.join(base_dir, "MixMHC2pred_outputs")
+    if output_dir is None:
+        base_dir = os.path.dirname(annovar_outputs_dir)  # Parent directory of annovar_outputs
+        output_dir = os.path.join(base_dir, "MixMHC2pred_outputs")
+    mixmhc2pred_outputs_dir = output_dir
     os.makedirs(mixmhc2pred_outputs_dir, exist_ok=True)  # Create the folder if it doesn't exist
 
-    # Locate the alleleList_mix.txt file in the script folder
-    script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    allele_file_path = os.path.join(script_dir, "alleleList_mix.txt")
-    if not os.path.isfile(allele_file_path):
-        raise FileNotFoundError(f"No file named 'alleleList_mix.txt' found in the script folder: {script_dir}")
+    if alleles is None:
+        # Locate the alleleList_mix.txt file in the script folder
+        script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        allele_file_path = os.path.join(script_dir, "alleleList_mix.txt")
+        if not os.path.isfile(allele_file_path):
+            raise FileNotFoundError(f"No file named 'alleleList_mix.txt' found in the script folder: {script_dir}")
 
-    # Read alleles from alleleList_mix.txt
-    with open(allele_file_path, "r") as allele_file:
-        alleles = [line.strip() for line in allele_file if line.strip()]  # Strip whitespace and ignore empty lines
+        # Read alleles from alleleList_mix.txt
+        with open(allele_file_path, "r") as allele_file:
+            alleles = [line.strip() for line in allele_file if line.strip()]  # Strip whitespace and ignore empty lines
     if not alleles:
         raise ValueError(
             "No alleles found in 'alleleList_mix.txt'. Please ensure the file contains valid allele entries.")
@@ -44,11 +145,19 @@ def trigger_MixMHC2pred(mixmhc2pred_path, annovar_outputs_dir):
     # Define the output file in the new directory
     output_file = os.path.join(mixmhc2pred_outputs_dir, "mutated_peptide_sequences_mix_out.txt")
 
-    # Construct the MixMHC2pred command
-    command = f"{mixmhc2pred_executable} -i {pep_file} -o {output_file} -a {alleles_str} --no_context"
+    def run_predictions(run_pep_file, run_output_file):
+        # Construct the MixMHC2pred command
+        command = f"{mixmhc2pred_executable} -i {run_pep_file} -o {run_output_file} -a {alleles_str} --no_context"
+
+        # Print and execute the command
+        print(f"Executing MixMHC2pred command:\n{command}")
+        run_command(command, "MixMHC2pred", input_file=run_pep_file, output_file=run_output_file, alleles=len(alleles))
 
-    # Print and execute the command
-    print(f"Executing MixMHC2pred command:\n{command}")
-    subprocess.run(command, shell=True, check=True)
+    if cache is not None:
+        run_MixMHC2pred_cached(cache, tool_version(mixmhc2pred_path, ("MixMHC2pred_unix",)), pep_file, alleles, output_file,
+                               run_predictions)
+    else:
+        run_predictions(pep_file, output_file)
 
     print(f"MixMHC2pred prediction completed. Output saved to: {output_file}")
+    return output_file
@@ -0,0 +1,177 @@
+import os
+
+# Variant IDs ANNOVAR gives each avinput line ("line1", "line2", ...)
+LINE_ID_PREFIX = "line"
+
+# Leading avinput fields (Chr, Start, End, Ref, Alt) that table_annovar.pl copies into its tables
+AVINPUT_KEY_FIELDS = 5
+
+
+def split_avinput(avinput_file, shard_dir, shard_by="chromosome", block_size=50000):
+    """
+    Split an avinput file into shards by chromosome or into fixed-size variant blocks.
+
+    Parameters:
+        avinput_file (str): avinput file written by convert2annovar.pl.
+        shard_dir (str): Folder for the shard files.
+        shard_by (str): 'chromosome' (one shard per chromosome, in order of first appearance)
+            or 'block' (consecutive blocks of block_size variants).
+        block_size (int): Variants per shard when shard_by is 'block'.
+
+    Returns:
+        list: (shard avinput path, line numbers) per non-empty shard, where line numbers holds
+        the 1-based avinput line number of every shard line (ANNOVAR's lineN IDs).
+    """
+    if shard_by not in ("chromosome", "block"):
+        raise ValueError(f"Unknown ANNOVAR shard mode '{shard_by}'; use 'chromosome' or 'block'.")
+
+    shards = {}
+    shard_key = None
+    with open(avinput_file, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            if shard_by == "block":
+                shard_key = (line_number - 1) // max(1, block_size)
+            elif line.strip():
+                shard_key = line.split("\t", 1)[0]
+            # Blank lines stay with the previous line so the numbering is unchanged
+            shards.setdefault(shard_key, ([], []))
+            shards[shard_key][0].append(line)
+            shards[shard_key][1].append(line_number)
+
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_files = []
+    for index, (lines, line_numbers) in enumerate(shards.values()):
+        shard_file = os.path.join(shard_dir, f"shard_{index}.avinput")
+        with open(shard_file, "w") as f:
+            f.writelines(lines)
+        shard_files.append((shard_file, line_numbers))
+    return shard_files
+
+
+def _global_line_number(line_id, line_numbers):
+    """Map a shard's 'lineN' ID to the avinput line number of the unsharded file."""
+    if not line_id.startswith(LINE_ID_PREFIX) or not line_id[len(LINE_ID_PREFIX):].isdigit():
+        raise ValueError(f"Unexpected ANNOVAR variant ID: {line_id}")
+    return line_numbers[int(line_id[len(LINE_ID_PREFIX):]) - 1]
+
+
+def merge_exonic_variant_functions(shard_files, output_file):
+    """
+    Merge per-shard exonic_variant_function files, renumbering lineN to the unsharded avinput.
+
+    Parameters:
+        shard_files (list): (exonic_variant_function path, line numbers) per shard.
+        output_file (str): Path of the merged file, ordered by line number as in a single run.
+    """
+    records = []
+    for evf_file, line_numbers in shard_files:
+        with open(evf_file, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                line_id, rest = line.split("\t", 1)
+                line_number = _global_line_number(line_id, line_numbers)
+                records.append((line_number, f"{LINE_ID_PREFIX}{line_number}\t{rest}"))
+
+    # Stable sort: several records of one variant keep their order
+    records.sort(key=lambda record: record[0])
+    with open(output_file, "w") as f:
+        f.writelines(line for _, line in records)
+
+
+def _iter_fasta_blocks(fasta_file):
+    """Yield (first header token, record text) for every record of a FASTA file."""
+    with open(fasta_file, "r") as f:
+        block = []
+        for line in f:
+            if line.startswith(">") and block:
+                yield block[0][1:].split(maxsplit=1)[0], block
+                block = []
+            if line.startswith(">") or block:
+                block.append(line)
+        if block:
+            yield block[0][1:].split(maxsplit=1)[0], block
+
+
+def merge_mutated_protein_fastas(shard_files, output_file):
+    """
+    Merge per-shard coding_change.pl FASTA outputs, renumbering lineN to the unsharded avinput.
+
+    Records are ordered by line number; records of one variant (the WILDTYPE and its mutant)
+    keep their order, so the result matches a single coding_change.pl run.
+
+    Parameters:
+        shard_files (list): (FASTA path, line numbers) per shard.
+        output_file (str): Path of the merged FASTA file.
+    """
+    records = []
+    for fasta_file, line_numbers in shard_files:
+        for line_id, block in _iter_fasta_blocks(fasta_file):
+            line_number = _global_line_number(line_id, line_numbers)
+            header = block[0][1 + len(line_id):]
+            records.append((line_number, [f">{LINE_ID_PREFIX}{line_number}{header}"] + block[1:]))
+
+    records.sort(key=lambda record: record[0])
+    with open(output_file, "w") as f:
+        for _, block in records:
+            f.writelines(block)
+
+
+def merge_annotation_tables(shard_files, output_file, key_column=0, has_header=True):
+    """
+    Merge per-shard table_annovar.pl tables without lineN IDs, ordering rows as in a single run.
+
+    Used for the tab-separated hg19_multianno.txt (key_column 0, one header line) and
+    refGene.variant_function (key_column 2, no header). Each row is matched, in order, to
+    the next line of its shard's avinput with the same Chr/Start/End/Ref/Alt fields, so
+    lines ANNOVAR left out (e.g. invalid input) are passed over.
+
+    Parameters:
+        shard_files (list): (table path, shard avinput path, line numbers) per shard; shards
+            without the table are skipped.
+        output_file (str): Path of the merged table.
+        key_column (int): Column holding Chr, followed by Start, End, Ref and Alt.
+        has_header (bool): Whether every table starts with a header line.
+
+    Returns:
+        bool: False when no shard wrote the table (nothing is written).
+    """
+    header = None
+    records = []
+    found = False
+    for table_file, avinput_file, line_numbers in shard_files:
+        if not os.path.isfile(table_file):
+            continue
+        found = True
+        with open(avinput_file, "r") as f:
+            keys = [line.rstrip("\n").split("\t")[:AVINPUT_KEY_FIELDS] for line in f]
+
+        with open(table_file, "r") as f:
+            if has_header:
+                shard_header = f.readline()
+                if header is None:
+                    header = shard_header
+                elif shard_header != header:
+                    raise ValueError(f"Unexpected header in ANNOVAR output: {table_file}")
+
+            position = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                fields = line.rstrip("\n").split("\t")[key_column:key_column + AVINPUT_KEY_FIELDS]
+                while position < len(keys) and keys[position] != fields:
+                    position += 1
+                if position == len(keys):
+                    raise ValueError(f"Row of {table_file} matches no remaining line of {avinput_file}: {line.strip()}")
+                records.append((line_numbers[position], line))
+                position += 1
+
+    if not found:
+        return False
+
+    records.sort(key=lambda record: record[0])
+    with open(output_file, "w") as f:
+        if header is not None:
+            f.write(header)
+        f.writelines(line for _, line in records)
+    return True
@@ -0,0 +1,328 @@
+import mmap
+import os
+import re
+
+# Standard genetic code, codons ordered TTT, TTC, TTA, TTG, TCT, ... GGG
+_BASES = "TCAG"
+_AMINO_ACIDS = "FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"
+CODON_TABLE = {a + b + c: _AMINO_ACIDS[16 * i + 4 * j + k]
+               for i, a in enumerate(_BASES) for j, b in enumerate(_BASES) for k, c in enumerate(_BASES)}
+
+# Bytes removed from sequence lines (line breaks and surrounding whitespace)
+_SEQUENCE_WHITESPACE = b" \t\r\n"
+
+# Residues per line of the FASTA output, as coding_change.pl writes them
+FASTA_LINE_WIDTH = 60
+
+# Header placeholder of a missing cDNA or protein change (fasta_to_dataframe's placeholder too)
+MISSING_FIELD = "NA"
+
+# cDNA changes of exonic_variant_function, in transcript orientation and CDS coordinates
+_SNV = re.compile(r"^c\.([ACGT])(\d+)([ACGT])$")
+_SNV_HGVS = re.compile(r"^c\.(\d+)([ACGT])>([ACGT])$")
+_DELINS = re.compile(r"^c\.(\d+)(?:_(\d+))?delins([ACGT]+)$")
+_DELETION = re.compile(r"^c\.(\d+)(?:_(\d+))?del[ACGT]*$")
+_INSERTION = re.compile(r"^c\.(\d+)_(\d+)ins([ACGT]+)$")
+_DUPLICATION = re.compile(r"^c\.(\d+)(?:_(\d+))?dup([ACGT]+)$")
+
+
+class MrnaIndex:
+    """
+    faidx-style index over a memory-mapped mRNA FASTA (e.g. humandb/hg19_refGeneMrna.fa).
+
+    The index (name, length, offset, line bases, line bytes per record, as in a samtools
+    .fai file) is built once and saved next to the FASTA; later runs only read the index
+    and fetch the transcripts they need, instead of loading the whole reference.
+    """
+
+    def __init__(self, fasta_file, index_file=None):
+        self.fasta_file = fasta_file
+        self.index_file = index_file or f"{fasta_file}.fai"
+        self._file = open(fasta_file, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if (os.path.isfile(self.index_file)
+                and os.path.getmtime(self.index_file) >= os.path.getmtime(fasta_file)):
+            self.entries = self._read_index()
+        else:
+            print(f"Indexing mRNA sequences: {fasta_file}")
+            self.entries = self._build_index()
+            self._write_index()
+
+        # Transcript name -> index keys; ANNOVAR may key records as name#chr#start
+        self.names = {}
+        for key in self.entries:
+            self.names.setdefault(key.split("#", 1)[0], []).append(key)
+
+    def _build_index(self):
+        entries = {}
+        data = self._data
+        start = 0 if data[:1] == b">" else data.find(b"\n>") + 1
+        while 0 < start + 1 <= len(data) and data[start:start + 1] == b">":
+            header_end = data.find(b"\n", start)
+            header_end = len(data) if header_end == -1 else header_end
+            offset = header_end + 1
+            next_start = data.find(b"\n>", offset - 1)
+            end = len(data) if next_start == -1 else next_start + 1
+
+            lines = data[offset:end].split(b"\n")
+            while lines and not lines[-1].strip():
+                lines.pop()
+            line_bytes = len(lines[0]) + 1 if lines else 0
+            line_bases = len(lines[0].rstrip(b"\r")) if lines else 0
+            length = sum(len(line.rstrip(b"\r")) for line in lines)
+            # Records with uneven line lengths are fetched by scanning to the next header
+            if any(len(line) + 1 != line_bytes for line in lines[:-1]) or (lines and len(lines[-1]) + 1 > line_bytes):
+                line_bases = line_bytes = 0
+
+            name = data[start + 1:header_end].split(maxsplit=1)[0].decode() if header_end > start + 1 else ""
+            if name and name not in entries:
+                entries[name] = (length, offset, line_bases, line_bytes)
+            start = end if next_start != -1 else len(data)
+        return entries
+
+    def _read_index(self):
+        entries = {}
+        with open(self.index_file, "r") as f:
+            for line in f:
+                name, length, offset, line_bases, line_bytes = line.rstrip("\n").split("\t")
+                entries[name] = (int(length), int(offset), int(line_bases), int(line_bytes))
+        return entries
+
+    def _write_index(self):
+        try:
+            with open(self.index_file, "w") as f:
+                for name, entry in self.entries.items():
+                    f.write("\t".join([name] + [str(value) for value in entry]) + "\n")
+        except OSError:
+            print(f"Cannot write the mRNA index {self.index_file}; it will be rebuilt next time.")
+
+    def resolve(self, transcript, chromosome=None):
+        """Return the index key of a transcript, preferring records on the given chromosome."""
+        keys = self.names.get(transcript, [])
+        if len(keys) > 1 and chromosome is not None:
+            on_chromosome = [key for key in keys if f"#{chromosome}#" in key or f"#chr{chromosome}#" in key]
+            keys = on_chromosome or keys
+        return keys[0] if keys else None
+
+    def fetch(self, key):
+        """Return the sequence of one indexed record (upper case)."""
+        length, offset, line_bases, line_bytes = self.entries[key]
+        if line_bases:
+            end = offset + (length // line_bases) * line_bytes + length % line_bases
+        else:
+            end = self._data.find(b"\n>", offset - 1)
+            end = len(self._data) if end == -1 else end
+        return self._data[offset:end].translate(None, _SEQUENCE_WHITESPACE).decode().upper()
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+
+def read_refgene(refgene_file, transcripts):
+    """
+    Read the refGene records of the given transcripts.
+
+    Returns:
+        dict: Transcript -> list of (chromosome, CDS start, CDS end) with the CDS given as
+        1-based positions in the spliced mRNA (transcript orientation).
+    """
+    records = {}
+    with open(refgene_file, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 11 or fields[1] not in transcripts:
+                continue
+            name, chromosome, strand = fields[1], fields[2], fields[3]
+            cds_start, cds_end = int(fields[6]), int(fields[7])
+            exon_starts = [int(x) for x in fields[9].strip(",").split(",")]
+            exon_ends = [int(x) for x in fields[10].strip(",").split(",")]
+            if cds_start >= cds_end:  # Non-coding transcript
+                continue
+
+            # Spliced (0-based) mRNA offsets of the genomic CDS boundaries, left to right
+            exonic_before = 0
+            left = right = None
+            for exon_start, exon_end in zip(exon_starts, exon_ends):
+                if left is None and exon_start <= cds_start < exon_end:
+                    left = exonic_before + cds_start - exon_start
+                if right is None and exon_start < cds_end <= exon_end:
+                    right = exonic_before + cds_end - exon_start
+                exonic_before += exon_end - exon_start
+            if left is None or right is None:
+                continue
+
+            if strand == "-":
+                left, right = exonic_before - right, exonic_before - left
+            records.setdefault(name, []).append((chromosome, left + 1, right))
+    return records
+
+
+def translate(dna):
+    """Translate DNA codon by codon up to and including the first stop codon ('X' for unknown codons)."""
+    protein = []
+    for i in range(0, len(dna) - 2, 3):
+        amino_acid = CODON_TABLE.get(dna[i:i + 3], "X")
+        protein.append(amino_acid)
+        if amino_acid == "*":
+            break
+    return "".join(protein)
+
+
+def parse_cdna_change(cchange):
+    """
+    Parse an exonic_variant_function cDNA change into a CDS edit.
+
+    Returns:
+        tuple: (start, end, replacement, reference) with 1-based inclusive CDS positions of the
+        replaced bases (end = start - 1 for insertions after start - 1), or None if unsupported.
+    """
+    if match := _SNV.match(cchange):
+        return int(match[2]), int(match[2]), match[3], match[1]
+    if match := _SNV_HGVS.match(cchange):
+        return int(match[1]), int(match[1]), match[3], match[2]
+    if match := _DELINS.match(cchange):
+        return int(match[1]), int(match[2] or match[1]), match[3], None
+    if match := _DELETION.match(cchange):
+        return int(match[1]), int(match[2] or match[1]), "", None
+    if match := _INSERTION.match(cchange):
+        return int(match[1]) + 1, int(match[1]), match[3], None
+    if match := _DUPLICATION.match(cchange):
+        position = int(match[2] or match[1])
+        return position + 1, position, match[3], None
+    return None
+
+
+def describe_change(wildtype, mutant, frameshift):
+    """
+    Classify a mutant protein against its wildtype and describe the change like coding_change.pl.
+
+    Returns:
+        tuple: (mutation type, description), e.g. ('protein-altering', 'position 10 changed from G to D'),
+        or ('silent', '') when the proteins are identical.
+    """
+    if wildtype == mutant:
+        return "silent", ""
+
+    prefix = 0
+    while prefix < min(len(wildtype), len(mutant)) and wildtype[prefix] == mutant[prefix]:
+        prefix += 1
+    position = prefix + 1
+
+    if prefix < len(mutant) and mutant[prefix] == "*":
+        wildtype_residue = wildtype[prefix] if prefix < len(wildtype) else ""
+        return "immediate-stopgain", f"position {position} changed from {wildtype_residue} to *"
+
+    # Frameshifts and changes of the stop codon: the whole tails from the first difference
+    if frameshift or prefix >= len(wildtype) - 1:
+        return "protein-altering", (f"position {position}-{len(wildtype)} changed from "
+                                    f"{wildtype[prefix:]} to {mutant[prefix:]}")
+
+    suffix = 0
+    while (suffix < min(len(wildtype), len(mutant)) - prefix
+           and wildtype[len(wildtype) - 1 - suffix] == mutant[len(mutant) - 1 - suffix]):
+        suffix += 1
+    wildtype_segment = wildtype[prefix:len(wildtype) - suffix]
+    mutant_segment = mutant[prefix:len(mutant) - suffix]
+
+    if not wildtype_segment:
+        return "protein-altering", f"position {prefix}-{prefix + 1} has insertion {mutant_segment}"
+    if len(wildtype_segment) == 1:
+        return "protein-altering", f"position {position} changed from {wildtype_segment} to {mutant_segment}"
+    return "protein-altering", (f"position {position}-{prefix + len(wildtype_segment)} changed from "
+                                f"{wildtype_segment} to {mutant_segment}")
+
+
+def _strip_chr(chromosome):
+    return chromosome[3:] if chromosome.startswith("chr") else chromosome
+
+
+def _write_record(f, header, protein):
+    f.write(f">{header}\n")
+    for i in range(0, len(protein), FASTA_LINE_WIDTH):
+        f.write(protein[i:i + FASTA_LINE_WIDTH] + "\n")
+
+
+def run_coding_change(exonic_variant_function, refgene_file, mrna_fasta, fasta_output,
+                      include_snp=True, only_altering=True):
+    """
+    In-process replacement for `coding_change.pl ... -includesnp -onlyAltering`.
+
+    Only the transcripts named in exonic_variant_function are read: their refGene records
+    are picked from refgene_file while streaming it, and their mRNA sequences are fetched
+    through the faidx-style index of the memory-mapped mrna_fasta (see MrnaIndex). Each
+    variant is applied to the spliced mRNA and translated; the output holds a WILDTYPE and
+    a mutant record per (variant, transcript) as read by fasta_to_dataframe.
+
+    Parameters:
+        exonic_variant_function (str): table_annovar.pl exonic_variant_function file.
+        refgene_file (str): humandb/hg19_refGene.txt.
+        mrna_fasta (str): humandb/hg19_refGeneMrna.fa.
+        fasta_output (str): Path of the mutated protein FASTA file.
+        include_snp (bool): Also process SNVs (-includesnp).
+        only_altering (bool): Skip variants that leave the protein unchanged (-onlyAltering).
+
+    Returns:
+        str: fasta_output.
+    """
+    # Step 1: Collect (line, transcript, cDNA change, protein change, chromosome) per annotation
+    annotations = []
+    with open(exonic_variant_function, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4 or fields[1].startswith("unknown"):
+                continue
+            if not include_snp and "SNV" in fields[1]:
+                continue
+            for annotation in fields[2].strip(",").split(","):
+                parts = annotation.split(":")
+                if len(parts) < 4:
+                    continue
+                protein_change = parts[4] if len(parts) > 4 else ""
+                annotations.append((fields[0], parts[1], parts[3], protein_change, fields[3]))
+
+    transcripts = {annotation[1] for annotation in annotations}
+    refgene = read_refgene(refgene_file, transcripts)
+    mrna_index = MrnaIndex(mrna_fasta)
+    sequences = {}
+
+    # Step 2: Apply, translate and write every annotation in file order
+    n_written = 0
+    with open(fasta_output, "w") as out:
+        for line_id, transcript, cchange, pchange, chromosome in annotations:
+            edit = parse_cdna_change(cchange)
+            key = mrna_index.resolve(transcript, chromosome)
+            records = refgene.get(transcript, [])
+            if edit is None or key is None or not records:
+                print(f"WARNING: Skipping {line_id} {transcript} {cchange} (unsupported change or unknown transcript)")
+                continue
+            chromosome_records = [record for record in records if _strip_chr(record[0]) == _strip_chr(chromosome)]
+            _, cds_start, cds_end = (chromosome_records or records)[0]
+
+            if key not in sequences:
+                sequences[key] = mrna_index.fetch(key)
+            mrna = sequences[key]
+
+            start, end, replacement, reference = edit
+            left, right = cds_start - 1 + start - 1, cds_start - 1 + end
+            if right > len(mrna) or (reference is not None and mrna[left:right] != reference):
+                print(f"WARNING: Skipping {line_id} {transcript} {cchange} (reference mismatch)")
+                continue
+
+            wildtype = translate(mrna[cds_start - 1:cds_end])
+            mutant = translate(mrna[cds_start - 1:left] + replacement + mrna[right:])
+            frameshift = (len(replacement) - (end - start + 1)) % 3 != 0
+            mutation_type, description = describe_change(wildtype, mutant, frameshift)
+            if mutation_type == "silent" and only_altering:
+                continue
+
+            _write_record(out, f"{line_id} {transcript} WILDTYPE", wildtype)
+            # Every field is always written: fasta_to_dataframe reads the header by position
+            header = " ".join(part or MISSING_FIELD for part in (line_id, transcript, cchange, pchange, mutation_type))
+            _write_record(out, f"{header} ({description})" if description else header, mutant)
+            n_written += 1
+
+    mrna_index.close()
+    print(f"Translated {n_written} of {len(annotations)} variant transcripts into: {fasta_output}")
+    return fasta_output
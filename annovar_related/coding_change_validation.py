@@ -0,0 +1,183 @@
+import os
+import random
+import subprocess
+
+import pandas as pd
+
+from annovar_related.coding_change import CODON_TABLE, translate, run_coding_change
+from annovar_related.fasta_to_df import fasta_to_dataframe
+
+_SENSE_CODONS = [codon for codon, amino_acid in CODON_TABLE.items() if amino_acid != "*"]
+
+
+def _synthetic_transcript(rng, index):
+    """One random multi-exon coding transcript: (refGene fields, spliced mRNA, CDS start, CDS end)."""
+    utr5 = "".join(rng.choice("ACGT") for _ in range(rng.randint(5, 40)))
+    cds = "ATG" + "".join(rng.choice(_SENSE_CODONS) for _ in range(rng.randint(60, 200))) + rng.choice(["TAA", "TAG", "TGA"])
+    utr3 = "".join(rng.choice("ACGT") for _ in range(rng.randint(30, 120)))
+    mrna = utr5 + cds + utr3
+    cds_start, cds_end = len(utr5), len(utr5) + len(cds)  # 0-based, end exclusive
+
+    # Cut the mRNA into exons placed left to right on the genome
+    cuts = sorted(rng.sample(range(1, len(mrna)), rng.randint(0, 4)))
+    exon_lengths = [b - a for a, b in zip([0] + cuts, cuts + [len(mrna)])]
+    strand = rng.choice("+-")
+    if strand == "-":
+        exon_lengths = exon_lengths[::-1]
+    tx_start = position = rng.randint(1000, 10 ** 7)
+    exon_starts, exon_ends = [], []
+    for length in exon_lengths:
+        exon_starts.append(position)
+        exon_ends.append(position + length)
+        position += length + rng.randint(50, 500)
+
+    def genomic(offset):
+        # Genomic coordinate of a 0-based spliced offset counted left to right
+        for exon_start, exon_end in zip(exon_starts, exon_ends):
+            if offset < exon_end - exon_start:
+                return exon_start + offset
+            offset -= exon_end - exon_start
+        return exon_ends[-1]
+
+    if strand == "+":
+        genomic_cds = (genomic(cds_start), genomic(cds_end - 1) + 1)
+    else:
+        genomic_cds = (genomic(len(mrna) - cds_end), genomic(len(mrna) - cds_start - 1) + 1)
+
+    name = f"NM_{900000 + index}"
+    fields = [str(index), name, f"chr{rng.randint(1, 22)}", strand, str(tx_start), str(exon_ends[-1]),
+              str(genomic_cds[0]), str(genomic_cds[1]), str(len(exon_starts)),
+              ",".join(map(str, exon_starts)) + ",", ",".join(map(str, exon_ends)) + ",",
+              "0", f"GENE{index}", "cmpl", "cmpl", "0"]
+    return fields, mrna, cds_start, cds_end
+
+
+def _first_difference(protein, mutant):
+    return next((i for i, (a, b) in enumerate(zip(protein, mutant)) if a != b), min(len(protein), len(mutant)) - 1)
+
+
+def _synthetic_variant(rng, cds):
+    """A random SNV, in-frame or frameshift indel of a CDS: (cDNA change, protein change)."""
+    protein = translate(cds)
+    n_codons = len(cds) // 3 - 1
+    codon = rng.randint(2, n_codons)
+    kind = rng.choice(["snv", "snv", "deletion", "insertion", "frameshift_deletion", "frameshift_insertion", "dup"])
+
+    if kind == "snv":
+        position = 3 * (codon - 1) + rng.randint(1, 3)
+        reference = cds[position - 1]
+        observed = rng.choice([base for base in "ACGT" if base != reference])
+        mutant = translate(cds[:position - 1] + observed + cds[position:])
+        return f"c.{reference}{position}{observed}", f"p.{protein[codon - 1]}{codon}{mutant[codon - 1]}"
+    # In-frame indels are named at their 3'-most equivalent residue, as in HGVS
+    if kind == "deletion":
+        start = 3 * (codon - 1) + 1
+        first = _first_difference(protein, translate(cds[:start - 1] + cds[start + 2:]))
+        return f"c.{start}_{start + 2}del", f"p.{protein[first]}{first + 1}del"
+    if kind == "insertion":
+        inserted = rng.choice(_SENSE_CODONS)
+        position = 3 * codon
+        mutant = translate(cds[:position] + inserted + cds[position:])
+        first = _first_difference(protein, mutant)
+        return (f"c.{position}_{position + 1}ins{inserted}",
+                f"p.{protein[first - 1]}{first}_{protein[first]}{first + 1}ins{mutant[first]}")
+
+    position = 3 * (codon - 1) + rng.randint(1, 3)
+    if kind == "frameshift_deletion":
+        cchange, mutant_cds = f"c.{position}del{cds[position - 1]}", cds[:position - 1] + cds[position:]
+    elif kind == "dup":
+        cchange, mutant_cds = f"c.{position}dup{cds[position - 1]}", cds[:position] + cds[position - 1:]
+    else:
+        inserted = rng.choice("ACGT")
+        cchange, mutant_cds = f"c.{position}_{position + 1}ins{inserted}", cds[:position] + inserted + cds[position:]
+    mutant = translate(mutant_cds)
+    first = _first_difference(protein, mutant)
+    return cchange, f"p.{protein[first]}{first + 1}{mutant[first]}fs*{len(mutant) - first}"
+
+
+def write_synthetic_reference(output_dir, n_transcripts=50, n_variants=200, seed=0):
+    """
+    Write a small synthetic ANNOVAR reference and exonic_variant_function file.
+
+    The transcripts are random multi-exon genes on both strands; the variants are SNVs,
+    in-frame indels, frameshifts and duplications in transcript (cDNA) coordinates.
+
+    Returns:
+        dict: Paths of 'refgene', 'mrna' and 'exonic_variant_function'.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {
+        "refgene": os.path.join(output_dir, "synthetic_refGene.txt"),
+        "mrna": os.path.join(output_dir, "synthetic_refGeneMrna.fa"),
+        "exonic_variant_function": os.path.join(output_dir, "synthetic.refGene.exonic_variant_function"),
+    }
+
+    transcripts = [_synthetic_transcript(rng, index) for index in range(n_transcripts)]
+    with open(paths["refgene"], "w") as refgene, open(paths["mrna"], "w") as mrna_file:
+        for fields, mrna, _, _ in transcripts:
+            refgene.write("\t".join(fields) + "\n")
+            mrna_file.write(f">{fields[1]} leftmost exon at {fields[2]}:{int(fields[4]) + 1}\n")
+            for i in range(0, len(mrna), 60):
+                mrna_file.write(mrna[i:i + 60] + "\n")
+
+    with open(paths["exonic_variant_function"], "w") as f:
+        for line in range(1, n_variants + 1):
+            fields, mrna, cds_start, cds_end = rng.choice(transcripts)
+            cchange, pchange = _synthetic_variant(rng, mrna[cds_start:cds_end])
+            if "fs" in pchange:
+                kind = "frameshift"
+            elif cchange[2].isalpha():
+                kind = "synonymous SNV" if pchange[2] == pchange[-1] else "nonsynonymous SNV"
+            else:
+                kind = "nonframeshift"
+            annotation = f"{fields[12]}:{fields[1]}:exon1:{cchange}:{pchange},"
+            f.write(f"line{line}\t{kind}\t{annotation}\t{fields[2]}\t1\t1\t-\t-\n")
+    return paths
+
+
+def compare_coding_change_outputs(expected_fasta, actual_fasta):
+    """
+    Compare two coding_change FASTA outputs record by record.
+
+    Returns:
+        pd.DataFrame: The records that differ (missing on one side, or with a different
+        header field or protein sequence), with '_expected' / '_actual' columns.
+    """
+    def records(fasta_file):
+        df = fasta_to_dataframe(fasta_file)
+        df["Record"] = df.groupby(["Variant ID", "Transcript ID"]).cumcount()
+        return df
+
+    keys = ["Variant ID", "Transcript ID", "Record"]
+    merged = records(expected_fasta).merge(records(actual_fasta), on=keys, how="outer",
+                                           suffixes=("_expected", "_actual"), indicator=True)
+    columns = ["cDNA Change", "Protein Change", "Mutation Type", "Description", "Protein Sequence"]
+    differs = merged["_merge"] != "both"
+    for column in columns:
+        differs |= merged[f"{column}_expected"].astype(str) != merged[f"{column}_actual"].astype(str)
+    return merged[differs]
+
+
+def validate_coding_change(annovar_path, output_dir, n_transcripts=50, n_variants=200, seed=0):
+    """
+    Check the Python coding change engine against ANNOVAR's coding_change.pl on a synthetic reference.
+
+    Returns:
+        pd.DataFrame: Differing records (empty when both engines agree).
+    """
+    paths = write_synthetic_reference(output_dir, n_transcripts, n_variants, seed)
+    perl_fasta = os.path.join(output_dir, "coding_change_pl.fasta")
+    python_fasta = os.path.join(output_dir, "coding_change_py.fasta")
+
+    coding_change = os.path.join(annovar_path, "coding_change.pl")
+    command = (f"perl {coding_change} {paths['exonic_variant_function']} {paths['refgene']} {paths['mrna']} "
+               f"-includesnp -onlyAltering > {perl_fasta}")
+    print(f"Executing command:\n{command}")
+    subprocess.run(command, shell=True, check=True)
+    run_coding_change(paths["exonic_variant_function"], paths["refgene"], paths["mrna"], python_fasta)
+
+    differences = compare_coding_change_outputs(perl_fasta, python_fasta)
+    n_records = len(pd.concat([fasta_to_dataframe(perl_fasta), fasta_to_dataframe(python_fasta)]))
+    print(f"{len(differences)} differing records out of {n_records} (coding_change.pl + Python engine).")
+    return differences
@@ -1,16 +1,17 @@
+from annovar_related.variant_table import ensure_variant_table, select_variants
+
+
 def filter_immediate_stopgain(input_df):
     """
-    Function to remove rows with 'immediate-stopgain' and their preceding rows.
+    Function to remove rows with 'immediate-stopgain' and their paired WILDTYPE rows.
     """
-    # Create a copy
-    filtered_df = input_df.copy()
-
-    for index, row in filtered_df.iterrows():
-        if row["Mutation Type"] == "immediate-stopgain":
-            filtered_df.drop(index, inplace=True)
-            filtered_df.drop(index - 1, inplace=True)
+    variant_df = ensure_variant_table(input_df)
 
-    # Reset the index of the modified DataFrame
-    filtered_df.reset_index(drop=True, inplace=True)
+    # Mask the stop-gain mutants and the wildtype records they are paired with
+    stopgain = (variant_df["Mutation Type"] == "immediate-stopgain").to_numpy()
+    drop = stopgain.copy()
+    paired_wildtypes = variant_df.loc[stopgain, "Wildtype Index"].dropna()
+    drop[paired_wildtypes.to_numpy(dtype=int)] = True
 
-    return filtered_df
+    # Keep the rest with a fresh index and renumbered wildtype references
+    return select_variants(variant_df, ~drop)
@@ -1,33 +1,90 @@
+import mmap
+
 import pandas as pd
 
+FASTA_COLUMNS = ["Variant ID", "Transcript ID", "cDNA Change",
+                 "Protein Change", "Mutation Type", "Description",
+                 "Protein Sequence"]
+
+HEADER_COLUMNS = FASTA_COLUMNS[:-1]
+
+# Few distinct values, each repeated on many records (every transcript has a WILDTYPE and a mutant record)
+CATEGORICAL_COLUMNS = ["Transcript ID", "Mutation Type"]
+
+# Bytes removed from sequence lines (line breaks and surrounding whitespace)
+_SEQUENCE_WHITESPACE = b" \t\r\n"
+
+
+def _iter_fasta_records(fasta_file):
+    """
+    Yield (header, sequence) byte strings from a FASTA file.
+
+    The file is memory-mapped and split on record boundaries with bytes.find, so
+    sequence lines are never handled one by one in Python.
+    """
+    with open(fasta_file, "rb") as fasta:
+        try:
+            data = mmap.mmap(fasta.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            return
+
+        with data:
+            start = 0 if data[:1] == b">" else data.find(b"\n>")
+            if start == -1:
+                return
+            if data[start:start + 1] == b"\n":
+                start += 1
+
+            size = len(data)
+            while start < size:
+                next_start = data.find(b"\n>", start)
+                end = size if next_start == -1 else next_start + 1
+
+                header_end = data.find(b"\n", start, end)
+                if header_end == -1:
+                    header_end = end
+                header = data[start + 1:header_end].strip()
+                sequence = data[header_end:end].translate(None, _SEQUENCE_WHITESPACE)
+
+                yield header, sequence
+                start = end
+
+
+def _parse_header(header):
+    """Split an ANNOVAR coding_change.pl header into the six header columns."""
+    header = header.decode()
+    if "WILDTYPE" in header:
+        fields = header.split()
+        empty = "NA"
+        return [fields[0], fields[1], empty, empty, fields[2], empty]
+
+    fields = header.split(maxsplit=5)
+    return fields + ["NA"] * (len(HEADER_COLUMNS) - len(fields))
+
+
 def fasta_to_dataframe(fasta_file):
-    data = []
-    identifier = ""
-    sequence = []
-
-    with open(fasta_file, 'r') as fasta:
-        for line in fasta:
-            line = line.strip()
-            if line.startswith(">"):
-                if "WILDTYPE" not in line:
-                    if identifier:
-                        data.append(identifier + [''.join(sequence)])
-                    identifier = line[1:].split(maxsplit=5)
-                    sequence = []
-                elif "WILDTYPE" in line:
-                    if identifier:
-                        data.append(identifier + [''.join(sequence)])
-                    identifier = line[1:].split()
-                    empty = "NA"
-                    identifier = [identifier[0], identifier[1], empty, empty, identifier[2], empty]
-                    sequence = []
-            else:
-                sequence.append(line)
-
-        if identifier:
-            data.append(identifier + [''.join(sequence)])
-
-    df = pd.DataFrame(data, columns=["Variant ID", "Transcript ID", "cDNA Change",
-                                     "Protein Change", "Mutation Type", "Description",
-                                     "Protein Sequence"])
-    return df
\ No newline at end of file
+    """
+    Read an ANNOVAR mutated_proteins.fasta file into a DataFrame in a single pass.
+
+    Header fields are collected column by column and each sequence is decoded once,
+    straight into the column later stages read it from; the CATEGORICAL_COLUMNS are
+    stored as categoricals.
+
+    Parameters:
+        fasta_file (str): Path to the FASTA file written by coding_change.pl.
+
+    Returns:
+        pd.DataFrame: One row per record with the FASTA_COLUMNS columns.
+    """
+    header_columns = [[] for _ in HEADER_COLUMNS]
+    sequences = []
+    for header, sequence in _iter_fasta_records(fasta_file):
+        for column, value in zip(header_columns, _parse_header(header)):
+            column.append(value)
+        sequences.append(sequence.decode())
+
+    data = dict(zip(HEADER_COLUMNS, header_columns))
+    for name in CATEGORICAL_COLUMNS:
+        data[name] = pd.Categorical(data[name])
+    data["Protein Sequence"] = sequences
+    return pd.DataFrame(data, columns=FASTA_COLUMNS)
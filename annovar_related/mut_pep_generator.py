@@ -1,95 +1,245 @@
+import hashlib
 import random
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
-import re
 
-def mut_pep_generator(input_df):
-    insertion_count = 0
-    deletion_count = 0
-    frameshift_count = 0
-    replacement_count = 0
-
-    input_df = input_df.copy()
-    input_df["mutate_peptide_list"] = None
+from annovar_related.variant_table import ensure_variant_table
+from annovar_related.peptide_windows import window_arrays
+from annovar_related.wildtype_index import windows_in_wildtype
+from annovar_related.window_engine import (encode_sequence, spanning_windows, frameshift_windows,
+                                           windows_containing, materialise_window_starts,
+                                           tile_core_windows, core_coverage)
+
+# How frameshift tails (and insertions of at least core_length residues) are cut into peptides:
+# 'tile' = fewest windows covering every novel binding core, 'sample' = 30 random starts per length
+WINDOW_MODES = ("tile", "sample")
+
+COVERAGE_COLUMNS = ["Variant ID", "Transcript ID", "Mutation Class", "Protein Change", "Novel Cores",
+                    "Peptides", "Min Coverage", "Mean Coverage", "Cores Below Target"]
+
+
+def variant_seed(variant_id, transcript_id, protein_change, seed=0):
+    """
+    Derive a stable RNG seed for one variant from its IDs and the run-level seed.
+
+    Uses SHA-256 rather than hash() so the seed is the same in every process and run.
+    """
+    key = f"{seed}:{variant_id}:{transcript_id}:{protein_change}".encode()
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], "big")
+
+
+def novel_core_starts(sequence, region_start, region_end, wildtype_sequence, core_length=9):
+    """
+    Starts of the binding cores a changed region creates.
+
+    A core is novel when it overlaps the region [region_start, region_end) of the mutant
+    sequence (so cores across the junction count) and does not occur in the wildtype.
+    Every peptide holding a novel core is itself absent from the wildtype.
+
+    Returns:
+        np.ndarray: Sorted 0-based core starts in the mutant sequence.
+    """
+    first = max(0, region_start - core_length + 1)
+    last = min(region_end, len(sequence) - core_length + 1)
+    candidates = np.arange(first, max(first, last), dtype=np.int64)
+    return candidates[~windows_in_wildtype(sequence, candidates, candidates + core_length, wildtype_sequence, core_length)]
+
+
+def parse_protein_change(mutation_class, protein_change):
+    """
+    Parse the mutation position out of an ANNOVAR protein change.
+
+    Returns:
+        tuple: (position, detail) where detail is the inserted sequence of an insertion and the
+        tail length of a frameshift (None otherwise), or None when the protein change cannot be
+        parsed (e.g. 'NA' when ANNOVAR gave none).
+    """
+    try:
+        # Insertion p.Q183_R184insQ: position 183, inserted sequence
+        if mutation_class == "insertion":
+            mutation_info = protein_change.split('ins')
+            return int(mutation_info[0].split('_')[0][3:]), mutation_info[1]
+        # Deletion p.E710del: 0-based index
+        if mutation_class == "deletion":
+            return int(protein_change.split('del')[0][3:]) - 1, None
+        # Frameshift p.Y32Cfs*18: 0-based index, tail length
+        if mutation_class == "frameshift":
+            return int(protein_change.split('fs')[0][3:-1]) - 1, int(protein_change.split('*')[1])
+        # Replacement p.G300D: 0-based index
+        return int(protein_change.split('.')[1][1:-1]) - 1, None
+    except (ValueError, IndexError, AttributeError):
+        return None
+
+
+def _generate_variant_peptides(task):
+    """
+    Generate the novel peptides of a single protein-altering variant.
+
+    Module-level so it can be sent to worker processes; the result depends only on
+    the task itself, never on which worker runs it.
+
+    Returns:
+        tuple: (starts, lengths) arrays locating each novel peptide in the mutant sequence,
+        and the core coverage of a tiled variant (None when it was not tiled).
+    """
+    (mutation_class, (pos, detail), sequence, wildtype_sequence, rng_seed, min_length, max_length,
+     window_mode, min_core_coverage, core_length) = task
+    core_starts = None
+
+    # Insertion p.Q183_R184insQ
+    if mutation_class == "insertion":
+        inserted_sequence = detail  # AGDF
+        if window_mode == "tile" and len(inserted_sequence) >= core_length:
+            # Long insertion: cover its novel cores instead of requiring the whole insertion
+            core_starts = novel_core_starts(sequence, pos, pos + len(inserted_sequence), wildtype_sequence, core_length)
+            starts, ends = tile_core_windows(core_starts, len(sequence), min_length, max_length,
+                                             min_core_coverage, core_length)
+        else:
+            starts, ends = spanning_windows(pos, len(sequence), min_length, max_length)
+
+            # Check if all insertion part in seq
+            contains_insertion = windows_containing(encode_sequence(sequence), inserted_sequence, starts, ends)
+            starts, ends = starts[contains_insertion], ends[contains_insertion]
+
+    # Deletion p.E710del
+    elif mutation_class == "deletion":
+        starts, ends = spanning_windows(pos, len(sequence), min_length, max_length)
+
+    # Frameshift p.Y32Cfs*18
+    elif mutation_class == "frameshift":
+        mut_length = detail
+        if window_mode == "tile":
+            # Fewest windows putting every novel core of the tail (and junction) in min_core_coverage peptides
+            core_starts = novel_core_starts(sequence, pos, pos + mut_length, wildtype_sequence, core_length)
+            starts, ends = tile_core_windows(core_starts, len(sequence), min_length, max_length,
+                                             min_core_coverage, core_length)
+        else:
+            # Exhaustive search inside the frameshift tail, sample 30 starts per length when longer
+            starts, ends = frameshift_windows(pos, mut_length, len(sequence), min_length, max_length,
+                                              rng=random.Random(rng_seed))
+
+    # Replacement p.G300D
+    else:
+        starts, ends = spanning_windows(pos, len(sequence), min_length, max_length)
+
+    # Drop windows found in the wildtype before slicing out the remaining peptides
+    novel = ~windows_in_wildtype(sequence, starts, ends, wildtype_sequence, min_length)
+    peptides = materialise_window_starts(sequence, starts[novel], ends[novel])
+    starts, lengths = window_arrays(list(peptides.values()), [len(peptide) for peptide in peptides])
+
+    coverage = None
+    if core_starts is not None:
+        covered = core_coverage(core_starts, starts, starts.astype(np.int64) + lengths, core_length)
+        coverage = {"Novel Cores": len(core_starts), "Peptides": len(starts),
+                    "Min Coverage": int(covered.min()) if len(covered) else 0,
+                    "Mean Coverage": round(float(covered.mean()), 2) if len(covered) else 0.0,
+                    "Cores Below Target": int((covered < min_core_coverage).sum())}
+    return starts, lengths, coverage
+
+
+def mut_pep_generator(input_df, min_length=12, max_length=25, n_workers=1, seed=0, window_mode="sample",
+                      min_core_coverage=2, core_length=9, coverage_file=None):
+    """
+    Generate the mutated peptides spanning each protein-altering mutation.
+
+    Windows are enumerated for all peptide lengths at once by the NumPy window engine;
+    peptides that also occur in the paired wildtype protein (see build_variant_table)
+    are dropped.
+
+    By default (window_mode='sample') frameshift windows are sampled at random, with a
+    per-variant RNG seeded from the variant ID so the output is identical whatever the number
+    of workers. With window_mode='tile', frameshift tails and insertions of at least
+    core_length residues are tiled instead: the fewest windows are chosen so that every novel
+    core_length-mer (one overlapping the new residues and absent from the wildtype) lies in at
+    least min_core_coverage peptides (see window_engine.tile_core_windows).
+
+    Parameters:
+        input_df (pd.DataFrame): Variant table produced by build_variant_table/filter_immediate_stopgain.
+        min_length (int): Shortest peptide length to generate.
+        max_length (int): Longest peptide length to generate.
+        n_workers (int): Number of worker processes; 1 runs in the current process.
+        seed (int): Run-level seed combined with each variant ID for frameshift sampling.
+        window_mode (str): 'tile' or 'sample' (see WINDOW_MODES).
+        min_core_coverage (int): Peptides each novel core should appear in when tiling.
+        core_length (int): Binding core length used for tiling.
+        coverage_file (str): Optional CSV receiving the core coverage of every tiled variant
+            (COVERAGE_COLUMNS).
+
+    Returns:
+        pd.DataFrame: Copy of input_df with 'peptide_starts' and 'peptide_lengths' columns holding,
+        per protein-altering record, each peptide's 0-based start in 'Protein Sequence' and its
+        length as integer arrays (see annovar_related.peptide_windows; the strings are sliced
+        out only when needed).
+    """
+    if window_mode not in WINDOW_MODES:
+        raise ValueError(f"Unknown window mode '{window_mode}'; use one of {WINDOW_MODES}.")
+    input_df = ensure_variant_table(input_df).copy()
     input_df["Protein Sequence"] = input_df["Protein Sequence"].str.rstrip('*')
 
-    for index, row in input_df.iterrows():
-        pep_list = []
-        if row["Mutation Type"] == "protein-altering":
-            # Insertion p.Q183_R184insQ
-            if 'ins' in row['Protein Change']:
-                insertion_count += 1
-
-                mutation_info = row["Protein Change"].split('ins')
-                position_range = mutation_info[0]  # Q183_R184
-                inserted_sequence = mutation_info[1]  # AGDF
-
-                pos = int(position_range.split('_')[0][3:])  # 183
-
-                for peptide_length in range(12, 26):
-                    for offset in range(peptide_length):
-                        start = pos - peptide_length + offset
-                        end = pos + offset
-                        peptide = input_df.loc[index, "Protein Sequence"][start:end]
-
-                        if (len(peptide) >= 12
-                            and inserted_sequence in peptide # Check if all insertion part in seq
-                            and peptide not in input_df.loc[index - 1, "Protein Sequence"] # Check duplication
-                        ):
-                            pep_list.append(peptide)
-                input_df.at[index, "mutate_peptide_list"] = pd.Series(pep_list).unique().tolist()
-
-            # Deletion p.E710del
-            elif 'del' in row['Protein Change']:
-                deletion_count += 1
-                pos = int(row["Protein Change"].split('del')[0][3:]) - 1  # get index
-                for peptide_length in range(12, 26):
-                    for offset in range(peptide_length):
-                        peptide = input_df.loc[index, "Protein Sequence"][pos - peptide_length + offset: pos + offset]
-                        if len(peptide) >= 12 and peptide not in input_df.loc[index - 1, "Protein Sequence"]:
-                            pep_list.append(peptide)
-                input_df.at[index, "mutate_peptide_list"] = pd.Series(pep_list).unique().tolist()
-
-            # Frameshift p.Y32Cfs*18
-            elif 'fs' in row['Protein Change']:
-                frameshift_count += 1
-                pos = int(row["Protein Change"].split('fs')[0][3:-1]) - 1
-                mut_length = int(row["Protein Change"].split('*')[1])
-                for peptide_length in range(12, 26):
-                    # Frameshift inner possible peptides
-                    max_possible_peptides = mut_length - peptide_length + 1
-
-                    if max_possible_peptides > 30:
-                        # Random sample 30
-                        sampled_positions = random.sample(
-                            range(pos, pos + mut_length - peptide_length + 1), 30
-                        )
-                    else:
-                        # Exhaustive Search
-                        sampled_positions = range(pos, pos + mut_length - peptide_length + 1)
-
-                    for start_pos in sampled_positions:
-                        peptide = input_df.loc[index, "Protein Sequence"][start_pos:start_pos + peptide_length]
-                        if len(peptide) >= 12 and peptide not in input_df.loc[index - 1, "Protein Sequence"]:
-                            pep_list.append(peptide)
-                input_df.at[index, "mutate_peptide_list"] = pd.Series(pep_list).unique().tolist()
-
-            # Replacement p.G300D
-            else:
-                replacement_count += 1
-                pos = int(row["Protein Change"].split('.')[1][1:-1]) - 1  # 获取替换的突变索引并修正
-                for peptide_length in range(12, 26):
-                    for offset in range(peptide_length):
-                        peptide = input_df.loc[index, "Protein Sequence"][pos - peptide_length + offset: pos + offset]
-                        if len(peptide) >= 12 and peptide not in input_df.loc[index - 1, "Protein Sequence"]:
-                            pep_list.append(peptide)
-                input_df.at[index, "mutate_peptide_list"] = pd.Series(pep_list).unique().tolist()
-
-    print(f"Insertion Count: {insertion_count}")
-    print(f"Deletion Count: {deletion_count}")
-    print(f"Frameshift Count: {frameshift_count}")
-    print(f"Replacement Count: {replacement_count}")
+    sequences = input_df["Protein Sequence"].tolist()
+
+    # One task per protein-altering variant, in table order
+    task_rows = []
+    tasks = []
+    unparsable = []
+    for index, (variant_id, transcript_id, mutation_class, protein_change, wildtype_position) in enumerate(
+            zip(input_df["Variant ID"], input_df["Transcript ID"], input_df["Mutation Class"],
+                input_df["Protein Change"], input_df["Wildtype Index"])):
+        if pd.isna(mutation_class):
+            continue
+        parsed = parse_protein_change(mutation_class, protein_change)
+        if parsed is None:
+            unparsable.append(f"{variant_id} {transcript_id} {protein_change}")
+            continue
+
+        # No paired wildtype record: every window counts as novel
+        wildtype_sequence = "" if pd.isna(wildtype_position) else sequences[wildtype_position]
+        rng_seed = variant_seed(variant_id, transcript_id, protein_change, seed)
+
+        task_rows.append(index)
+        tasks.append((mutation_class, parsed, sequences[index], wildtype_sequence,
+                      rng_seed, min_length, max_length, window_mode, min_core_coverage, core_length))
+
+    if unparsable:
+        print(f"Warning: skipped {len(unparsable)} protein-altering records whose protein change cannot be parsed "
+              f"(e.g. {', '.join(unparsable[:3])}); they get no peptides.")
+
+    if n_workers > 1 and len(tasks) > 1:
+        # Partition the variants into a few chunks per worker; map keeps the table order
+        chunksize = max(1, len(tasks) // (n_workers * 4))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_generate_variant_peptides, tasks, chunksize=chunksize))
+    else:
+        results = [_generate_variant_peptides(task) for task in tasks]
+
+    start_arrays = [None] * len(input_df)
+    length_arrays = [None] * len(input_df)
+    coverage_rows = []
+    for index, (starts, lengths, coverage) in zip(task_rows, results):
+        start_arrays[index] = starts
+        length_arrays[index] = lengths
+        if coverage is not None:
+            coverage_rows.append([input_df[column].iat[index] for column in COVERAGE_COLUMNS[:4]]
+                                 + [coverage[column] for column in COVERAGE_COLUMNS[4:]])
+    input_df["peptide_starts"] = pd.Series(start_arrays, index=input_df.index, dtype=object)
+    input_df["peptide_lengths"] = pd.Series(length_arrays, index=input_df.index, dtype=object)
+
+    mutation_counts = input_df["Mutation Class"].value_counts()
+    print(f"Insertion Count: {mutation_counts.get('insertion', 0)}")
+    print(f"Deletion Count: {mutation_counts.get('deletion', 0)}")
+    print(f"Frameshift Count: {mutation_counts.get('frameshift', 0)}")
+    print(f"Replacement Count: {mutation_counts.get('replacement', 0)}")
+
+    if window_mode == "tile":
+        coverage_df = pd.DataFrame(coverage_rows, columns=COVERAGE_COLUMNS)
+        print(f"Tiled {len(coverage_df)} frameshift/insertion regions: {coverage_df['Novel Cores'].sum()} novel "
+              f"{core_length}-mer cores in {coverage_df['Peptides'].sum()} peptides, "
+              f"{coverage_df['Cores Below Target'].sum()} cores in fewer than {min_core_coverage} "
+              f"(too close to a sequence end)")
+        if coverage_file:
+            coverage_df.to_csv(coverage_file, index=False)
+            print(f"Core coverage saved at: {coverage_file}")
 
     return input_df
-
-
@@ -1,21 +1,27 @@
 import os
 
-def save_mutated_peptides_to_pep(mutation_df, output_dir):
+from annovar_related.peptide_map import build_peptide_variant_map, unique_peptides
+from annovar_related.peptide_windows import count_windows
+
+def save_mutated_peptides_to_pep(mutation_df, output_dir, peptide_map=None):
     """
-    Save all mutated peptides to a .pep file.
+    Save every distinct mutated peptide to a .pep file, once.
 
     Parameters:
         mutation_df (DataFrame): DataFrame containing mutation data.
         output_dir (str): Path to the output directory.
+        peptide_map (DataFrame): Optional peptide -> variant multimap from build_peptide_variant_map;
+            built from mutation_df when not given.
 
     Output:
         Saves a file named 'mutated_peptide_sequences.pep' in the output directory.
     """
-    # Extract all mutated peptides from the DataFrame
-    mutated_peptides = []
-    for peptides in mutation_df['mutate_peptide_list']:
-        if peptides:  # Ensure the list is not None or empty
-            mutated_peptides.extend(peptides)
+    if peptide_map is None:
+        peptide_map = build_peptide_variant_map(mutation_df)
+
+    # Deduplicate across all variants/transcripts, keeping first-appearance order
+    mutated_peptides = unique_peptides(peptide_map)
+    total_peptides = count_windows(mutation_df)
 
     # Ensure the output directory exists
     os.makedirs(output_dir, exist_ok=True)
@@ -26,4 +32,5 @@ def save_mutated_peptides_to_pep(mutation_df, output_dir):
         for peptide in mutated_peptides:
             f.write(f"{peptide}\n")
 
+    print(f"{len(mutated_peptides)} unique peptides kept out of {total_peptides} generated.")
     print(f"Mutated peptide sequences have been saved to: {output_file_path}")
@@ -0,0 +1,34 @@
+from annovar_related.peptide_windows import window_table, materialise_peptides
+
+PROVENANCE_COLUMNS = ["Variant ID", "Transcript ID", "Gene Name"]
+
+
+def build_peptide_variant_map(mutated_peptides_df):
+    """
+    Build the peptide -> [variant, transcript, gene] multimap from the generator output.
+
+    Parameters:
+        mutated_peptides_df (pd.DataFrame): Generator output with the peptide window columns
+            (and usually 'Gene Name' from extract_gene_names_from_dynamic_file).
+
+    Returns:
+        pd.DataFrame: One row per distinct (peptide, variant, transcript, gene) combination,
+        in generation order, with categorical columns so each string is stored once, and
+        each peptide's 0-based 'Start' in its mutant protein sequence.
+    """
+    provenance_cols = [col for col in PROVENANCE_COLUMNS if col in mutated_peptides_df.columns]
+
+    # Peptide strings are sliced out of the protein sequences here, once per window
+    windows = window_table(mutated_peptides_df)
+    peptide_map = mutated_peptides_df[provenance_cols].iloc[windows["Row"].to_numpy()].reset_index(drop=True)
+    peptide_map.insert(0, "Peptide", materialise_peptides(mutated_peptides_df, windows))
+    peptide_map["Start"] = windows["Start"].to_numpy()
+
+    peptide_map = peptide_map.drop_duplicates(ignore_index=True)
+    return peptide_map.astype({col: "category" for col in ["Peptide"] + provenance_cols})
+
+
+def unique_peptides(peptide_map):
+    """Return every distinct peptide once, in order of first appearance."""
+    return peptide_map["Peptide"].astype(str).drop_duplicates().tolist()
+
@@ -0,0 +1,159 @@
+import json
+import mmap
+import struct
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from annovar_related.peptide_windows import START_DTYPE, LENGTH_DTYPE
+
+# Text columns stored dictionary-encoded (codes + distinct values) and loaded as categoricals
+CATEGORICAL_COLUMNS = ["Gene Name", "Mutation Type", "Mutation Class"]
+
+# Fixed size of a zip local file header before its file name and extra field
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+
+
+def _encode_strings(values):
+    """
+    Pack strings (None/NaN allowed) into one UTF-8 buffer, int64 character offsets and a validity mask.
+
+    The offsets count characters, so the buffer is decoded once and sliced per value.
+    """
+    valid = np.array([isinstance(value, str) for value in values], dtype=bool)
+    strings = [value if is_valid else "" for value, is_valid in zip(values, valid)]
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in strings], out=offsets[1:])
+    return np.frombuffer("".join(strings).encode(), dtype=np.uint8), offsets, valid
+
+
+def _decode_strings(data, offsets, valid=None):
+    """Inverse of _encode_strings: a list of str, with None where the value was missing."""
+    text = data.tobytes().decode()
+    strings = [text[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    if valid is not None and not valid.all():
+        strings = [value if is_valid else None for value, is_valid in zip(strings, valid.tolist())]
+    return strings
+
+
+def _split_flat(flat, offsets):
+    """Per-record views of a flat array given its int64 record offsets."""
+    return [flat[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def _column_arrays(name, series):
+    """Return (kind, {member suffix: array}) for one DataFrame column."""
+    if name == "peptide_starts":
+        present = pd.notna(series).to_numpy()
+        starts = [value if is_present else () for value, is_present in zip(series, present)]
+        offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in starts], out=offsets[1:])
+        flat = np.concatenate([np.asarray(value, dtype=START_DTYPE) for value in starts]) if len(starts) else []
+        return "windows", {"offsets": offsets, "present": present, "starts": np.asarray(flat, dtype=START_DTYPE)}
+    if name == "peptide_lengths":
+        lengths = [value for value in series if isinstance(value, np.ndarray)]
+        flat = np.concatenate(lengths) if lengths else []
+        return "window_lengths", {"lengths": np.asarray(flat, dtype=LENGTH_DTYPE)}
+    if isinstance(series.dtype, pd.CategoricalDtype) or name in CATEGORICAL_COLUMNS:
+        categorical = pd.Categorical(series.astype(object).where(series.notna(), None))
+        data, offsets, valid = _encode_strings([str(value) for value in categorical.categories])
+        return "category", {"codes": categorical.codes.astype(np.int32), "data": data, "offsets": offsets}
+    if pd.api.types.is_bool_dtype(series.dtype) or pd.api.types.is_numeric_dtype(series.dtype):
+        mask = series.isna().to_numpy()
+        values = series.to_numpy(dtype=series.dtype.numpy_dtype if hasattr(series.dtype, "numpy_dtype") else None,
+                                 na_value=0) if mask.any() else series.to_numpy()
+        return str(series.dtype), {"values": np.asarray(values), "mask": mask}
+    data, offsets, valid = _encode_strings(series.tolist())
+    return "string", {"data": data, "offsets": offsets, "valid": valid}
+
+
+def save_mutated_peptides_npz(mutated_peptides_df, npz_file):
+    """
+    Save the generator output as an uncompressed, columnar .npz file.
+
+    Every column becomes one or more typed arrays: text as a UTF-8 buffer with int64
+    offsets, CATEGORICAL_COLUMNS (and categorical columns) as int32 codes plus their
+    distinct values, numbers as their own dtype with a missing-value mask, and the
+    peptide windows as flat start/length arrays with per-record offsets. Nothing is
+    pickled, so load_mutated_peptides_npz can memory-map the arrays.
+
+    Parameters:
+        mutated_peptides_df (pd.DataFrame): Generator output with the peptide window columns.
+        npz_file (str): Output path.
+    """
+    schema, arrays = [], {}
+    for index, name in enumerate(mutated_peptides_df.columns):
+        kind, members = _column_arrays(name, mutated_peptides_df[name])
+        schema.append([name, kind])
+        for suffix, array in members.items():
+            arrays[f"{index}.{suffix}"] = array
+    arrays["schema"] = np.array(json.dumps(schema))
+    np.savez(npz_file, **arrays)
+
+
+def _stored_members(npz_file, use_mmap=True):
+    """
+    Return {member name: array} for an uncompressed .npz file.
+
+    With use_mmap the arrays are read-only views into one memory map of the file, so
+    opening it costs no copying; the map stays open as long as any array uses it.
+    """
+    if not use_mmap:
+        with np.load(npz_file, allow_pickle=False) as npz:
+            return {name: npz[name] for name in npz.files}
+
+    members = {}
+    with open(npz_file, "rb") as f, zipfile.ZipFile(f) as archive:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{npz_file} is compressed and cannot be memory-mapped: {info.filename}")
+            header = _LOCAL_HEADER.unpack_from(mapped, info.header_offset)
+            f.seek(info.header_offset + _LOCAL_HEADER.size + header[-2] + header[-1])
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            count = int(np.prod(shape))
+            array = np.frombuffer(mapped, dtype=dtype, count=count, offset=f.tell())
+            members[info.filename[:-len(".npy")]] = array.reshape(shape, order="F" if fortran_order else "C")
+    return members
+
+
+def load_mutated_peptides_npz(npz_file, use_mmap=True):
+    """
+    Load a file written by save_mutated_peptides_npz.
+
+    Codes, numbers and window arrays are used in place (memory-mapped with use_mmap);
+    only the text columns are decoded into Python strings.
+
+    Returns:
+        pd.DataFrame: The generator output, with the CATEGORICAL_COLUMNS as categoricals.
+    """
+    members = _stored_members(npz_file, use_mmap)
+    schema = json.loads(str(members["schema"]))
+
+    names = [name for name, _ in schema]
+    columns = {}
+    for index, (name, kind) in enumerate(schema):
+        member = {key.split(".", 1)[1]: array for key, array in members.items() if key.split(".", 1)[0] == str(index)}
+        if kind == "windows":
+            offsets = member["offsets"]
+            starts = _split_flat(member["starts"], offsets)
+            lengths = _split_flat(members[f"{names.index('peptide_lengths')}.lengths"], offsets)
+            present = member["present"].tolist()
+            columns[name] = pd.Series([value if is_present else None for value, is_present in zip(starts, present)],
+                                      dtype=object)
+            columns["peptide_lengths"] = pd.Series(
+                [value if is_present else None for value, is_present in zip(lengths, present)], dtype=object)
+        elif kind == "window_lengths":
+            continue
+        elif kind == "category":
+            categories = _decode_strings(member["data"], member["offsets"])
+            columns[name] = pd.Series(pd.Categorical.from_codes(member["codes"], categories))
+        elif kind == "string":
+            columns[name] = pd.Series(_decode_strings(member["data"], member["offsets"], member["valid"]))
+        else:
+            values = pd.Series(member["values"], dtype=kind)
+            columns[name] = values.mask(member["mask"]) if member["mask"].any() else values
+    return pd.DataFrame({name: columns[name] for name in names})
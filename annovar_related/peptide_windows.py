@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+# Generator output columns: per record, the 0-based starts of its peptides in 'Protein Sequence'
+# and their lengths, as small integer arrays (None for records without peptides)
+WINDOW_COLUMNS = ["peptide_starts", "peptide_lengths"]
+
+# mutated_peptides_with_genes.csv keeps the windows run-length encoded in one column
+ENCODED_WINDOW_COLUMN = "peptide_windows"
+
+START_DTYPE = np.int32
+LENGTH_DTYPE = np.uint8
+
+
+def window_arrays(starts, lengths):
+    """Pack one record's window starts and lengths into compact integer arrays."""
+    return np.asarray(starts, dtype=START_DTYPE), np.asarray(lengths, dtype=LENGTH_DTYPE)
+
+
+def empty_windows(n_records):
+    """Return per-record empty start and length arrays for n_records records."""
+    return ([np.empty(0, dtype=START_DTYPE) for _ in range(n_records)],
+            [np.empty(0, dtype=LENGTH_DTYPE) for _ in range(n_records)])
+
+
+def window_table(mutated_peptides_df):
+    """
+    Flatten the per-record windows into (Row, Start, Length) integer columns.
+
+    Parameters:
+        mutated_peptides_df (pd.DataFrame): Generator output with the WINDOW_COLUMNS.
+
+    Returns:
+        pd.DataFrame: One row per peptide in generation order; 'Row' is the positional
+        row of its record in mutated_peptides_df.
+    """
+    starts = mutated_peptides_df["peptide_starts"].to_numpy()
+    lengths = mutated_peptides_df["peptide_lengths"].to_numpy()
+    rows = np.flatnonzero(pd.notna(mutated_peptides_df["peptide_starts"]).to_numpy())
+    counts = np.fromiter((len(starts[row]) for row in rows), dtype=np.int64, count=len(rows))
+
+    if not counts.sum():
+        return pd.DataFrame({"Row": np.empty(0, dtype=np.int32), "Start": np.empty(0, dtype=START_DTYPE),
+                             "Length": np.empty(0, dtype=LENGTH_DTYPE)})
+    return pd.DataFrame({
+        "Row": np.repeat(rows, counts).astype(np.int32),
+        "Start": np.concatenate([starts[row] for row in rows]).astype(START_DTYPE, copy=False),
+        "Length": np.concatenate([lengths[row] for row in rows]).astype(LENGTH_DTYPE, copy=False),
+    })
+
+
+def materialise_peptides(mutated_peptides_df, table=None):
+    """
+    Slice the peptide strings of a window table out of the records' protein sequences.
+
+    Strings are only built here, e.g. when the .pep file or the peptide map is made.
+
+    Returns:
+        list: Peptide strings in window table order.
+    """
+    if table is None:
+        table = window_table(mutated_peptides_df)
+    sequences = mutated_peptides_df["Protein Sequence"].to_numpy()
+    return [sequences[row][start:start + length] for row, start, length in
+            zip(table["Row"].tolist(), table["Start"].tolist(), table["Length"].tolist())]
+
+
+def count_windows(mutated_peptides_df):
+    """Total number of generated peptides (windows) over all records."""
+    return int(mutated_peptides_df["peptide_starts"].dropna().map(len).sum())
+
+
+def encode_windows(starts, lengths):
+    """
+    Run-length encode one record's windows in generation order.
+
+    Consecutive windows of one length with consecutive starts form a run written as
+    'start:length:count' (':count' omitted for single windows); runs are space-separated.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if len(starts) == 0:
+        return ""
+    breaks = np.flatnonzero((np.diff(starts) != 1) | (np.diff(lengths) != 0)) + 1
+    run_starts = np.concatenate([[0], breaks])
+    run_counts = np.diff(np.concatenate([run_starts, [len(starts)]]))
+    return " ".join(
+        f"{start}:{length}" + (f":{count}" if count > 1 else "")
+        for start, length, count in zip(starts[run_starts].tolist(), lengths[run_starts].tolist(), run_counts.tolist())
+    )
+
+
+def decode_windows(encoded):
+    """Inverse of encode_windows: return (starts, lengths) arrays."""
+    run_starts, run_lengths, run_counts = [], [], []
+    for run in str(encoded).split():
+        fields = [int(value) for value in run.split(":")]
+        run_starts.append(fields[0])
+        run_lengths.append(fields[1])
+        run_counts.append(fields[2] if len(fields) > 2 else 1)
+    run_counts = np.array(run_counts, dtype=np.int64)
+    offsets = np.arange(run_counts.sum()) - np.repeat(np.cumsum(run_counts) - run_counts, run_counts)
+    return window_arrays(np.repeat(run_starts, run_counts) + offsets, np.repeat(run_lengths, run_counts))
+
+
+def save_mutated_peptides_csv(mutated_peptides_df, csv_file):
+    """
+    Save the generator output to CSV with the windows run-length encoded (see encode_windows).
+
+    The window arrays are written as one 'peptide_windows' column in place of the two array
+    columns, so the file stays small; read it back with read_mutated_peptides_csv.
+    """
+    output_df = mutated_peptides_df.copy()
+    position = output_df.columns.get_loc("peptide_starts")
+    encoded = [
+        encode_windows(starts, lengths) if isinstance(starts, np.ndarray) else None
+        for starts, lengths in zip(output_df["peptide_starts"], output_df["peptide_lengths"])
+    ]
+    output_df = output_df.drop(columns=WINDOW_COLUMNS)
+    output_df.insert(position, ENCODED_WINDOW_COLUMN, encoded)
+    output_df.to_csv(csv_file, index=False)
+
+
+def read_mutated_peptides_csv(csv_file):
+    """
+    Read a CSV written by save_mutated_peptides_csv back into the generator layout.
+
+    Records with no (or only filtered-out) peptides come back without windows.
+    """
+    df = pd.read_csv(csv_file, keep_default_na=False, na_values=[""])
+    position = df.columns.get_loc(ENCODED_WINDOW_COLUMN)
+    encoded = df.pop(ENCODED_WINDOW_COLUMN)
+    decoded = [decode_windows(value) if pd.notna(value) else (None, None) for value in encoded]
+    df.insert(position, "peptide_starts", pd.Series([starts for starts, _ in decoded], index=df.index, dtype=object))
+    df.insert(position + 1, "peptide_lengths", pd.Series([lengths for _, lengths in decoded], index=df.index, dtype=object))
+    if "Wildtype Index" in df.columns:
+        df["Wildtype Index"] = df["Wildtype Index"].astype("Int64")
+    return df
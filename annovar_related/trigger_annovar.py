@@ -1,15 +1,114 @@
-import subprocess
 import os
+from concurrent.futures import ThreadPoolExecutor
 
+from annovar_related.annovar_merge import (split_avinput, merge_annotation_tables, merge_exonic_variant_functions,
+                                           merge_mutated_protein_fastas)
+from annovar_related.coding_change import MrnaIndex, run_coding_change
+from pipeline_related.metrics import count_lines, measure, run_command
 
-def trigger_annovar(vcf_file_path, annovar_path):
+
+def _table_annovar_command(annovar_path, avinput_file, output_prefix):
+    table_annovar = os.path.join(annovar_path, 'table_annovar.pl')
+    humandb = os.path.join(annovar_path, 'humandb/')
+    return f"perl {table_annovar} {avinput_file} {humandb} -buildver hg19 -out {output_prefix} -protocol refGene -operation g -polish"
+
+
+def _coding_change_command(annovar_path, exonic_variant_function, fasta_output):
+    coding_change = os.path.join(annovar_path, 'coding_change.pl')
+    hg19_refGene_txt = os.path.join(annovar_path, 'humandb/hg19_refGene.txt')
+    hg19_refGene_fa = os.path.join(annovar_path, 'humandb/hg19_refGeneMrna.fa')
+    return f"perl {coding_change} {exonic_variant_function} {hg19_refGene_txt} {hg19_refGene_fa} -includesnp -onlyAltering > {fasta_output}"
+
+
+def _run_coding_change(annovar_path, exonic_variant_function, fasta_output, engine):
+    """Translate the exonic variants with coding_change.pl ('perl') or the in-process engine ('python')."""
+    if engine == "python":
+        with measure("step", "coding_change_python", input_lines=count_lines(exonic_variant_function)) as record:
+            run_coding_change(exonic_variant_function, os.path.join(annovar_path, 'humandb/hg19_refGene.txt'),
+                              os.path.join(annovar_path, 'humandb/hg19_refGeneMrna.fa'), fasta_output)
+            record["output_lines"] = count_lines(fasta_output)
+        return
+    if engine != "perl":
+        raise ValueError(f"Unknown coding change engine '{engine}'; use 'perl' or 'python'.")
+    command = _coding_change_command(annovar_path, exonic_variant_function, fasta_output)
+    print(f"Executing ANNOVAR command:\n{command}")
+    run_command(command, "coding_change", input_file=exonic_variant_function, output_file=fasta_output)
+
+
+def run_annovar_sharded(annovar_path, avinput_file, exonic_variant_function, fasta_output,
+                        shard_by="chromosome", block_size=50000, n_workers=1, coding_change_engine="perl",
+                        output_prefix=None):
+    """
+    Annotate avinput shards concurrently and merge their outputs as if ANNOVAR ran once.
+
+    Every shard runs table_annovar.pl and coding_change.pl on its own; the
+    exonic_variant_function and FASTA outputs are then merged in avinput order with
+    lineN IDs renumbered to the unsharded file, and the hg19_multianno.txt and
+    variant_function tables in avinput order. Logs stay per shard in the 'shards' folder.
+
+    Parameters:
+    - annovar_path: Path to the ANNOVAR folder.
+    - avinput_file: avinput file of the whole VCF.
+    - exonic_variant_function: Path of the merged exonic_variant_function file.
+    - fasta_output: Path of the merged mutated protein FASTA file.
+    - shard_by: 'chromosome' or 'block' (see split_avinput).
+    - block_size: Variants per shard when shard_by is 'block'.
+    - n_workers: Maximum number of shards annotated at once.
+    - coding_change_engine: 'perl' (coding_change.pl) or 'python' (annovar_related.coding_change).
+    - output_prefix: Prefix of the merged multianno and variant_function tables
+      (default: exonic_variant_function without '.refGene.exonic_variant_function').
+    """
+    if output_prefix is None:
+        output_prefix = exonic_variant_function.replace(".refGene.exonic_variant_function", "")
+    shard_dir = os.path.join(os.path.dirname(exonic_variant_function), "shards")
+    shards = split_avinput(avinput_file, shard_dir, shard_by=shard_by, block_size=block_size)
+    if coding_change_engine == "python":
+        # Build the mRNA index once, before the shards read it
+        MrnaIndex(os.path.join(annovar_path, 'humandb/hg19_refGeneMrna.fa')).close()
+
+    def annotate_shard(shard):
+        shard_avinput, line_numbers = shard
+        prefix = os.path.splitext(shard_avinput)[0]
+        command = _table_annovar_command(annovar_path, shard_avinput, prefix)
+        print(f"Executing ANNOVAR command:\n{command}")
+        run_command(command, "table_annovar", input_file=shard_avinput,
+                    output_file=f"{prefix}.refGene.exonic_variant_function", shard=os.path.basename(shard_avinput))
+        _run_coding_change(annovar_path, f"{prefix}.refGene.exonic_variant_function",
+                           f"{prefix}.mutated_proteins.fasta", coding_change_engine)
+        return prefix
+
+    print(f"Running ANNOVAR on {len(shards)} shards (by {shard_by}) on {n_workers} workers.")
+    with ThreadPoolExecutor(max_workers=max(1, n_workers)) as executor:
+        prefixes = list(executor.map(annotate_shard, shards))
+
+    merge_exonic_variant_functions([(f"{prefix}.refGene.exonic_variant_function", line_numbers)
+                                    for prefix, (_, line_numbers) in zip(prefixes, shards)], exonic_variant_function)
+    merge_mutated_protein_fastas([(f"{prefix}.mutated_proteins.fasta", line_numbers)
+                                  for prefix, (_, line_numbers) in zip(prefixes, shards)], fasta_output)
+    merge_annotation_tables([(f"{prefix}.hg19_multianno.txt", shard_avinput, line_numbers)
+                             for prefix, (shard_avinput, line_numbers) in zip(prefixes, shards)],
+                            f"{output_prefix}.hg19_multianno.txt")
+    merge_annotation_tables([(f"{prefix}.refGene.variant_function", shard_avinput, line_numbers)
+                             for prefix, (shard_avinput, line_numbers) in zip(prefixes, shards)],
+                            f"{output_prefix}.refGene.variant_function", key_column=2, has_header=False)
+
+
+def trigger_annovar(vcf_file_path, annovar_path, output_dir=None, shard_by=None, block_size=50000, n_workers=1,
+                    coding_change_engine="perl"):
     """
     Function to process VCF files with ANNOVER in Linux.
+
+    Outputs go to output_dir, by default 'annovar_outputs' next to the ANNOVAR folder.
+    With shard_by ('chromosome' or 'block'), annotation runs on avinput shards on up to
+    n_workers processes at once (see run_annovar_sharded); the merged outputs are the
+    same as those of a single run. coding_change_engine='python' translates the variants
+    in-process (see annovar_related.coding_change) instead of running coding_change.pl.
     """
 
     ### Ensure the 'all_outputs' folder exists ###
-    base_dir = os.path.dirname(annovar_path)  # Get the parent directory of the annovar path
-    output_dir = os.path.join(base_dir, "annovar_outputs")
+    if output_dir is None:
+        base_dir = os.path.dirname(annovar_path)  # Get the parent directory of the annovar path
+        output_dir = os.path.join(base_dir, "annovar_outputs")
     os.makedirs(output_dir, exist_ok=True)  # Create the folder if it doesn't exist
 
     ### 1) Convert .vcf to .avinput ###
@@ -27,26 +126,31 @@ def trigger_annovar(vcf_file_path, annovar_path):
 
     # Print and execute the command
     print(f"1st command: {first_command}")
-    subprocess.run(first_command, shell=True, check=True)
+    run_command(first_command, "convert2annovar", input_file=vcf_file_path, output_file=avinput_file)
 
     ### 2) Annotate the variant file ###
-    table_annovar = os.path.join(annovar_path, 'table_annovar.pl')
-    humandb = os.path.join(annovar_path, 'humandb/')
     annotation_output_prefix = os.path.join(output_dir, filename)  # Output files from this step go to output_dir
-    second_code = f"perl {table_annovar} {avinput_file} {humandb} -buildver hg19 -out {annotation_output_prefix} -protocol refGene -operation g -polish"
+    exonic_variant_function = os.path.join(output_dir, f"{filename}.refGene.exonic_variant_function")
+    fasta_output = os.path.join(output_dir, f"{filename}.mutated_proteins.fasta")  # Save fasta in output_dir
+
+    if shard_by:
+        run_annovar_sharded(annovar_path, avinput_file, exonic_variant_function, fasta_output,
+                            shard_by=shard_by, block_size=block_size, n_workers=n_workers,
+                            coding_change_engine=coding_change_engine, output_prefix=annotation_output_prefix)
+        return fasta_output
+
+    second_code = _table_annovar_command(annovar_path, avinput_file, annotation_output_prefix)
 
     print(f"2nd command: {second_code}")
-    subprocess.run(second_code, shell=True, check=True)
+    run_command(second_code, "table_annovar", input_file=avinput_file, output_file=exonic_variant_function)
 
     ### 3) Get Fasta File ###
-    coding_change = os.path.join(annovar_path, 'coding_change.pl')
-    exonic_variant_function = os.path.join(output_dir, f"{filename}.refGene.exonic_variant_function")
-    hg19_refGene_txt = os.path.join(annovar_path, 'humandb/hg19_refGene.txt')
-    hg19_refGene_fa = os.path.join(annovar_path, 'humandb/hg19_refGeneMrna.fa')
-    fasta_output = os.path.join(output_dir, f"{filename}.mutated_proteins.fasta")  # Save fasta in output_dir
-
-    third_command = f"perl {coding_change} {exonic_variant_function} {hg19_refGene_txt} {hg19_refGene_fa} -includesnp -onlyAltering > {fasta_output}"
-    print(f"3rd command: {third_command}")
-    subprocess.run(third_command, shell=True, check=True)
+    if coding_change_engine == "python":
+        print("3rd step: translating the exonic variants in-process")
+        _run_coding_change(annovar_path, exonic_variant_function, fasta_output, coding_change_engine)
+    else:
+        third_command = _coding_change_command(annovar_path, exonic_variant_function, fasta_output)
+        print(f"3rd command: {third_command}")
+        run_command(third_command, "coding_change", input_file=exonic_variant_function, output_file=fasta_output)
 
     return fasta_output
\ No newline at end of file
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+
+def build_variant_table(fasta_df):
+    """
+    Pair every mutant record of the ANNOVAR FASTA with its WILDTYPE record.
+
+    coding_change.pl writes each WILDTYPE protein directly before its mutant, with
+    the same Variant ID and Transcript ID. Instead of every stage assuming the
+    wildtype sits at `index - 1`, the pairing is resolved once here.
+
+    Parameters:
+        fasta_df (pd.DataFrame): DataFrame returned by fasta_to_dataframe.
+
+    Returns:
+        pd.DataFrame: Copy of fasta_df with a fresh RangeIndex and two extra columns:
+        - 'Wildtype Index': row position of the paired WILDTYPE record (<NA> for
+          WILDTYPE rows and for mutants without a matching wildtype).
+        - 'Mutation Class': insertion / deletion / frameshift / replacement for
+          protein-altering rows, <NA> otherwise.
+    """
+    variant_df = fasta_df.reset_index(drop=True).copy()
+
+    is_wildtype = variant_df["Mutation Type"] == "WILDTYPE"
+    positions = pd.Series(np.arange(len(variant_df)), index=variant_df.index)
+
+    # Most recent WILDTYPE record at or above each row
+    last_wildtype = positions.where(is_wildtype).ffill()
+    last_variant_id = variant_df["Variant ID"].where(is_wildtype).ffill()
+    last_transcript_id = variant_df["Transcript ID"].where(is_wildtype).ffill()
+
+    paired = (
+        ~is_wildtype
+        & (last_variant_id == variant_df["Variant ID"])
+        & (last_transcript_id == variant_df["Transcript ID"])
+    )
+    variant_df["Wildtype Index"] = last_wildtype.where(paired).astype("Int64")
+
+    # Classify protein-altering changes in the same precedence the generator uses
+    protein_change = variant_df["Protein Change"].astype(str)
+    is_altering = variant_df["Mutation Type"] == "protein-altering"
+    mutation_class = np.select(
+        [
+            protein_change.str.contains("ins", regex=False),
+            protein_change.str.contains("del", regex=False),
+            protein_change.str.contains("fs", regex=False),
+        ],
+        ["insertion", "deletion", "frameshift"],
+        default="replacement",
+    )
+    variant_df["Mutation Class"] = pd.Series(mutation_class, index=variant_df.index).where(is_altering)
+
+    return variant_df
+
+
+def ensure_variant_table(input_df):
+    """Return input_df unchanged if it is already a variant table, otherwise build one."""
+    if "Wildtype Index" in input_df.columns:
+        return input_df
+    return build_variant_table(input_df)
+
+
+def select_variants(variant_df, keep_mask):
+    """
+    Keep the rows selected by keep_mask and renumber 'Wildtype Index' to match.
+
+    Mutants whose wildtype record was dropped lose their pairing (<NA>).
+    """
+    keep_mask = np.asarray(keep_mask, dtype=bool)
+    new_positions = np.full(len(variant_df), -1, dtype=np.int64)
+    new_positions[keep_mask] = np.arange(keep_mask.sum())
+
+    selected = variant_df[keep_mask].reset_index(drop=True)
+    old_wildtype = selected["Wildtype Index"]
+    remapped = pd.Series(
+        new_positions[old_wildtype.fillna(0).to_numpy(dtype=np.int64)],
+        index=selected.index,
+    )
+    selected["Wildtype Index"] = remapped.where(old_wildtype.notna() & (remapped >= 0)).astype("Int64")
+    return selected
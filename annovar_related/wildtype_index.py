@@ -0,0 +1,129 @@
+import numpy as np
+
+from annovar_related.window_engine import encode_sequence
+
+
+def build_wildtype_index(wildtype_sequence, anchor_length=12):
+    """
+    Build a k-mer anchor index over a wildtype protein sequence.
+
+    Every window generated by mut_pep_generator is at least 12 residues long, so
+    a peptide can only occur in the wildtype at a position where its first
+    12-mer occurs. Indexing those anchors once per WILDTYPE record turns each
+    novelty check into a hash lookup plus a few direct comparisons instead of a
+    scan over the whole protein.
+
+    Parameters:
+        wildtype_sequence (str): Wildtype protein sequence.
+        anchor_length (int): Length of the indexed k-mers (the minimum peptide length).
+
+    Returns:
+        dict: Mapping of every anchor k-mer to the list of its start positions.
+    """
+    index = {}
+    for start in range(len(wildtype_sequence) - anchor_length + 1):
+        index.setdefault(wildtype_sequence[start:start + anchor_length], []).append(start)
+    return index
+
+
+def peptide_in_wildtype(peptide, wildtype_sequence, wildtype_index, anchor_length=12):
+    """
+    Check whether a peptide occurs in the wildtype sequence using its anchor index.
+
+    Gives the same answer as `peptide in wildtype_sequence` for peptides of at
+    least `anchor_length` residues; shorter peptides fall back to the substring scan.
+    """
+    if len(peptide) < anchor_length:
+        return peptide in wildtype_sequence
+
+    positions = wildtype_index.get(peptide[:anchor_length])
+    if not positions:
+        return False
+    return any(wildtype_sequence.startswith(peptide, start) for start in positions)
+
+
+# Multiplier of the polynomial k-mer hash (arithmetic wraps modulo 2**64)
+_HASH_BASE = 1000003
+
+
+def kmer_hashes(encoded_sequence, k, starts=None):
+    """
+    Polynomial hashes of the k-mers of an encoded sequence.
+
+    Equal k-mers get equal hashes; different ones may collide, so matches must be
+    confirmed on the residues themselves.
+
+    Returns:
+        np.ndarray: uint64 hash of the k-mer at each of starts (default: every position
+        with a full k-mer).
+    """
+    if k <= 0 or len(encoded_sequence) < k:
+        return np.empty(0, dtype=np.uint64)
+    powers = np.array([pow(_HASH_BASE, k - 1 - j, 1 << 64) for j in range(k)], dtype=np.uint64)
+    windows = np.lib.stride_tricks.sliding_window_view(encoded_sequence, k)
+    if starts is not None:
+        windows = windows[starts]
+    return windows.astype(np.uint64) @ powers
+
+
+def windows_in_wildtype(sequence, starts, ends, wildtype_sequence, anchor_length=12):
+    """
+    Mask of the windows [start, end) of sequence whose peptide occurs in the wildtype.
+
+    Gives the same answers as peptide_in_wildtype on the sliced peptides, without slicing
+    them. The anchor k-mer of every distinct start is looked up among the hashed wildtype
+    anchors; each candidate wildtype position is then compared residue by residue to get
+    the longest wildtype match from that start, and a window is in the wildtype when it
+    fits inside that match. Windows shorter than anchor_length fall back to the
+    substring scan.
+
+    Parameters:
+        sequence (str): Mutant protein sequence.
+        starts (np.ndarray): 0-based window starts (inside the sequence).
+        ends (np.ndarray): Window ends (exclusive).
+        wildtype_sequence (str): Wildtype protein sequence.
+        anchor_length (int): Anchor k-mer length (the minimum window length).
+
+    Returns:
+        np.ndarray: Boolean mask aligned with starts.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(ends, dtype=np.int64) - starts
+    in_wildtype = np.zeros(len(starts), dtype=bool)
+    if not len(starts):
+        return in_wildtype
+
+    encoded = encode_sequence(sequence)
+    encoded_wildtype = encode_sequence(wildtype_sequence)
+    unique_starts, inverse = np.unique(starts, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    match_lengths = np.zeros(len(unique_starts), dtype=np.int64)
+
+    wildtype_hashes = kmer_hashes(encoded_wildtype, anchor_length)
+    anchored = unique_starts[unique_starts + anchor_length <= len(encoded)]
+    if len(wildtype_hashes) and len(anchored):
+        # Every (start, wildtype position) pair whose anchors hash alike
+        order = np.argsort(wildtype_hashes, kind="stable")
+        sorted_hashes = wildtype_hashes[order]
+        anchor_hashes = kmer_hashes(encoded, anchor_length, anchored)
+        first = np.searchsorted(sorted_hashes, anchor_hashes, side="left")
+        counts = np.searchsorted(sorted_hashes, anchor_hashes, side="right") - first
+        pair_starts = np.repeat(anchored, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_wildtype_starts = order[np.repeat(first, counts) + offsets]
+
+        # Longest common prefix of each pair, up to the longest window
+        steps = np.arange(int(lengths.max()))
+        mutant_positions = pair_starts[:, None] + steps
+        wildtype_positions = pair_wildtype_starts[:, None] + steps
+        inside = (mutant_positions < len(encoded)) & (wildtype_positions < len(encoded_wildtype))
+        equal = inside & (encoded[np.minimum(mutant_positions, len(encoded) - 1)]
+                          == encoded_wildtype[np.minimum(wildtype_positions, len(encoded_wildtype) - 1)])
+        equal = np.concatenate([equal, np.zeros((len(equal), 1), dtype=bool)], axis=1)
+        prefix_lengths = np.argmin(equal, axis=1)
+        np.maximum.at(match_lengths, np.searchsorted(unique_starts, pair_starts), prefix_lengths)
+
+    in_wildtype = lengths <= match_lengths[inverse]
+    for i in np.flatnonzero(lengths < anchor_length).tolist():
+        in_wildtype[i] = sequence[starts[i]:starts[i] + lengths[i]] in wildtype_sequence
+    return in_wildtype
@@ -0,0 +1,187 @@
+import random
+
+import numpy as np
+
+
+def encode_sequence(sequence):
+    """Encode a protein sequence as a uint8 array of ASCII residue codes."""
+    return np.frombuffer(sequence.encode("ascii"), dtype=np.uint8)
+
+
+def slice_bounds(starts, ends, seq_len):
+    """
+    Resolve window bounds exactly the way Python slicing `sequence[start:end]` does.
+
+    Negative bounds count from the end of the sequence and all bounds are clipped
+    to [0, seq_len], so the returned windows match what string slicing would give.
+    """
+    starts = np.where(starts < 0, np.maximum(starts + seq_len, 0), np.minimum(starts, seq_len))
+    ends = np.where(ends < 0, np.maximum(ends + seq_len, 0), np.minimum(ends, seq_len))
+    return starts, np.maximum(ends, starts)
+
+
+def spanning_windows(pos, seq_len, min_length=12, max_length=25):
+    """
+    Enumerate every window of min_length..max_length residues ending between pos and
+    pos + length - 1, ordered by length and then offset.
+
+    Parameters:
+        pos (int): 0-based index the windows are anchored on.
+        seq_len (int): Length of the mutant protein sequence.
+        min_length (int): Shortest peptide length.
+        max_length (int): Longest peptide length.
+
+    Returns:
+        tuple: (starts, ends) arrays of the windows that are at least min_length long.
+    """
+    lengths = np.arange(min_length, max_length + 1)
+    offsets = np.arange(max_length)
+    valid = offsets[None, :] < lengths[:, None]
+
+    starts = (pos - lengths[:, None] + offsets[None, :])[valid]
+    ends = np.broadcast_to(pos + offsets, valid.shape)[valid]
+
+    starts, ends = slice_bounds(starts, ends, seq_len)
+    keep = ends - starts >= min_length
+    return starts[keep], ends[keep]
+
+
+def frameshift_windows(pos, mut_length, seq_len, min_length=12, max_length=25,
+                       sample_size=30, rng=random):
+    """
+    Enumerate windows lying inside a frameshift's novel tail.
+
+    For each length, every start in [pos, pos + mut_length - length] is used, unless
+    there are more than sample_size of them, in which case sample_size starts are
+    drawn with rng.sample (one draw per length, in ascending length order).
+
+    Returns:
+        tuple: (starts, ends) arrays of the windows that are at least min_length long.
+    """
+    start_blocks = []
+    length_blocks = []
+    for peptide_length in range(min_length, max_length + 1):
+        max_possible_peptides = mut_length - peptide_length + 1
+        if max_possible_peptides > sample_size:
+            positions = np.array(
+                rng.sample(range(pos, pos + mut_length - peptide_length + 1), sample_size),
+                dtype=np.int64,
+            )
+        else:
+            positions = np.arange(pos, pos + mut_length - peptide_length + 1, dtype=np.int64)
+        start_blocks.append(positions)
+        length_blocks.append(np.full(len(positions), peptide_length, dtype=np.int64))
+
+    starts = np.concatenate(start_blocks) if start_blocks else np.empty(0, dtype=np.int64)
+    lengths = np.concatenate(length_blocks) if length_blocks else np.empty(0, dtype=np.int64)
+
+    starts, ends = slice_bounds(starts, starts + lengths, seq_len)
+    keep = ends - starts >= min_length
+    return starts[keep], ends[keep]
+
+
+def tile_core_windows(core_starts, seq_len, min_length=12, max_length=25, min_coverage=1, core_length=9):
+    """
+    Choose the fewest windows such that every given core lies in at least min_coverage of them.
+
+    A window [start, end) of min_length..max_length residues inside the sequence covers
+    the core starting at c when start <= c and c + core_length <= end. The cores are
+    walked left to right; whenever one is covered fewer than min_coverage times, the
+    missing windows are taken among those covering it that reach furthest right (the
+    shorter one first on a tie). For intervals on a line this greedy choice is optimal:
+    no smaller set of windows gives every core min_coverage.
+
+    Cores close to a sequence end may have fewer than min_coverage possible windows; they
+    get all of them (see core_coverage).
+
+    Parameters:
+        core_starts (np.ndarray): Sorted, unique 0-based starts of the cores to cover.
+        seq_len (int): Length of the mutant protein sequence.
+        min_length (int): Shortest peptide length.
+        max_length (int): Longest peptide length.
+        min_coverage (int): Number of distinct windows each core should lie in.
+        core_length (int): Binding core length.
+
+    Returns:
+        tuple: (starts, ends) arrays of the chosen windows, ordered by length and then start.
+    """
+    core_starts = np.asarray(core_starts, dtype=np.int64)
+    coverage = np.zeros(len(core_starts), dtype=np.int64)
+    chosen = set()
+
+    for i, core_start in enumerate(core_starts.tolist()):
+        missing = min_coverage - coverage[i]
+        if missing <= 0:
+            continue
+
+        # Every unused window of an acceptable length holding this core, furthest-reaching first
+        candidates = [
+            (start + length, length, start)
+            for length in range(min_length, max_length + 1)
+            for start in range(max(0, core_start + core_length - length), min(core_start, seq_len - length) + 1)
+            if (start, length) not in chosen
+        ]
+        candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+
+        for end, length, start in candidates[:missing]:
+            chosen.add((start, length))
+            first = np.searchsorted(core_starts, start, side="left")
+            last = np.searchsorted(core_starts, end - core_length, side="right")
+            coverage[first:last] += 1
+
+    windows = sorted(chosen, key=lambda window: (window[1], window[0]))
+    starts = np.array([start for start, _ in windows], dtype=np.int64)
+    ends = np.array([start + length for start, length in windows], dtype=np.int64)
+    return starts, ends
+
+
+def core_coverage(core_starts, starts, ends, core_length=9):
+    """Number of windows [start, end) each core (given by its start) lies in."""
+    core_starts = np.asarray(core_starts, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    inside = (starts[None, :] <= core_starts[:, None]) & (core_starts[:, None] + core_length <= ends[None, :])
+    return inside.sum(axis=1)
+
+
+def windows_containing(encoded_sequence, motif, starts, ends):
+    """
+    Mask of the windows [start, end) that contain at least one full copy of motif.
+
+    Occurrences of the motif are located once with a sliding-window comparison over
+    the encoded sequence, and each window is checked against the first occurrence at
+    or after its start.
+    """
+    motif_length = len(motif)
+    if motif_length == 0:
+        return np.ones(len(starts), dtype=bool)
+    if motif_length > len(encoded_sequence):
+        return np.zeros(len(starts), dtype=bool)
+
+    views = np.lib.stride_tricks.sliding_window_view(encoded_sequence, motif_length)
+    occurrences = np.flatnonzero((views == encode_sequence(motif)).all(axis=1))
+    if len(occurrences) == 0:
+        return np.zeros(len(starts), dtype=bool)
+
+    nearest = np.searchsorted(occurrences, starts)
+    found = nearest < len(occurrences)
+    first_start = occurrences[np.minimum(nearest, len(occurrences) - 1)]
+    return found & (first_start + motif_length <= ends)
+
+
+def materialise_windows(sequence, starts, ends):
+    """Slice the windows out of the sequence, keeping the first copy of each peptide."""
+    return list(materialise_window_starts(sequence, starts, ends))
+
+
+def materialise_window_starts(sequence, starts, ends):
+    """
+    Slice the windows out of the sequence.
+
+    Returns:
+        dict: Peptide -> 0-based start of its first window in the sequence, in window order.
+    """
+    peptides = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        peptides.setdefault(sequence[start:end], start)
+    return peptides
@@ -0,0 +1,56 @@
+import argparse
+import os
+
+from pipeline_related.cohort import run_cohort
+from pipeline_related.metrics import start_recording
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run the MHC class II neoantigen pipeline for a cohort of samples without prompts.")
+    parser.add_argument("manifest", help="Cohort manifest CSV: sample, vcf, expression_file, tpm_threshold "
+                                         "[, expression_columns, netmhciipan_alleles, mixmhc2pred_alleles]")
+    parser.add_argument("--annovar", required=True, help="ANNOVAR folder")
+    parser.add_argument("--netmhciipan", required=True, help="NetMHCIIpan folder")
+    parser.add_argument("--mixmhc2pred", required=True, help="MixMHC2pred folder")
+    parser.add_argument("--output-dir", required=True, help="Cohort output folder (one subfolder per sample)")
+    parser.add_argument("--max-samples", type=int, default=2, help="Samples processed at once (default: 2)")
+    parser.add_argument("--cache", help="Prediction cache database (default: <output-dir>/prediction_cache/predictions.sqlite)")
+    parser.add_argument("--annovar-shard-by", choices=["chromosome", "block", "none"], default="none",
+                        help="Split each VCF for ANNOVAR by chromosome or into variant blocks (default: none)")
+    parser.add_argument("--annovar-block-size", type=int, default=50000, help="Variants per ANNOVAR block (default: 50000)")
+    parser.add_argument("--annovar-workers", type=int, default=os.cpu_count() or 1,
+                        help="ANNOVAR shards annotated at once per sample (default: number of CPUs)")
+    parser.add_argument("--peptide-workers", type=int, default=os.cpu_count() or 1,
+                        help="Peptide generation processes per sample (default: number of CPUs)")
+    parser.add_argument("--frameshift-window-mode", choices=["sample", "tile"], default="sample",
+                        help="Sample frameshift windows at random or tile their novel 9-mer cores (default: sample)")
+    parser.add_argument("--min-core-coverage", type=int, default=2,
+                        help="Peptides each novel 9-mer core should appear in when tiling (default: 2)")
+    parser.add_argument("--netmhciipan-shards", type=int, default=1,
+                        help="Peptide chunks per NetMHCIIpan batch (default: 1, a single run)")
+    parser.add_argument("--netmhciipan-workers", type=int, default=os.cpu_count() or 1,
+                        help="NetMHCIIpan processes running at once (default: number of CPUs)")
+    parser.add_argument("--prefilter", action="store_true",
+                        help="Drop peptides of unexpressed genes before prediction (they are predicted by default)")
+    parser.add_argument("--metrics", help="JSON-lines file of per-stage and per-command metrics "
+                                          "(default: <output-dir>/pipeline_metrics.jsonl)")
+    parser.add_argument("--profile", choices=["cprofile", "tracemalloc"],
+                        help="Profile the Python stages with cProfile or tracemalloc")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    start_recording(args.metrics or os.path.join(args.output_dir, "pipeline_metrics.jsonl"), profile=args.profile)
+    run_cohort(
+        args.manifest, args.annovar, args.netmhciipan, args.mixmhc2pred, args.output_dir,
+        max_samples=args.max_samples,
+        cache_path=args.cache,
+        netmhciipan_options={"n_shards": args.netmhciipan_shards, "n_workers": args.netmhciipan_workers},
+        prefilter=args.prefilter,
+        annovar_options={"shard_by": None if args.annovar_shard_by == "none" else args.annovar_shard_by,
+                         "block_size": args.annovar_block_size, "n_workers": args.annovar_workers},
+        peptide_options={"n_workers": args.peptide_workers, "window_mode": args.frameshift_window_mode,
+                         "min_core_coverage": args.min_core_coverage},
+    )
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import stat
+
+# Folders of the stand-in executables, laid out like the real installations
+FAKE_TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_tools")
+FAKE_NETMHCIIPAN_PATH = os.path.join(FAKE_TOOLS_DIR, "netMHCIIpan")
+FAKE_MIXMHC2PRED_PATH = os.path.join(FAKE_TOOLS_DIR, "MixMHC2pred")
+
+
+def _score(*keys):
+    """Deterministic pseudo-random integer for a (peptide, allele) pair."""
+    return int(hashlib.md5(":".join(keys).encode()).hexdigest()[:8], 16)
+
+
+def _read_peptides(pep_file):
+    with open(pep_file, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _read_fasta_windows(fasta_file, lengths):
+    """(Pos, peptide, sequence name) of every window of the given lengths, 1-based like NetMHCIIpan's FASTA output."""
+    records = []
+    with open(fasta_file, "r") as f:
+        for line in f:
+            if line.startswith(">"):
+                records.append([line[1:].split()[0], ""])
+            elif records:
+                records[-1][1] += line.strip()
+    return [(start + 1, sequence[start:start + length], name) for name, sequence in records
+            for length in lengths for start in range(len(sequence) - length + 1)]
+
+
+def write_netmhciipan_xls(pep_file, alleles, xls_file, lengths=None, rank_weak=5):
+    """
+    Write a NetMHCIIpan-shaped -xls table for a .pep file, or for the windows of a FASTA file when lengths is given.
+
+    Ranks (0-40) and scores are hashes of the peptide and allele, so a peptide gets
+    the same prediction in every run, shard, input type and cache state, like the real tool.
+    """
+    if lengths is None:
+        entries = [(position, peptide, "Sequence") for position, peptide in enumerate(_read_peptides(pep_file))]
+    else:
+        entries = _read_fasta_windows(pep_file, lengths)
+    with open(xls_file, "w") as f:
+        f.write("\t\t\t\t" + "\t\t\t\t".join(alleles) + "\n")
+        f.write("\t".join(["Pos", "Peptide", "ID", "Target"] + ["Core", "Inverted", "Score", "Rank"] * len(alleles)
+                          + ["Ave", "NB"]) + "\n")
+        for position, peptide, name in entries:
+            row = [str(position), peptide, name, "NA"]
+            scores, n_binders = [], 0
+            for allele in alleles:
+                rank = (_score(peptide, allele) % 4000) / 100
+                score = (_score(allele, peptide) % 10000) / 10000
+                scores.append(score)
+                n_binders += rank <= rank_weak
+                row += [peptide[3:12], "0", f"{score:.4f}", f"{rank:.2f}"]
+            f.write("\t".join(row + [f"{sum(scores) / len(scores):.4f}", str(n_binders)]) + "\n")
+    return len(entries)
+
+
+def write_mixmhc2pred_output(pep_file, alleles, output_file):
+    """Write a MixMHC2pred-shaped output (19 comment lines, then the table) for a .pep file."""
+    peptides = _read_peptides(pep_file)
+    with open(output_file, "w") as f:
+        # Like MixMHC2pred, name the input file among the metadata lines
+        f.write(f"# Input file: {pep_file}\n")
+        for i in range(1, 19):
+            f.write(f"# Stand-in MixMHC2pred output, metadata line {i + 1}\n")
+        f.write("\t".join(["Peptide", "Context", "BestAllele", "%Rank_best", "Core_best", "CoreP1_best"]
+                          + [f"{column}_{allele}" for allele in alleles for column in ["Core", "CoreP1", "%Rank"]]) + "\n")
+        for peptide in peptides:
+            ranks = [(_score(peptide, allele) % 4000) / 100 for allele in alleles]
+            best = min(range(len(alleles)), key=lambda i: ranks[i])
+            row = [peptide, "NA", alleles[best], f"{ranks[best]:g}", peptide[2:11], "3"]
+            for rank in ranks:
+                row += [peptide[2:11], "3", f"{rank:g}"]
+            f.write("\t".join(row) + "\n")
+    return len(peptides)
+
+
+def netmhciipan_main(args):
+    """Command line of the stand-in netMHCIIpan: [-inptype 0|1 -length <lengths>] [-rankW <rank>] -f <input> -a <alleles> -xls -xlsfile <file>."""
+    alleles = args[args.index("-a") + 1].split(",")
+    lengths = None
+    if "-inptype" in args and args[args.index("-inptype") + 1] == "0":
+        lengths = [int(length) for length in args[args.index("-length") + 1].split(",")] if "-length" in args else [15]
+    rank_weak = float(args[args.index("-rankW") + 1]) if "-rankW" in args else 5
+    n_peptides = write_netmhciipan_xls(args[args.index("-f") + 1], alleles, args[args.index("-xlsfile") + 1], lengths,
+                                       rank_weak)
+    print(f"# Stand-in NetMHCIIpan: {n_peptides} peptides x {len(alleles)} alleles")
+
+
+def mixmhc2pred_main(args):
+    """Command line of the stand-in MixMHC2pred_unix: -i <pep file> -o <output> -a <allele> ... [--options]."""
+    alleles = []
+    for value in args[args.index("-a") + 1:]:
+        if value.startswith("-"):
+            break
+        alleles.append(value)
+    n_peptides = write_mixmhc2pred_output(args[args.index("-i") + 1], alleles, args[args.index("-o") + 1])
+    print(f"# Stand-in MixMHC2pred: {n_peptides} peptides x {len(alleles)} alleles")
+
+
+def ensure_executable():
+    """Make sure the stand-in executables carry the execute bit (it is lost on some checkouts)."""
+    for executable in [os.path.join(FAKE_NETMHCIIPAN_PATH, "netMHCIIpan"),
+                       os.path.join(FAKE_MIXMHC2PRED_PATH, "MixMHC2pred_unix")]:
+        mode = os.stat(executable).st_mode
+        if not mode & stat.S_IXUSR:
+            os.chmod(executable, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
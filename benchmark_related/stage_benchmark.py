@@ -0,0 +1,221 @@
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from annovar_related.fasta_to_df import fasta_to_dataframe
+from annovar_related.variant_table import build_variant_table
+from annovar_related.drop_imme_stopgain import filter_immediate_stopgain
+from annovar_related.mut_pep_generator import mut_pep_generator
+from annovar_related.extract_gene_name import extract_gene_names_from_dynamic_file
+from annovar_related.peptide_map import build_peptide_variant_map
+from annovar_related.pep_file_generator import save_mutated_peptides_to_pep
+from expression_related.expression_store import ExpressionStore
+from expression_related.expression_prefilter import prefilter_unexpressed_peptides
+from netMHCIIpan_related.trigger_netMHCIIpan import trigger_netMHCIIpan
+from netMHCIIpan_related.netMHCIIpan_postprocess import process_netMHCIIpan_results_by_allele
+from netMHCIIpan_related.cluster_result import cluster_peptides_by_gene
+from MixMHC2pred_related.trigger_mixMHC2pred import trigger_MixMHC2pred
+from MixMHC2pred_related.mixMHC2pred_postprocess import process_MixMHC2pred_results
+from benchmark_related.synthetic_data import (write_synthetic_annovar_outputs, write_synthetic_expression,
+                                              synthetic_alleles)
+from benchmark_related.fake_predictors import FAKE_NETMHCIIPAN_PATH, FAKE_MIXMHC2PRED_PATH, ensure_executable
+
+# 'relative_time' is seconds / calibration_seconds(), so baselines from other machines stay comparable
+RESULT_COLUMNS = ["n_variants", "stage", "seconds", "relative_time", "peak_mib", "rows"]
+
+# A stage is a regression when it is this many times slower (or bigger) than the baseline ...
+DEFAULT_TOLERANCE = 1.5
+# ... and slower by more than this, so timer noise on sub-millisecond stages is ignored
+MIN_SECONDS_DIFFERENCE = 0.05
+MIN_PEAK_MIB_DIFFERENCE = 5.0
+
+
+def calibration_seconds(repeats=5):
+    """
+    Time a fixed reference workload on this machine (fastest of `repeats` runs).
+
+    The workload mixes what the stages spend their time on (NumPy sorting, pandas
+    grouping and Python string slicing), so dividing a stage time by it cancels most
+    of the difference between machines.
+    """
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 1000, 1_000_000)
+    protein = "".join(rng.choice(list("ACDEFGHIKLMNPQRSTVWY"), 5000))
+
+    best = None
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        np.sort(values)
+        pd.Series(values).groupby(values % 97).sum()
+        len({protein[i:i + length] for length in range(12, 26) for i in range(len(protein) - length + 1)})
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def _rows(result):
+    """Row count of a stage result (DataFrame, file list, ...), or None when it has none."""
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return None
+
+
+def _pipeline_stages(sample_dir, files, alleles, tpm_threshold):
+    """
+    The benchmarked stages in pipeline order: (name, function of the previous results).
+
+    Each function receives the dict of earlier stage results and returns its own,
+    so the stages are chained exactly as in main_script.py.
+    """
+    annovar_outputs_dir = os.path.join(sample_dir, "annovar_outputs")
+    netmhciipan_alleles, mixmhc2pred_alleles = alleles
+    netmhciipan_dir = os.path.join(sample_dir, "netMHCIIpan_outputs")
+    mixmhc2pred_dir = os.path.join(sample_dir, "MixMHC2pred_outputs")
+
+    def clustering_input(results):
+        # The string-overlap clustering, fed every (gene, peptide) pair of the peptide map
+        return results["build_peptide_variant_map"][["Gene Name", "Peptide"]].astype(str).drop_duplicates()
+
+    return [
+        ("fasta_to_dataframe", lambda r: fasta_to_dataframe(files["fasta"])),
+        ("build_variant_table", lambda r: build_variant_table(r["fasta_to_dataframe"])),
+        ("filter_immediate_stopgain", lambda r: filter_immediate_stopgain(r["build_variant_table"])),
+        ("mut_pep_generator", lambda r: mut_pep_generator(r["filter_immediate_stopgain"], window_mode="tile")),
+        ("extract_gene_names", lambda r: extract_gene_names_from_dynamic_file(
+            "synthetic.vcf", annovar_outputs_dir, r["mut_pep_generator"].copy())),
+        ("load_expression", lambda r: ExpressionStore.load(files["expression"])),
+        ("prefilter_unexpressed_peptides", lambda r: prefilter_unexpressed_peptides(
+            r["extract_gene_names"], r["load_expression"].tpm, n_alleles=len(netmhciipan_alleles) + len(mixmhc2pred_alleles))),
+        ("build_peptide_variant_map", lambda r: build_peptide_variant_map(r["prefilter_unexpressed_peptides"])),
+        ("save_pep_file", lambda r: save_mutated_peptides_to_pep(
+            r["prefilter_unexpressed_peptides"], annovar_outputs_dir, r["build_peptide_variant_map"])),
+        ("netMHCIIpan", lambda r: trigger_netMHCIIpan(FAKE_NETMHCIIPAN_PATH, annovar_outputs_dir,
+                                                      alleles=netmhciipan_alleles, output_dir=netmhciipan_dir)),
+        ("MixMHC2pred", lambda r: trigger_MixMHC2pred(FAKE_MIXMHC2PRED_PATH, annovar_outputs_dir,
+                                                      alleles=mixmhc2pred_alleles, output_dir=mixmhc2pred_dir)),
+        ("cluster_peptides_by_gene", lambda r: cluster_peptides_by_gene(clustering_input(r))),
+        ("netMHCIIpan_postprocess", lambda r: process_netMHCIIpan_results_by_allele(
+            r["netMHCIIpan"], os.path.join(netmhciipan_dir, "allele_results"), r["prefilter_unexpressed_peptides"],
+            files["expression"], tpm_threshold, r["build_peptide_variant_map"], expression_store=r["load_expression"])),
+        ("MixMHC2pred_postprocess", lambda r: process_MixMHC2pred_results(
+            r["MixMHC2pred"], os.path.join(mixmhc2pred_dir, "allele_results"), r["prefilter_unexpressed_peptides"],
+            files["expression"], tpm_threshold, r["build_peptide_variant_map"], expression_store=r["load_expression"])),
+    ]
+
+
+def _run_chain(stages, trace_memory):
+    """Run the stages once; return {stage: result} and {stage: (seconds, peak bytes or None)}."""
+    results, measurements = {}, {}
+    for name, function in stages:
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        results[name] = function(results)
+        seconds = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        measurements[name] = (seconds, peak)
+    return results, measurements
+
+
+def benchmark_pipeline(n_variants, work_dir, protein_length=500, n_alleles=3, repeats=3, tpm_threshold=1.0, seed=0,
+                       calibration=None):
+    """
+    Time every pipeline stage on a synthetic sample of n_variants variants.
+
+    The stages run `repeats` times and the fastest time is kept; one more run under
+    tracemalloc gives each stage's peak Python memory (including NumPy and pandas
+    buffers). tracemalloc slows the code down, so that run is never timed. The
+    predictors are the stand-in executables of fake_predictors.py; their peak memory
+    is that of this process only.
+
+    Parameters:
+        n_variants (int): Number of synthetic variants.
+        work_dir (str): Scratch folder for the synthetic sample and its outputs.
+        protein_length (int): Mean protein length of the synthetic genes.
+        n_alleles (int): Alleles per predictor.
+        repeats (int): Timed runs per stage.
+        tpm_threshold (float): TPM threshold of the postprocessors.
+        seed (int): Seed of the synthetic data.
+        calibration (float): calibration_seconds() of this machine (measured when None).
+
+    Returns:
+        pd.DataFrame: RESULT_COLUMNS, one row per stage.
+    """
+    if calibration is None:
+        calibration = calibration_seconds()
+    ensure_executable()
+    sample_dir = os.path.join(work_dir, f"variants_{n_variants}")
+    files = write_synthetic_annovar_outputs(os.path.join(sample_dir, "annovar_outputs"), n_variants,
+                                            protein_length=protein_length, seed=seed)
+    files["expression"] = write_synthetic_expression(os.path.join(sample_dir, "gene_expression.csv"),
+                                                     files["genes"], seed=seed)
+    stages = _pipeline_stages(sample_dir, files, synthetic_alleles(n_alleles), tpm_threshold)
+
+    best = {}
+    for _ in range(max(1, repeats)):
+        results, measurements = _run_chain(stages, trace_memory=False)
+        for name, (seconds, _) in measurements.items():
+            best[name] = min(best.get(name, seconds), seconds)
+    _, traced = _run_chain(stages, trace_memory=True)
+
+    table = pd.DataFrame(
+        [(n_variants, name, best[name], best[name] / calibration, traced[name][1] / 2 ** 20, _rows(results[name]))
+         for name, _ in stages],
+        columns=RESULT_COLUMNS,
+    )
+    table["rows"] = table["rows"].astype("Int64")
+    return table
+
+
+def run_benchmarks(sizes=(100, 1000, 10000), work_dir="benchmark_work", **options):
+    """
+    Run benchmark_pipeline for every size and print each size's stage table.
+
+    Returns:
+        pd.DataFrame: RESULT_COLUMNS for all sizes.
+    """
+    calibration = calibration_seconds()
+    print(f"Calibration workload: {calibration:.4f} s (stage times are also reported relative to it)")
+    tables = []
+    for n_variants in sizes:
+        print(f"Benchmarking {n_variants} variants......")
+        table = benchmark_pipeline(n_variants, work_dir, calibration=calibration, **options)
+        print(table.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+def compare_to_baseline(results, baseline_file, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare benchmark results with a stored baseline (a CSV of an earlier run_benchmarks).
+
+    Times are compared relative to each machine's calibration workload: a stage regresses
+    when its relative time is more than `tolerance` times the baseline's and it takes at
+    least MIN_SECONDS_DIFFERENCE longer than the baseline scaled to this machine, or when its
+    peak memory grows likewise (by at least MIN_PEAK_MIB_DIFFERENCE).
+
+    Returns:
+        pd.DataFrame: Results joined with the baseline ('_baseline' columns), the time and
+        memory ratios and a boolean 'regression' column. Stages or sizes missing from the
+        baseline have NaN ratios and never regress.
+    """
+    baseline = pd.read_csv(baseline_file)
+    if "relative_time" not in baseline.columns:
+        raise ValueError(f"{baseline_file} has no relative timings; refresh it with benchmark_script.py --save-baseline.")
+    merged = results.merge(baseline[["n_variants", "stage", "seconds", "relative_time", "peak_mib"]],
+                           on=["n_variants", "stage"], how="left", suffixes=("", "_baseline"))
+    merged["time_ratio"] = merged["relative_time"] / merged["relative_time_baseline"]
+    merged["memory_ratio"] = merged["peak_mib"] / merged["peak_mib_baseline"]
+    expected_seconds = merged["seconds"] / merged["time_ratio"]
+    slower = (merged["time_ratio"] > tolerance) & (merged["seconds"] - expected_seconds > MIN_SECONDS_DIFFERENCE)
+    bigger = (merged["memory_ratio"] > tolerance) & (merged["peak_mib"] - merged["peak_mib_baseline"] > MIN_PEAK_MIB_DIFFERENCE)
+    merged["regression"] = slower | bigger
+    return merged
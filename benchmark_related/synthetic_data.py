@@ -0,0 +1,143 @@
+import os
+import random
+
+from annovar_related.coding_change import describe_change
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+# Share of each variant kind in the synthetic ANNOVAR output (the rest are amino acid replacements)
+VARIANT_MIX = {"frameshift": 0.15, "insertion": 0.08, "deletion": 0.07, "immediate-stopgain": 0.05}
+
+# exonic_variant_function category of each variant kind
+_EXONIC_FUNCTION = {
+    "replacement": "nonsynonymous SNV",
+    "frameshift": "frameshift deletion",
+    "insertion": "nonframeshift insertion",
+    "deletion": "nonframeshift deletion",
+    "immediate-stopgain": "stopgain",
+}
+
+
+def _random_protein(rng, length):
+    """A random protein of the given length (including the leading M), ending with the stop '*'."""
+    return "M" + "".join(rng.choice(AMINO_ACIDS) for _ in range(length - 1)) + "*"
+
+
+def _other_residue(rng, residue):
+    return rng.choice([amino_acid for amino_acid in AMINO_ACIDS if amino_acid != residue])
+
+
+def _mutate(rng, kind, wildtype):
+    """
+    Apply one synthetic change to a wildtype protein.
+
+    Returns:
+        tuple: (cDNA change, protein change, mutant protein), named like ANNOVAR's coding_change.pl output.
+    """
+    position = rng.randint(2, len(wildtype) - 2)  # 1-based, never the start or stop residue
+    reference = wildtype[position - 1]
+    codon_end = 3 * position
+
+    if kind == "replacement":
+        alternative = _other_residue(rng, reference)
+        return (f"c.{rng.choice('ACGT')}{codon_end}{rng.choice('ACGT')}", f"p.{reference}{position}{alternative}",
+                wildtype[:position - 1] + alternative + wildtype[position:])
+    if kind == "immediate-stopgain":
+        return f"c.{rng.choice('ACGT')}{codon_end}A", f"p.{reference}{position}X", wildtype[:position - 1] + "*"
+    if kind == "deletion":
+        return f"c.{codon_end - 2}_{codon_end}del", f"p.{reference}{position}del", wildtype[:position - 1] + wildtype[position:]
+    if kind == "insertion":
+        inserted = "".join(rng.choice(AMINO_ACIDS) for _ in range(rng.randint(1, 3)))
+        return (f"c.{codon_end}_{codon_end + 1}ins{'N' * 3 * len(inserted)}",
+                f"p.{reference}{position}_{wildtype[position]}{position + 1}ins{inserted}",
+                wildtype[:position] + inserted + wildtype[position:])
+
+    # Frameshift: a new tail of tail_length residues (the last one being the new stop) from the position on
+    tail_length = rng.randint(2, 120)
+    tail = _other_residue(rng, reference) + "".join(rng.choice(AMINO_ACIDS) for _ in range(tail_length - 2))
+    return (f"c.{codon_end}del{rng.choice('ACGT')}", f"p.{reference}{position}{tail[0]}fs*{tail_length}",
+            wildtype[:position - 1] + tail + "*")
+
+
+def _write_fasta_record(f, header, sequence, width=60):
+    f.write(f">{header}\n")
+    for i in range(0, len(sequence), width):
+        f.write(sequence[i:i + width] + "\n")
+
+
+def write_synthetic_annovar_outputs(output_dir, n_variants, protein_length=500, vcf_name="synthetic", seed=0):
+    """
+    Write a synthetic ANNOVAR mutated_proteins.fasta and the matching exonic_variant_function.
+
+    Every variant hits a random protein of a gene shared by about two variants. The
+    FASTA holds a WILDTYPE record before each mutant, as coding_change.pl writes it;
+    VARIANT_MIX sets the share of frameshifts, in-frame indels and stop-gains.
+
+    Parameters:
+        output_dir (str): Folder for the two files (an 'annovar_outputs' stand-in).
+        n_variants (int): Number of variants.
+        protein_length (int): Mean wildtype protein length; lengths vary by +-50%.
+        vcf_name (str): Base name of the files, as if ANNOVAR had annotated '<vcf_name>.vcf'.
+        seed (int): Random seed; the same arguments always give the same files.
+
+    Returns:
+        dict: Paths of 'fasta' and 'exonic_variant_function', and the sorted 'genes'.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    fasta_file = os.path.join(output_dir, f"{vcf_name}.mutated_proteins.fasta")
+    variant_function_file = os.path.join(output_dir, f"{vcf_name}.refGene.exonic_variant_function")
+
+    n_genes = max(1, n_variants // 2)
+    genes = [(f"GENE{i}", f"NM_{100000 + i}",
+              _random_protein(rng, rng.randint(max(30, protein_length // 2), max(30, 3 * protein_length // 2))))
+             for i in range(n_genes)]
+    kinds, weights = zip(*VARIANT_MIX.items())
+    kinds, weights = kinds + ("replacement",), weights + (1 - sum(weights),)
+
+    with open(fasta_file, "w") as fasta, open(variant_function_file, "w") as variant_function:
+        for line in range(1, n_variants + 1):
+            gene, transcript, wildtype = rng.choice(genes)
+            kind = rng.choices(kinds, weights)[0]
+            cdna_change, protein_change, mutant = _mutate(rng, kind, wildtype)
+            mutation_type, description = describe_change(wildtype, mutant, kind == "frameshift")
+
+            _write_fasta_record(fasta, f"line{line} {transcript} WILDTYPE", wildtype)
+            _write_fasta_record(fasta, f"line{line} {transcript} {cdna_change} {protein_change} {mutation_type} "
+                                       f"({description})", mutant)
+            variant_function.write(f"line{line}\t{_EXONIC_FUNCTION[kind]}\t"
+                                   f"{gene}:{transcript}:exon1:{cdna_change}:{protein_change},\t"
+                                   f"chr{rng.randint(1, 22)}\t{line}\t{line}\tA\tG\n")
+
+    return {"fasta": fasta_file, "exonic_variant_function": variant_function_file,
+            "genes": sorted(gene for gene, _, _ in genes)}
+
+
+def write_synthetic_expression(expression_file, genes, sample_columns=("tpm_sampleTest",), seed=0):
+    """
+    Write a gene expression CSV (gene_name plus one TPM column per sample) for the given genes.
+
+    About 10% of the genes are left out and another 10% get a TPM of 0, so the
+    expression pre-filter and the 'Considered Target' flag both have work to do.
+    """
+    rng = random.Random(seed)
+    with open(expression_file, "w") as f:
+        f.write(",".join(["gene_name"] + list(sample_columns)) + "\n")
+        for gene in genes:
+            draw = rng.random()
+            if draw < 0.1:
+                continue
+            values = ["0" if draw < 0.2 else f"{rng.uniform(0, 50):.2f}" for _ in sample_columns]
+            f.write(",".join([gene] + values) + "\n")
+    return expression_file
+
+
+def synthetic_alleles(n_alleles):
+    """
+    Return n_alleles made-up DRB1 allele names as (NetMHCIIpan names, MixMHC2pred names).
+
+    The stand-in predictors accept any name, so allele count can be varied freely.
+    """
+    netmhciipan = [f"DRB1_{i + 1:02d}01" for i in range(n_alleles)]
+    mixmhc2pred = [f"DRB1_{i + 1:02d}_01" for i in range(n_alleles)]
+    return netmhciipan, mixmhc2pred
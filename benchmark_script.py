@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+
+from benchmark_related.stage_benchmark import DEFAULT_TOLERANCE, run_benchmarks, compare_to_baseline
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_related", "baseline.csv")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Time every pipeline stage on synthetic variants with stand-in predictors.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="Numbers of variants to benchmark (default: 100 1000 10000)")
+    parser.add_argument("--protein-length", type=int, default=500, help="Mean synthetic protein length (default: 500)")
+    parser.add_argument("--alleles", type=int, default=3, help="Alleles per predictor (default: 3)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per stage; the fastest is kept (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data (default: 0)")
+    parser.add_argument("--work-dir", default="benchmark_work", help="Scratch folder (default: benchmark_work)")
+    parser.add_argument("--output", default="benchmark_results.csv", help="Results CSV (default: benchmark_results.csv)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline CSV to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Slowdown or memory growth factor counted as a regression (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_benchmarks(args.sizes, args.work_dir, protein_length=args.protein_length, n_alleles=args.alleles,
+                             repeats=args.repeats, seed=args.seed)
+    results.to_csv(args.output, index=False)
+    print(f"Benchmark results saved to: {args.output}")
+
+    if args.save_baseline:
+        results.to_csv(args.baseline, index=False, float_format="%.4f")
+        print(f"Baseline saved to: {args.baseline}")
+    elif os.path.isfile(args.baseline):
+        comparison = compare_to_baseline(results, args.baseline, tolerance=args.tolerance)
+        columns = ["n_variants", "stage", "seconds", "relative_time", "relative_time_baseline", "time_ratio",
+                   "peak_mib", "peak_mib_baseline", "memory_ratio", "regression"]
+        print(comparison[columns].to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+        regressions = comparison[comparison["regression"]]
+        if not regressions.empty:
+            print(f"{len(regressions)} stage(s) regressed against the baseline: "
+                  f"{', '.join(f'{row.stage} ({row.n_variants})' for row in regressions.itertuples())}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+    else:
+        print(f"No baseline found at {args.baseline}; run with --save-baseline to store one.")
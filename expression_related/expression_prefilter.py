@@ -0,0 +1,43 @@
+import pandas as pd
+
+from annovar_related.peptide_windows import empty_windows, materialise_peptides, window_table
+
+
+def prefilter_unexpressed_peptides(mutated_peptides_df_with_genes, gene_tpm, min_tpm=0.0, n_alleles=None):
+    """
+    Drop the peptides of unexpressed genes before they are sent to the predictors.
+
+    Postprocessing discards binders whose gene has missing or zero expression, so with
+    the default min_tpm the peptides removed here could never reach a result file.
+    A peptide shared with an expressed gene is kept (through that gene's record).
+
+    Parameters:
+        mutated_peptides_df_with_genes (pd.DataFrame): Generator output with 'Gene Name'.
+        gene_tpm (pd.Series): Gene name -> TPM (e.g. ExpressionStore.tpm).
+        min_tpm (float): Genes need a TPM above this value to keep their peptides.
+        n_alleles (int): Alleles each peptide is predicted against, to report the saved predictions.
+
+    Returns:
+        pd.DataFrame: Copy with the peptide windows of unexpressed records emptied.
+    """
+    filtered_df = mutated_peptides_df_with_genes.copy()
+
+    # Missing genes count as unexpressed, as in postprocessing
+    expressed = filtered_df["Gene Name"].map(gene_tpm).fillna(0) > min_tpm
+    unexpressed = filtered_df["peptide_starts"].notna() & ~expressed
+
+    # The peptide strings are sliced once, to count the unique peptides with and without the unexpressed records
+    windows = window_table(filtered_df)
+    peptides = pd.Series(materialise_peptides(filtered_df, windows))
+    before = peptides.nunique()
+    after = peptides[expressed.to_numpy()[windows["Row"].to_numpy()]].nunique()
+    removed = before - after
+
+    for col, empty in zip(["peptide_starts", "peptide_lengths"], empty_windows(len(filtered_df))):
+        filtered_df[col] = filtered_df[col].where(~unexpressed, pd.Series(empty, index=filtered_df.index, dtype=object))
+    print(f"Expression pre-filter: {unexpressed.sum()} variant records from "
+          f"{filtered_df.loc[unexpressed, 'Gene Name'].nunique()} unexpressed genes skipped; "
+          f"{removed} of {before} unique peptides removed.")
+    if n_alleles:
+        print(f"Predictor calls saved: {removed} peptides x {n_alleles} alleles = {removed * n_alleles} predictions.")
+    return filtered_df
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Gene name column and default sample column of the expression CSV
+GENE_COLUMN = "gene_name"
+DEFAULT_SAMPLE_COLUMNS = ["tpm_sampleTest"]
+
+
+def file_hash(path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExpressionStore:
+    """
+    Gene expression matrix parsed once and shared by every pipeline stage.
+
+    Values are held as a (samples x genes) float array so one sample column is a
+    contiguous row; genes are deduplicated (first occurrence kept) and indexed by
+    name. The selected sample column(s) give each gene's TPM; with several columns
+    their mean is used.
+
+    Parameters:
+        genes (list): Gene names, one per matrix column.
+        samples (list): Sample column names, one per matrix row.
+        matrix (np.ndarray): TPM values, shape (len(samples), len(genes)); may be memory-mapped.
+        sample_columns (list): Sample column(s) to use (None = DEFAULT_SAMPLE_COLUMNS).
+    """
+
+    def __init__(self, genes, samples, matrix, sample_columns=None):
+        self.gene_index = pd.Index(genes, name=GENE_COLUMN)
+        self.samples = list(samples)
+        self.matrix = matrix
+        self._tpm = None
+        self.select(sample_columns or DEFAULT_SAMPLE_COLUMNS)
+
+    @classmethod
+    def load(cls, expression_file, sample_columns=None, cache_dir=None):
+        """
+        Load an expression CSV, using its binary sidecar when one exists for the same file contents.
+
+        The sidecar is '<sha256>.npy' (memory-mapped on load) plus '<sha256>.json' (gene and
+        sample names) in cache_dir, by default an 'expression_cache' folder next to the CSV.
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(expression_file)), "expression_cache")
+        key = file_hash(expression_file)
+        matrix_file = os.path.join(cache_dir, f"{key}.npy")
+        names_file = os.path.join(cache_dir, f"{key}.json")
+
+        if os.path.isfile(matrix_file) and os.path.isfile(names_file):
+            with open(names_file, "r") as f:
+                names = json.load(f)
+            print(f"Loaded gene expression from the binary cache: {matrix_file}")
+            return cls(names["genes"], names["samples"], np.load(matrix_file, mmap_mode="r"), sample_columns)
+
+        # Parse the CSV once: keep the first row of each gene and every numeric sample column
+        expression_df = pd.read_csv(expression_file)
+        expression_df.drop_duplicates(subset=[GENE_COLUMN], keep="first", inplace=True)
+        sample_df = expression_df.drop(columns=[GENE_COLUMN]).select_dtypes("number")
+        matrix = np.ascontiguousarray(sample_df.to_numpy(dtype=np.float64).T)
+        genes = expression_df[GENE_COLUMN].astype(str).tolist()
+        samples = list(sample_df.columns)
+
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(matrix_file, matrix)
+            with open(names_file, "w") as f:
+                json.dump({"genes": genes, "samples": samples}, f)
+            print(f"Gene expression binary cache written to: {matrix_file}")
+        except OSError as e:
+            print(f"Could not write the gene expression binary cache ({e}); continuing without it.")
+
+        return cls(genes, samples, matrix, sample_columns)
+
+    def select(self, sample_columns):
+        """Select the sample column(s) whose (mean) TPM is used for every gene."""
+        sample_columns = [sample_columns] if isinstance(sample_columns, str) else list(sample_columns)
+        missing = [col for col in sample_columns if col not in self.samples]
+        if missing:
+            raise ValueError(f"Sample column(s) {missing} not found in the gene expression file. "
+                             f"Available columns: {self.samples}")
+        self.sample_columns = sample_columns
+        self._tpm = None
+
+    @property
+    def tpm(self):
+        """pd.Series: Gene name -> TPM of the selected sample column(s)."""
+        if self._tpm is None:
+            rows = [self.samples.index(col) for col in self.sample_columns]
+            values = np.asarray(self.matrix[rows]).mean(axis=0)
+            self._tpm = pd.Series(values, index=self.gene_index, name="TPM")
+        return self._tpm
+
+    def median_tpm(self):
+        """Median TPM over expressed genes (TPM > 0)."""
+        tpm = self.tpm
+        return tpm[tpm > 0].median()
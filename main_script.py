@@ -1,110 +1,305 @@
 import os
-import pandas as pd
 from annovar_related.vcf_path_prompt import vcf_path_prompt
 from annovar_related.annovar_dir_search import find_or_prompt_annovar_path
 from annovar_related.trigger_annovar import trigger_annovar
 from annovar_related.fasta_to_df import fasta_to_dataframe
+from annovar_related.variant_table import build_variant_table
 from annovar_related.drop_imme_stopgain import filter_immediate_stopgain
 from annovar_related.mut_pep_generator import mut_pep_generator
 from annovar_related.extract_gene_name import extract_gene_names_from_dynamic_file
 from annovar_related.pep_file_generator import save_mutated_peptides_to_pep
+from annovar_related.peptide_map import build_peptide_variant_map
+from annovar_related.peptide_windows import save_mutated_peptides_csv
+from annovar_related.peptide_npz import save_mutated_peptides_npz
 
 from netMHCIIpan_related.netMHCIIpan_path_prompt import find_or_prompt_netMHCIIpan_path
-from netMHCIIpan_related.trigger_netMHCIIpan import trigger_netMHCIIpan
+from netMHCIIpan_related.trigger_netMHCIIpan import trigger_netMHCIIpan, trigger_netMHCIIpan_contexts
 from netMHCIIpan_related.netMHCIIpan_postprocess import process_netMHCIIpan_results_by_allele
 
 from MixMHC2pred_related.mixMHC2pred_path_prompt import find_or_prompt_MixMHC2pred_path
 from MixMHC2pred_related.trigger_mixMHC2pred import trigger_MixMHC2pred
 from MixMHC2pred_related.mixMHC2pred_postprocess import process_MixMHC2pred_results
 
+from expression_related.expression_store import ExpressionStore
+from expression_related.expression_prefilter import prefilter_unexpressed_peptides
+
+from pipeline_related.stage_scheduler import run_stages
+from pipeline_related.checkpoint import PipelineCheckpoint
+from pipeline_related.prediction_cache import PredictionCache
+from pipeline_related.metrics import start_recording
+
+# ------------------- Settings -------------------
+# ANNOVAR annotates the variants in one run (None) or in shards ('chromosome', 'block' of ANNOVAR_BLOCK_SIZE variants);
+# shards leave their multianno tables unmerged in annovar_outputs/shards/
+ANNOVAR_SHARD_BY = None
+ANNOVAR_BLOCK_SIZE = 50000
+ANNOVAR_WORKERS = os.cpu_count() or 1
+
+# NetMHCIIpan can be split into peptide chunks (and optionally allele groups) run in parallel; 1 = single run
+NETMHCIIPAN_SHARDS = 1
+NETMHCIIPAN_ALLELES_PER_JOB = None  # None = all alleles in every job
+NETMHCIIPAN_WORKERS = os.cpu_count() or 1
+# 'peptides' sends the .pep file (-inptype 1); 'contexts' sends one mutant region per variant as FASTA (-inptype 0)
+# and lets NetMHCIIpan cut the PEPTIDE_MIN_LENGTH-PEPTIDE_MAX_LENGTH windows itself (no prediction cache)
+NETMHCIIPAN_INPUT = "peptides"
+
+# Predictions are cached per (tool, version, allele, peptide) so reruns only predict new peptides;
+# the NetMHCIIpan plain-text output then only covers the newly predicted peptides
+USE_PREDICTION_CACHE = False
+PREDICTION_CACHE_MAX_ENTRIES = 50_000_000  # None = unlimited
+
+# Sample column(s) of the gene expression file used as each gene's TPM (several = their mean)
+EXPRESSION_SAMPLE_COLUMNS = ["tpm_sampleTest"]
+
+# Skip peptides of genes without expression (TPM > PREFILTER_MIN_TPM) before running the predictors
+PREFILTER_UNEXPRESSED = False
+PREFILTER_MIN_TPM = 0.0
+
+# Peptide lengths, and how frameshift tails and long insertions are cut into peptides: 'sample' = 30 random starts
+# per length (as in batch mode), 'tile' = fewest peptides putting every novel 9-mer binding core in at least
+# MIN_CORE_COVERAGE of them
+PEPTIDE_MIN_LENGTH = 12
+PEPTIDE_MAX_LENGTH = 25
+FRAMESHIFT_WINDOW_MODE = "sample"
+MIN_CORE_COVERAGE = 2
+# Peptide generation processes (the peptides are identical for any number)
+PEPTIDE_WORKERS = os.cpu_count() or 1
+
+# The generated peptides are saved as a columnar .npz (see load_mutated_peptides_npz); True also writes a CSV copy
+WRITE_MUTATED_PEPTIDES_CSV = False
+
+# Finished stages and prompt answers are recorded here; a rerun skips stages whose inputs are unchanged
+CHECKPOINT_DIR = "pipeline_checkpoint"
+RESUME_FROM_CHECKPOINT = True  # False = start afresh and ask every question again
+
+# Every stage and external command appends its timings, memory and row counts to this JSON-lines file
+METRICS_FILE = "pipeline_metrics.jsonl"  # None = no metrics
+PROFILE_STAGES = None  # None, 'cprofile' (a .prof file per stage) or 'tracemalloc' (top allocation sites)
+
+checkpoint = PipelineCheckpoint(CHECKPOINT_DIR, resume=RESUME_FROM_CHECKPOINT)
+if METRICS_FILE:
+    start_recording(METRICS_FILE, profile=PROFILE_STAGES)
+
 # ------------------- Step 1: Prompt for VCF File -------------------
-vcf_file_path = vcf_path_prompt()
+vcf_file_path = checkpoint.answer("vcf_file_path", vcf_path_prompt, os.path.isfile)
 if vcf_file_path:
     print("Looking for ANNOVAR directory......")
 
 # ------------------- Step 2: Find or Prompt ANNOVAR Path -------------------
-annovar_path = find_or_prompt_annovar_path()
+annovar_path = checkpoint.answer("annovar_path", find_or_prompt_annovar_path, os.path.isdir)
 annovar_output_dir = os.path.join(os.path.dirname(annovar_path), "annovar_outputs")
 print(f"Your ANNOVAR path is set to: {annovar_path}")
 
-# ------------------- Step 3: Run ANNOVAR -------------------
-fasta_path = trigger_annovar(vcf_file_path=vcf_file_path, annovar_path=annovar_path)
-print("The fasta file is at: ", fasta_path, "     Start converting to DataFrame.......")
-
-# ------------------- Step 4: Convert fasta to DataFrame -------------------
-df = fasta_to_dataframe(fasta_path)
-
-# ------------------- Step 5: Filter out immediate-stopgain -------------------
-print("Filtering out immediate-stopgain.........")
-mutation_df = filter_immediate_stopgain(df)
-print("Filtering done!")
-
-# ------------------- Step 6: Generate mutation peptide sequences -------------------
-mutated_peptides_df = mut_pep_generator(mutation_df)
-print("Mutation peptide sequences extracted!")
-
-# ------------------- Step 7: Bind with Gene Name (for gene expression analysis) -------------------
-mutated_peptides_df_with_genes = extract_gene_names_from_dynamic_file(
-    vcf_file_path=vcf_file_path,
-    output_dir=annovar_output_dir,
-    mutated_peptides_df=mutated_peptides_df
-)
-print(mutated_peptides_df_with_genes.head())
-output_csv_path = "mutated_peptides_with_genes.csv"
-mutated_peptides_df_with_genes.to_csv(output_csv_path, index=False)
-print(f"File saved successfully at: {output_csv_path}")
-
-# ------------------- Step 8: Generate .pep File -------------------
-save_mutated_peptides_to_pep(mutated_peptides_df_with_genes, annovar_output_dir)
-
-# ------------------- Step 9: Prompt for Gene Expression File -------------------
-gene_expression_file = input("Enter the full path to the gene expression CSV file: ").strip()
-
-# Read Gene Expression Data
-gene_expression_df = pd.read_csv(gene_expression_file)
-gene_expression_df.drop_duplicates(subset=["gene_name"], keep="first", inplace=True)
-gene_expression_df.set_index("gene_name", inplace=True)
-
-# Remove TPM = 0 before calculating the median
-non_zero_gene_expression = gene_expression_df[gene_expression_df["tpm_sampleTest"] > 0]
-median_tpm = non_zero_gene_expression["tpm_sampleTest"].median()
-print(f"The median TPM value of the gene expression data (excluding zeros) is: {median_tpm:.2f}")
-
-# Prompt for TPM Threshold
-while True:
-    try:
-        tpm_threshold = float(input(f"Please enter the TPM threshold (recommendation: > {median_tpm:.2f}): "))
-        if tpm_threshold < 0:
-            print("Threshold must be a non-negative number. Please try again.")
-        else:
-            break
-    except ValueError:
-        print("Invalid input. Please enter a numeric value.")
-
-# ------------------- NetMHCIIpan Processing -------------------
-# Step 10: Find or Prompt NetMHCIIpan Path
-netMHCIIpan_path = find_or_prompt_netMHCIIpan_path()
+prediction_cache = None
+if USE_PREDICTION_CACHE:
+    prediction_cache_path = os.path.join(os.path.dirname(annovar_path), "prediction_cache", "predictions.sqlite")
+    prediction_cache = PredictionCache(prediction_cache_path, max_entries=PREDICTION_CACHE_MAX_ENTRIES)
+    print(f"Using the prediction cache at: {prediction_cache_path}")
+
+# ------------------- Step 3: Prompt for Gene Expression File -------------------
+gene_expression_file = checkpoint.answer(
+    "gene_expression_file", lambda: input("Enter the full path to the gene expression CSV file: ").strip(), os.path.isfile)
+
+# ------------------- Step 4: Find or Prompt Predictor Paths -------------------
+netMHCIIpan_path = checkpoint.answer("netMHCIIpan_path", find_or_prompt_netMHCIIpan_path, os.path.isdir)
 print(f"Your NetMHCIIpan path is set to: {netMHCIIpan_path}")
 
-# Step 11: Run NetMHCIIpan
-trigger_netMHCIIpan(netMHCIIpan_path, annovar_output_dir)
+MixMHC2pred_path = checkpoint.answer("MixMHC2pred_path", find_or_prompt_MixMHC2pred_path, os.path.isdir)
+print(f"Your MixMHC2pred path is set to: {MixMHC2pred_path}")
 
-# Step 12: Process NetMHCIIpan results
 netMHCIIpan_output_file = os.path.join(os.path.dirname(annovar_output_dir), "netMHCIIpan_outputs", "NetMHCIIpan_out.txt")
 netMHCIIpan_results_dir = os.path.join(os.path.dirname(annovar_output_dir), "netMHCIIpan_outputs", "allele_results")
+MixMHC2pred_output_file = os.path.join(os.path.dirname(annovar_output_dir), "MixMHC2pred_outputs", "mutated_peptide_sequences_mix_out.txt")
+MixMHC2pred_results_dir = os.path.join(os.path.dirname(annovar_output_dir), "MixMHC2pred_outputs", "allele_results")
 
-process_netMHCIIpan_results_by_allele(netMHCIIpan_output_file, netMHCIIpan_results_dir, mutated_peptides_df_with_genes, gene_expression_file, tpm_threshold)
+# Files the stages read and write, used to decide which stages a rerun can skip
+script_dir = os.path.dirname(os.path.abspath(__file__))
+vcf_name = os.path.splitext(os.path.basename(vcf_file_path))[0]
+annovar_fasta_file = os.path.join(annovar_output_dir, f"{vcf_name}.mutated_proteins.fasta")
+exonic_variant_function_file = os.path.join(annovar_output_dir, f"{vcf_name}.refGene.exonic_variant_function")
+mutated_peptides_npz_file = "mutated_peptides_with_genes.npz"
+mutated_peptides_csv_file = "mutated_peptides_with_genes.csv"
+core_coverage_file = "frameshift_core_coverage.csv"
+pep_file_path = os.path.join(annovar_output_dir, "mutated_peptide_sequences.pep")
 
-# ------------------- MixMHC2pred Processing -------------------
-# Step 13: Find or Prompt MixMHC2pred Path
-MixMHC2pred_path = find_or_prompt_MixMHC2pred_path()
-print(f"Your MixMHC2pred path is set to: {MixMHC2pred_path}")
 
-# Step 14: Run MixMHC2pred
-trigger_MixMHC2pred(MixMHC2pred_path, annovar_output_dir)
+# ------------------- Pipeline stages -------------------
+# Each stage receives the results of the stages it depends on; see the STAGES table below.
 
-# Step 15: Process MixMHC2pred results
-MixMHC2pred_output_file = os.path.join(os.path.dirname(annovar_output_dir), "MixMHC2pred_outputs", "mutated_peptide_sequences_mix_out.txt")
-MixMHC2pred_results_dir = os.path.join(os.path.dirname(annovar_output_dir), "MixMHC2pred_outputs", "allele_results")
+def run_annovar(_):
+    fasta_path = trigger_annovar(vcf_file_path=vcf_file_path, annovar_path=annovar_path, shard_by=ANNOVAR_SHARD_BY,
+                                 block_size=ANNOVAR_BLOCK_SIZE, n_workers=ANNOVAR_WORKERS)
+    print("The fasta file is at: ", fasta_path, "     Start converting to DataFrame.......")
+    return fasta_path
+
+
+def load_gene_expression():
+    # Read Gene Expression Data once; every later stage uses this store
+    return ExpressionStore.load(gene_expression_file, sample_columns=EXPRESSION_SAMPLE_COLUMNS)
+
+
+def prompt_tpm_threshold(expression_store):
+    # Remove TPM = 0 before calculating the median
+    median_tpm = expression_store.median_tpm()
+    print(f"The median TPM value of the gene expression data (excluding zeros) is: {median_tpm:.2f}")
+
+    # Prompt for TPM Threshold; Enter keeps the previous run's value
+    previous_threshold = checkpoint.get_answer("tpm_threshold")
+    keep_hint = f", press Enter to keep {previous_threshold}" if previous_threshold is not None else ""
+    while True:
+        try:
+            answer = input(f"Please enter the TPM threshold (recommendation: > {median_tpm:.2f}{keep_hint}): ").strip()
+            tpm_threshold = previous_threshold if not answer and previous_threshold is not None else float(answer)
+            if tpm_threshold < 0:
+                print("Threshold must be a non-negative number. Please try again.")
+            else:
+                checkpoint.set_answer("tpm_threshold", tpm_threshold)
+                return tpm_threshold
+        except ValueError:
+            print("Invalid input. Please enter a numeric value.")
+
+
+def parse_variants(inputs):
+    # Convert fasta to DataFrame and pair each mutant record with its WILDTYPE record
+    df = build_variant_table(fasta_to_dataframe(inputs["annovar"]))
+
+    # Filter out immediate-stopgain
+    print("Filtering out immediate-stopgain.........")
+    mutation_df = filter_immediate_stopgain(df)
+    print("Filtering done!")
+    return mutation_df
+
+
+def generate_peptides(inputs):
+    # Generate mutation peptide sequences
+    mutated_peptides_df = mut_pep_generator(inputs["variants"], min_length=PEPTIDE_MIN_LENGTH, max_length=PEPTIDE_MAX_LENGTH,
+                                            n_workers=PEPTIDE_WORKERS, window_mode=FRAMESHIFT_WINDOW_MODE,
+                                            min_core_coverage=MIN_CORE_COVERAGE,
+                                            coverage_file=core_coverage_file if FRAMESHIFT_WINDOW_MODE == "tile" else None)
+    print("Mutation peptide sequences extracted!")
+
+    # Bind with Gene Name (for gene expression analysis)
+    mutated_peptides_df_with_genes = extract_gene_names_from_dynamic_file(
+        vcf_file_path=vcf_file_path,
+        output_dir=annovar_output_dir,
+        mutated_peptides_df=mutated_peptides_df
+    )
+    print(mutated_peptides_df_with_genes.head())
+    save_mutated_peptides_npz(mutated_peptides_df_with_genes, mutated_peptides_npz_file)
+    print(f"File saved successfully at: {mutated_peptides_npz_file}")
+    if WRITE_MUTATED_PEPTIDES_CSV:
+        save_mutated_peptides_csv(mutated_peptides_df_with_genes, mutated_peptides_csv_file)
+        print(f"File saved successfully at: {mutated_peptides_csv_file}")
+    return mutated_peptides_df_with_genes
+
+
+def count_alleles(allele_file_name):
+    with open(os.path.join(script_dir, allele_file_name), "r") as allele_file:
+        return sum(1 for line in allele_file if line.strip())
+
+
+def prefilter_peptides(inputs):
+    if not PREFILTER_UNEXPRESSED:
+        return inputs["peptides"]
+    # Every peptide is predicted against the NetMHCIIpan and the MixMHC2pred alleles
+    n_alleles = count_alleles("alleleList_net.txt") + count_alleles("alleleList_mix.txt")
+    return prefilter_unexpressed_peptides(inputs["peptides"], inputs["gene_expression"].tpm,
+                                          min_tpm=PREFILTER_MIN_TPM, n_alleles=n_alleles)
+
+
+def write_pep_file(inputs):
+    mutated_peptides_df_with_genes = inputs["expressed_peptides"]
+    # Peptide -> [variant, transcript, gene] multimap, shared by the .pep writer and both postprocessors
+    peptide_map = build_peptide_variant_map(mutated_peptides_df_with_genes)
+    save_mutated_peptides_to_pep(mutated_peptides_df_with_genes, annovar_output_dir, peptide_map)
+    return peptide_map
+
+
+def run_netMHCIIpan(inputs):
+    if NETMHCIIPAN_INPUT == "contexts":
+        # The windows NetMHCIIpan predicted, mapped back onto the variant records
+        _, context_peptides_df = trigger_netMHCIIpan_contexts(
+            netMHCIIpan_path, annovar_output_dir, inputs["expressed_peptides"],
+            lengths=(PEPTIDE_MIN_LENGTH, PEPTIDE_MAX_LENGTH), n_shards=NETMHCIIPAN_SHARDS,
+            alleles_per_job=NETMHCIIPAN_ALLELES_PER_JOB, n_workers=NETMHCIIPAN_WORKERS)
+        return context_peptides_df
+    trigger_netMHCIIpan(netMHCIIpan_path, annovar_output_dir, n_shards=NETMHCIIPAN_SHARDS,
+                        alleles_per_job=NETMHCIIPAN_ALLELES_PER_JOB, n_workers=NETMHCIIPAN_WORKERS,
+                        cache=prediction_cache)
+
+
+def postprocess_netMHCIIpan(inputs):
+    mutated_peptides_df, peptide_map = inputs["expressed_peptides"], inputs["pep_file"]
+    if NETMHCIIPAN_INPUT == "contexts":
+        mutated_peptides_df = inputs["netMHCIIpan"]
+        peptide_map = build_peptide_variant_map(mutated_peptides_df)
+    process_netMHCIIpan_results_by_allele(netMHCIIpan_output_file, netMHCIIpan_results_dir, mutated_peptides_df,
+                                          gene_expression_file, inputs["tpm_threshold"], peptide_map,
+                                          expression_store=inputs["gene_expression"])
+
+
+def run_MixMHC2pred(_):
+    trigger_MixMHC2pred(MixMHC2pred_path, annovar_output_dir, cache=prediction_cache)
+
+
+def postprocess_MixMHC2pred(inputs):
+    process_MixMHC2pred_results(MixMHC2pred_output_file, MixMHC2pred_results_dir, inputs["expressed_peptides"],
+                                gene_expression_file, inputs["tpm_threshold"], inputs["pep_file"],
+                                expression_store=inputs["gene_expression"])
+
+
+def checkpoint_spec(params=None, inputs=(), outputs=()):
+    # Checkpoint spec of a stage whose parameters and files do not depend on its inputs
+    return lambda _: {"params": params or {}, "inputs": list(inputs), "outputs": list(outputs)}
+
+
+def postprocess_spec(results_dir):
+    # Postprocessing reruns on its own when only the TPM threshold changes
+    return lambda inputs: {
+        "params": {"tpm_threshold": inputs["tpm_threshold"], "sample_columns": EXPRESSION_SAMPLE_COLUMNS},
+        "inputs": [gene_expression_file],
+        "outputs": [results_dir],
+    }
+
+
+# ------------------- Step 5: Read Gene Expression and Prompt for TPM Threshold -------------------
+# Every answer is collected here, on the main thread, before the stages start; the stages only receive them
+gene_expression = load_gene_expression()
+tpm_threshold = prompt_tpm_threshold(gene_expression)
+
+# Stage name -> (function, stages it depends on[, checkpoint spec]). The two predictors only
+# need the .pep file (or, for NetMHCIIpan contexts, the expressed peptides), so they run concurrently.
+# Stages with a checkpoint spec are skipped on a rerun when their parameters, input files and
+# upstream stages are unchanged; the gene expression and TPM threshold stages pass on the answers above.
+STAGES = {
+    "annovar": (run_annovar, [], checkpoint_spec(
+        {"annovar_path": annovar_path}, [vcf_file_path], [annovar_fasta_file, exonic_variant_function_file])),
+    "gene_expression": (lambda _: gene_expression, []),
+    "tpm_threshold": (lambda _: tpm_threshold, []),
+    "variants": (parse_variants, ["annovar"], checkpoint_spec()),
+    "peptides": (generate_peptides, ["variants"], checkpoint_spec(
+        {"peptides": "windows", "csv": WRITE_MUTATED_PEPTIDES_CSV, "lengths": [PEPTIDE_MIN_LENGTH, PEPTIDE_MAX_LENGTH],
+         "window_mode": FRAMESHIFT_WINDOW_MODE, "min_core_coverage": MIN_CORE_COVERAGE},
+        outputs=[mutated_peptides_npz_file] + ([mutated_peptides_csv_file] if WRITE_MUTATED_PEPTIDES_CSV else [])
+        + ([core_coverage_file] if FRAMESHIFT_WINDOW_MODE == "tile" else []))),
+    "expressed_peptides": (prefilter_peptides, ["peptides", "gene_expression"], checkpoint_spec(
+        {"prefilter": PREFILTER_UNEXPRESSED, "min_tpm": PREFILTER_MIN_TPM, "sample_columns": EXPRESSION_SAMPLE_COLUMNS},
+        [gene_expression_file] if PREFILTER_UNEXPRESSED else [])),
+    "pep_file": (write_pep_file, ["expressed_peptides"], checkpoint_spec(outputs=[pep_file_path])),
+    "netMHCIIpan": (run_netMHCIIpan, ["expressed_peptides"] if NETMHCIIPAN_INPUT == "contexts" else ["pep_file"], checkpoint_spec(
+        {"netMHCIIpan_path": netMHCIIpan_path, "input": NETMHCIIPAN_INPUT, "lengths": [PEPTIDE_MIN_LENGTH, PEPTIDE_MAX_LENGTH]},
+        [os.path.join(script_dir, "alleleList_net.txt")], [netMHCIIpan_output_file])),
+    "netMHCIIpan_postprocess": (postprocess_netMHCIIpan, ["netMHCIIpan", "expressed_peptides", "pep_file", "gene_expression", "tpm_threshold"],
+                                postprocess_spec(netMHCIIpan_results_dir)),
+    "MixMHC2pred": (run_MixMHC2pred, ["pep_file"], checkpoint_spec(
+        {"MixMHC2pred_path": MixMHC2pred_path}, [os.path.join(script_dir, "alleleList_mix.txt")], [MixMHC2pred_output_file])),
+    "MixMHC2pred_postprocess": (postprocess_MixMHC2pred, ["MixMHC2pred", "expressed_peptides", "pep_file", "gene_expression", "tpm_threshold"],
+                                postprocess_spec(MixMHC2pred_results_dir)),
+}
+
+# ------------------- Step 6: Run the pipeline -------------------
+run_stages(STAGES, checkpoint=checkpoint)
 
-process_MixMHC2pred_results(MixMHC2pred_output_file, MixMHC2pred_results_dir, mutated_peptides_df_with_genes, gene_expression_file, tpm_threshold)
+if prediction_cache is not None:
+    print(f"Prediction cache statistics: {prediction_cache.stats()}")
+    prediction_cache.close()
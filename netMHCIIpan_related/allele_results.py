@@ -0,0 +1,148 @@
+import os
+import numpy as np
+import pandas as pd
+from annovar_related.peptide_map import build_peptide_variant_map, unique_peptides
+from netMHCIIpan_related.cluster_result import cluster_by_intervals
+
+# Keys of the variant record (variant, transcript) each peptide was generated from
+VARIANT_KEYS = ["Variant ID", "Transcript ID"]
+
+# Variant-level columns written next to every binder, joined on VARIANT_KEYS
+EXTRA_COLUMNS = ["cDNA Change", "Protein Change", "Mutation Type", "Description"]
+
+# Columns of the per-run variant table; the protein sequence is only stored here
+VARIANT_TABLE_COLUMNS = VARIANT_KEYS + ["Gene Name"] + EXTRA_COLUMNS + ["Protein Sequence"]
+
+# Columns added by the annotation step
+ANNOTATION_COLUMNS = ["Gene Name", "Gene Expression", "Considered Target", "Cluster"]
+
+
+def cluster_binders(binders, peptide_order, coordinates, sequences):
+    """
+    Cluster the binders of every (allele, gene) group, computing each distinct peptide set once.
+
+    Alleles that bind the same peptides of a gene share one clustering; a peptide listed
+    once per variant of the gene counts once. Peptides with
+    coordinates are clustered by merging their intervals on the mutant protein (see
+    cluster_by_intervals); the others are clustered by string overlap in a canonical
+    order (their .pep file order) so the result only depends on the peptide set.
+
+    Parameters:
+        binders (pd.DataFrame): Long table with at least 'Allele', 'Gene Name' and 'Peptide'.
+        peptide_order (pd.Series): Peptide -> position in the .pep file.
+        coordinates (pd.DataFrame): Peptide -> variant multimap with a 'Start' column.
+        sequences (dict): (Variant ID, Transcript ID) -> mutant protein sequence.
+
+    Returns:
+        pd.Series: 'Cluster' aligned with binders' index.
+    """
+    if binders.empty:
+        return pd.Series(index=binders.index, dtype=object, name="Cluster")
+
+    ordered = binders[["Allele", "Gene Name", "Peptide"]].drop_duplicates()
+    ordered["Order"] = ordered["Peptide"].map(peptide_order)
+    ordered = ordered.sort_values("Order", kind="stable")
+    group_sets = ordered.groupby(["Allele", "Gene Name"], sort=False)["Peptide"].agg(tuple)
+
+    # Distinct (gene, peptide set) -> set id, clustered once each
+    set_ids = {}
+    group_set_ids = [set_ids.setdefault((gene, peptides), len(set_ids)) for (_, gene), peptides in group_sets.items()]
+    print(f"Clustering {len(set_ids)} distinct peptide sets for {len(group_sets)} (allele, gene) groups.")
+
+    members = pd.DataFrame(
+        [(set_id, gene, pep) for (gene, peptides), set_id in set_ids.items() for pep in peptides],
+        columns=["Set", "Gene Name", "Peptide"],
+    )
+    cluster_df = cluster_by_intervals(members, coordinates, sequences)
+    group_df = pd.DataFrame({
+        "Allele": group_sets.index.get_level_values(0),
+        "Gene Name": group_sets.index.get_level_values(1),
+        "Set": group_set_ids,
+    })
+
+    keys = binders[["Allele", "Gene Name", "Peptide"]].reset_index()
+    keys = keys.merge(group_df, on=["Allele", "Gene Name"], how="left").merge(cluster_df, on=["Set", "Peptide"], how="left")
+    return pd.Series(keys["Cluster"].to_numpy(), index=keys["index"].to_numpy(), name="Cluster").reindex(binders.index)
+
+
+def variant_records(mutated_peptides_df_with_genes):
+    """
+    Return the peptide-generating (mutant) records, one row per (Variant ID, Transcript ID).
+
+    Returns:
+        pd.DataFrame: VARIANT_TABLE_COLUMNS, with the protein sequence stripped of its stop '*'.
+    """
+    records = mutated_peptides_df_with_genes.dropna(subset=["peptide_starts"])
+    records = records[VARIANT_TABLE_COLUMNS].drop_duplicates(subset=VARIANT_KEYS, ignore_index=True)
+    records["Protein Sequence"] = records["Protein Sequence"].str.rstrip("*")
+    return records
+
+
+def write_allele_results(long_df, alleles, output_dir, mutated_peptides_df_with_genes, gene_tpm,
+                         tpm_threshold, leading_cols, trailing_cols, peptide_map=None):
+    """
+    Annotate binders of all alleles at once and write one CSV per allele.
+
+    Each binder is joined to every (variant, transcript, gene) record it was generated from,
+    so a peptide shared by several genes or variants gets one row per record, each with its
+    own gene's expression; protein sequences go to a single 'variant_table.csv' in output_dir
+    instead of being repeated on every row.
+
+    Parameters:
+    - long_df: Long binder table (one row per peptide and allele, with 'Allele' and 'Rank' columns),
+      already filtered on Rank, e.g. from read_xls_long or read_mix_long.
+    - alleles: Alleles in output order; alleles without binders get a header-only CSV.
+    - output_dir: Directory to save individual allele CSV files.
+    - mutated_peptides_df_with_genes: DataFrame containing peptides and corresponding genes.
+    - gene_tpm: Gene name -> TPM series (e.g. ExpressionStore.tpm).
+    - tpm_threshold: TPM expression threshold, defined in main_script.py.
+    - leading_cols: Predictor columns written before the annotation columns (e.g. ['Peptide']).
+    - trailing_cols: Predictor columns written after the variant columns (e.g. ['Rank']).
+    - peptide_map: Optional peptide -> variant multimap from build_peptide_variant_map (built if not given).
+    """
+    if peptide_map is None:
+        peptide_map = build_peptide_variant_map(mutated_peptides_df_with_genes)
+    peptides = unique_peptides(peptide_map)
+    peptide_order = pd.Series(np.arange(len(peptides)), index=peptides)
+
+    # Step 1: Sort by allele (in output order), then by Rank ascending
+    allele_codes = pd.Categorical(long_df["Allele"], categories=alleles).codes
+    binders = long_df.iloc[np.lexsort((long_df["Rank"].to_numpy(), allele_codes))].reset_index(drop=True)
+
+    # Step 2: Join each binder to every variant record (and gene) it was generated from; unmapped peptides drop out
+    coordinates = peptide_map.astype({"Peptide": str, "Gene Name": str})
+    if "Start" not in coordinates.columns:
+        coordinates["Start"] = pd.NA
+    provenance = coordinates[["Peptide", "Gene Name"] + VARIANT_KEYS].astype(str).drop_duplicates()
+    binders = binders.merge(provenance, on="Peptide", how="inner")
+
+    # Step 3: Add gene expression values and drop genes with missing or zero expression
+    binders["Gene Expression"] = binders["Gene Name"].map(gene_tpm)
+    binders = binders[binders["Gene Expression"] > 0].copy()
+
+    # Add a binary column to indicate whether it meets the TPM threshold
+    binders["Considered Target"] = (binders["Gene Expression"] >= tpm_threshold).astype(int)
+
+    # Step 4: Perform peptide clustering by gene, shared between alleles
+    records = variant_records(mutated_peptides_df_with_genes)
+    sequences = dict(zip(zip(records["Variant ID"], records["Transcript ID"]), records["Protein Sequence"]))
+    binders["Cluster"] = cluster_binders(binders, peptide_order, coordinates, sequences)
+
+    # Step 5: Add the variant-level columns of each binder's record
+    binders = binders.merge(records[VARIANT_KEYS + EXTRA_COLUMNS], on=VARIANT_KEYS, how="left")
+
+    selected_columns = list(leading_cols) + ANNOTATION_COLUMNS + VARIANT_KEYS + EXTRA_COLUMNS + list(trailing_cols)
+    results = binders[["Allele"] + selected_columns]
+
+    # Step 6: Save the variant table (referenced by Variant ID and Transcript ID) and each allele's results
+    os.makedirs(output_dir, exist_ok=True)
+    variant_table_file = os.path.join(output_dir, "variant_table.csv")
+    records.to_csv(variant_table_file, index=False)
+    print(f"Variant table saved to: {variant_table_file}")
+
+    allele_frames = dict(tuple(results.groupby("Allele", sort=False)))
+    for allele in alleles:
+        allele_df = allele_frames.get(allele, results.iloc[:0])
+        output_file = os.path.join(output_dir, f"{allele}_results.csv")
+        allele_df[selected_columns].to_csv(output_file, index=False)
+        print(f"Results for allele {allele} saved to: {output_file}")
@@ -1,6 +1,121 @@
 import pandas as pd
 
 
+def _get_max_overlap(s1, s2):
+    """
+    寻找 s1 的后缀和 s2 的前缀的最大重叠长度。
+    比如 s1 = ABCDE, s2 = DEFG，则重叠为 'DE'，长度为 2。
+    返回最大重叠的长度（int）。
+
+    Uses the KMP prefix function of s2 + separator + s1, so the cost is linear
+    in the peptide lengths instead of probing every overlap length with endswith.
+    """
+    text = s2 + "\0" + s1
+    prefix = [0] * len(text)
+    for i in range(1, len(text)):
+        k = prefix[i - 1]
+        while k and text[i] != text[k]:
+            k = prefix[k - 1]
+        if text[i] == text[k]:
+            k += 1
+        prefix[i] = k
+    return min(prefix[-1], len(s1), len(s2))
+
+
+def _find_merged_sequence(seq1, seq2):
+    """
+    给定两个肽段，若满足：
+    - 彼此有包含关系，则返回较长者。
+    - 否则，寻找最大首尾重叠并合并，若能找到非零重叠，则返回合并后的序列。
+    - 如果无法合并，返回 None。
+    """
+    # 1) 若存在包含关系，直接返回更长的
+    if seq1 in seq2:
+        return seq2
+    if seq2 in seq1:
+        return seq1
+
+    # 2) 找最大前缀/后缀重叠
+    overlap_len_1 = _get_max_overlap(seq1, seq2)  # s1 后缀和 s2 前缀
+    overlap_len_2 = _get_max_overlap(seq2, seq1)  # s2 后缀和 s1 前缀
+
+    # 2.1) 若 seq1 的末尾和 seq2 的开头有最大重叠
+    merged_1 = None
+    if overlap_len_1 > 0:
+        merged_1 = seq1 + seq2[overlap_len_1:]  # 拼接
+
+    # 2.2) 若 seq2 的末尾和 seq1 的开头有最大重叠
+    merged_2 = None
+    if overlap_len_2 > 0:
+        merged_2 = seq2 + seq1[overlap_len_2:]  # 拼接
+
+    # 按照长度或其他规则选一个合并结果
+    candidates = [m for m in [merged_1, merged_2] if m]
+    if candidates:
+        # 先返回最长的合并结果试试
+        return max(candidates, key=len)
+
+    # 若没有包含关系、也无法重叠合并，返回 None
+    return None
+
+
+def _merge_peptides(peptides):
+    """
+    给定同一基因下的所有肽段，聚类成母肽段列表。
+    返回一个（可能较少的）母肽段列表，确保其中任何两个都不再能合并。
+    """
+    # 先按长度从大到小排序
+    peptides = sorted(peptides, key=len, reverse=True)
+    clusters = []
+
+    for pep in peptides:
+        merged_into_existing = False
+
+        for i, cluster_seq in enumerate(clusters):
+            merged = _find_merged_sequence(cluster_seq, pep)
+            if merged is not None:
+                # 若能合并，更新该聚类代表序列
+                clusters[i] = merged
+                merged_into_existing = True
+                break
+
+        if not merged_into_existing:
+            # 若无法并入任何已有聚类，新增一个母肽段
+            clusters.append(pep)
+
+    return clusters
+
+
+def assign_clusters(peptides):
+    """
+    Cluster the peptides of one gene and map each peptide to its mother peptide.
+
+    Parameters:
+        peptides (iterable): Peptides of one gene; the result depends on their order.
+
+    Returns:
+        dict: Peptide -> mother peptide (the longest merged sequence containing it).
+    """
+    peptides = list(peptides)
+
+    # 获得母肽段列表
+    mother_peptides = _merge_peptides(peptides)
+
+    # 对每条原肽段，匹配到一个合适的母肽段（通常是包含它的那条）
+    # 若有多个母肽段都包含它，可以自行决定取第一个或取长度最大的。
+    clusters = {}
+    for pep in peptides:
+        # 找到所有包含 pep 的母肽段
+        candidate_mothers = [m for m in mother_peptides if pep in m]
+        if candidate_mothers:
+            # 这里简单取长度最大的母肽段
+            clusters[pep] = max(candidate_mothers, key=len)
+        else:
+            # 如果没有任何母肽段包含它（理论上不该出现），就自己当母肽段
+            clusters[pep] = pep
+    return clusters
+
+
 def cluster_peptides_by_gene(peptide_df):
     """
     Cluster peptides by gene and merge highly similar/overlapping sequences.
@@ -20,80 +135,6 @@ def cluster_peptides_by_gene(peptide_df):
         original peptide belongs.
     """
 
-    def get_max_overlap(s1, s2):
-        """
-        寻找 s1 的后缀和 s2 的前缀的最大重叠长度。
-        比如 s1 = ABCDE, s2 = DEFG，则重叠为 'DE'，长度为 2。
-        返回最大重叠的长度（int）。
-        """
-        max_len = min(len(s1), len(s2))
-        for length in range(max_len, 0, -1):
-            if s1.endswith(s2[:length]):
-                return length
-        return 0
-
-    def find_merged_sequence(seq1, seq2):
-        """
-        给定两个肽段，若满足：
-        - 彼此有包含关系，则返回较长者。
-        - 否则，寻找最大首尾重叠并合并，若能找到非零重叠，则返回合并后的序列。
-        - 如果无法合并，返回 None。
-        """
-        # 1) 若存在包含关系，直接返回更长的
-        if seq1 in seq2:
-            return seq2
-        if seq2 in seq1:
-            return seq1
-
-        # 2) 找最大前缀/后缀重叠
-        overlap_len_1 = get_max_overlap(seq1, seq2)  # s1 后缀和 s2 前缀
-        overlap_len_2 = get_max_overlap(seq2, seq1)  # s2 后缀和 s1 前缀
-
-        # 2.1) 若 seq1 的末尾和 seq2 的开头有最大重叠
-        merged_1 = None
-        if overlap_len_1 > 0:
-            merged_1 = seq1 + seq2[overlap_len_1:]  # 拼接
-
-        # 2.2) 若 seq2 的末尾和 seq1 的开头有最大重叠
-        merged_2 = None
-        if overlap_len_2 > 0:
-            merged_2 = seq2 + seq1[overlap_len_2:]  # 拼接
-
-        # 按照长度或其他规则选一个合并结果
-        candidates = [m for m in [merged_1, merged_2] if m]
-        if candidates:
-            # 先返回最长的合并结果试试
-            return max(candidates, key=len)
-
-        # 若没有包含关系、也无法重叠合并，返回 None
-        return None
-
-    def merge_peptides(peptides):
-        """
-        给定同一基因下的所有肽段，聚类成母肽段列表。
-        返回一个（可能较少的）母肽段列表，确保其中任何两个都不再能合并。
-        """
-        # 先按长度从大到小排序
-        peptides = sorted(peptides, key=len, reverse=True)
-        clusters = []
-
-        for pep in peptides:
-            merged_into_existing = False
-
-            for i, cluster_seq in enumerate(clusters):
-                merged = find_merged_sequence(cluster_seq, pep)
-                if merged is not None:
-                    # 若能合并，更新该聚类代表序列
-                    clusters[i] = merged
-                    merged_into_existing = True
-                    break
-
-            if not merged_into_existing:
-                # 若无法并入任何已有聚类，新增一个母肽段
-                clusters.append(pep)
-
-        return clusters
-
     # --------------------------------------------------------------
     # 对每个 Gene Name 分组聚合，并对其中的 Peptide 做聚类
     # --------------------------------------------------------------
@@ -103,25 +144,78 @@ def cluster_peptides_by_gene(peptide_df):
         # 当前基因下所有肽段列表
         peptides = subdf["Peptide"].tolist()
 
-        # 获得母肽段列表
-        mother_peptides = merge_peptides(peptides)
-
-        # 对每条原肽段，匹配到一个合适的母肽段（通常是包含它的那条）
-        # 若有多个母肽段都包含它，可以自行决定取第一个或取长度最大的。
+        clusters = assign_clusters(peptides)
         for pep in peptides:
-            # 找到所有包含 pep 的母肽段
-            candidate_mothers = [m for m in mother_peptides if pep in m]
-            if candidate_mothers:
-                # 这里简单取长度最大的母肽段
-                best_mother = max(candidate_mothers, key=len)
-            else:
-                # 如果没有任何母肽段包含它（理论上不该出现），就自己当母肽段
-                best_mother = pep
-
             output_records.append({
                 "Gene Name": gene_name,
                 "Peptide": pep,
-                "Cluster": best_mother
+                "Cluster": clusters[pep]
             })
 
     return pd.DataFrame(output_records)
+
+
+def cluster_by_intervals(members, coordinates, sequences):
+    """
+    Cluster peptides by merging their overlapping intervals on the mutant protein they came from.
+
+    Within each peptide set and (variant, transcript) record, intervals are sorted by start
+    and a new cluster begins whenever a start is not below the running end of the current
+    one; the cluster is the mutant sequence slice it covers. A peptide found in several
+    records takes the longest of its clusters. Peptides without coordinates fall back to
+    the string-overlap clustering of assign_clusters, per set.
+
+    Parameters:
+        members (pd.DataFrame): Columns 'Set', 'Gene Name' and 'Peptide' (one row per set member).
+        coordinates (pd.DataFrame): Columns 'Peptide', 'Gene Name', 'Variant ID', 'Transcript ID'
+            and 'Start' (0-based offset), e.g. the peptide -> variant multimap.
+        sequences (dict): (Variant ID, Transcript ID) -> mutant protein sequence.
+
+    Returns:
+        pd.DataFrame: Columns 'Set', 'Peptide' and 'Cluster', one row per member.
+    """
+    record_cols = ["Variant ID", "Transcript ID"]
+    hits = members.merge(coordinates.dropna(subset=["Start"]), on=["Gene Name", "Peptide"], how="inner")
+
+    clustered = pd.DataFrame(columns=["Set", "Peptide", "Cluster"])
+    if not hits.empty:
+        hits["Start"] = hits["Start"].astype("int64")
+        hits["End"] = hits["Start"] + hits["Peptide"].str.len()
+        hits = hits.sort_values(["Set"] + record_cols + ["Start", "End"], kind="stable", ignore_index=True)
+
+        # A new cluster starts at every record boundary and wherever the intervals stop overlapping
+        group_keys = hits[["Set"] + record_cols].astype(str)
+        new_record = (group_keys != group_keys.shift()).any(axis=1)
+        running_end = hits.groupby(["Set"] + record_cols, sort=False, observed=True)["End"].cummax().shift()
+        cluster_ids = (new_record | (hits["Start"] >= running_end)).cumsum()
+
+        bounds = hits.groupby(cluster_ids).agg(
+            variant=("Variant ID", "first"), transcript=("Transcript ID", "first"),
+            start=("Start", "min"), end=("End", "max"),
+        )
+        cluster_seqs = pd.Series(
+            [sequences[(variant, transcript)][start:end]
+             for variant, transcript, start, end in bounds.itertuples(index=False)],
+            index=bounds.index,
+        )
+        hits["Cluster"] = cluster_ids.map(cluster_seqs)
+
+        # One cluster per peptide: the longest among its records
+        hits["Length"] = hits["Cluster"].str.len()
+        clustered = (hits.sort_values("Length", ascending=False, kind="stable")
+                     .drop_duplicates(subset=["Set", "Peptide"])[["Set", "Peptide", "Cluster"]])
+
+    # Peptides without coordinates: string-overlap clustering within their set
+    located = pd.MultiIndex.from_frame(clustered[["Set", "Peptide"]])
+    unlocated = members[~pd.MultiIndex.from_frame(members[["Set", "Peptide"]]).isin(located)]
+    fallback = [
+        (set_id, pep, mother)
+        for set_id, set_members in unlocated.groupby("Set", sort=False)
+        for pep, mother in assign_clusters(set_members["Peptide"]).items()
+    ]
+    fallback = pd.DataFrame(fallback, columns=["Set", "Peptide", "Cluster"])
+
+    frames = [frame for frame in (clustered, fallback) if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=["Set", "Peptide", "Cluster"])
+    return members[["Set", "Peptide"]].merge(pd.concat(frames, ignore_index=True), on=["Set", "Peptide"], how="left")
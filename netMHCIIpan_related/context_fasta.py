@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from annovar_related.peptide_windows import window_arrays, empty_windows
+from annovar_related.wildtype_index import build_wildtype_index, peptide_in_wildtype
+from netMHCIIpan_related.netMHCIIpan_xls import read_xls_table, split_xls_header, write_xls_table
+
+# NetMHCIIpan truncates sequence names, so each context region gets a short ID
+CONTEXT_ID_PREFIX = "ctx"
+
+# One submitted context region: the record's positional row, the region [Offset, End) of its
+# mutant protein and the changed residues [Span Start, Span End), in protein coordinates
+CONTEXT_COLUMNS = ["ID", "Row", "Offset", "End", "Span Start", "Span End"]
+
+
+def mutation_span(sequence, wildtype_sequence):
+    """
+    Locate the changed residues of a mutant protein by trimming what it shares with its wildtype.
+
+    Returns:
+        tuple: (start, end) of the residues that differ, 0-based and end-exclusive. For a
+        deletion start == end, the junction between the residues left on either side. A
+        record without a wildtype changes its whole sequence.
+    """
+    if not wildtype_sequence:
+        return 0, len(sequence)
+
+    prefix = 0
+    shortest = min(len(sequence), len(wildtype_sequence))
+    while prefix < shortest and sequence[prefix] == wildtype_sequence[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < shortest - prefix and sequence[-1 - suffix] == wildtype_sequence[-1 - suffix]:
+        suffix += 1
+    return prefix, len(sequence) - suffix
+
+
+def spans_mutation(start, end, span_start, span_end):
+    """Whether the window [start, end) holds a changed residue (or both sides of a deletion junction)."""
+    if span_start == span_end:
+        return start < span_start < end
+    return start < span_end and end > span_start
+
+
+def _wildtype_sequence(mutated_peptides_df, row, sequences):
+    wildtype_position = mutated_peptides_df["Wildtype Index"].iat[row]
+    return "" if pd.isna(wildtype_position) else sequences[int(wildtype_position)]
+
+
+def write_context_fasta(mutated_peptides_df, fasta_file, max_length=25):
+    """
+    Write one mutant context region per peptide-generating record as a FASTA file for NetMHCIIpan -inptype 0.
+
+    Each region is the changed residues plus max_length - 1 residues on either side, so it
+    holds every window of up to max_length residues that spans the mutation. Records
+    without peptides (non-coding, immediate stop-gain, or emptied by the expression
+    pre-filter) get no region.
+
+    Parameters:
+        mutated_peptides_df (pd.DataFrame): Generator output (see mut_pep_generator), with 'Wildtype Index'.
+        fasta_file (str): Output FASTA file.
+        max_length (int): Longest peptide length NetMHCIIpan will be asked for.
+
+    Returns:
+        pd.DataFrame: CONTEXT_COLUMNS, one row per region in file order.
+    """
+    sequences = mutated_peptides_df["Protein Sequence"].str.rstrip("*").tolist()
+    starts = mutated_peptides_df["peptide_starts"].tolist()
+
+    contexts = []
+    os.makedirs(os.path.dirname(os.path.abspath(fasta_file)), exist_ok=True)
+    with open(fasta_file, "w") as f:
+        for row, (sequence, peptide_starts) in enumerate(zip(sequences, starts)):
+            if not isinstance(peptide_starts, np.ndarray) or not len(peptide_starts):
+                continue
+            span_start, span_end = mutation_span(sequence, _wildtype_sequence(mutated_peptides_df, row, sequences))
+            offset = max(0, span_start - max_length + 1)
+            end = min(len(sequence), max(span_end, span_start + 1) + max_length - 1)
+
+            context_id = f"{CONTEXT_ID_PREFIX}{len(contexts)}"
+            f.write(f">{context_id}\n{sequence[offset:end]}\n")
+            contexts.append((context_id, row, offset, end, span_start, span_end))
+
+    print(f"{len(contexts)} mutant context regions saved to: {fasta_file}")
+    return pd.DataFrame(contexts, columns=CONTEXT_COLUMNS)
+
+
+def _window_start(region, peptide, pos):
+    """Start of peptide in its context region, using NetMHCIIpan's Pos (0- or 1-based) when it matches."""
+    for start in (pos, pos - 1):
+        if start >= 0 and region.startswith(peptide, start):
+            return start
+    return region.find(peptide)
+
+
+def map_context_predictions(context_xls_file, mutated_peptides_df, contexts, output_xls_file, min_length=12):
+    """
+    Map NetMHCIIpan predictions over context regions back to the mutated peptides.
+
+    Only windows that span the mutation and do not occur in the wildtype protein are
+    kept. The predictions are written once per distinct peptide to output_xls_file, in the
+    layout of a NetMHCIIpan run over a .pep file, so the usual postprocessing reads them.
+
+    Parameters:
+        context_xls_file (str): NetMHCIIpan -xls output of the context FASTA.
+        mutated_peptides_df (pd.DataFrame): The generator output the regions were written from.
+        contexts (pd.DataFrame): Regions returned by write_context_fasta.
+        output_xls_file (str): Peptide-level -xls table to write.
+        min_length (int): Shortest peptide length (the wildtype anchor length).
+
+    Returns:
+        pd.DataFrame: Copy of mutated_peptides_df whose peptide windows are the kept
+        windows of each region (empty for records without a region).
+    """
+    alleles, header, rows = read_xls_table(context_xls_file)
+    common, group, summary = split_xls_header(header, len(alleles))
+    sequences = mutated_peptides_df["Protein Sequence"].str.rstrip("*").tolist()
+    context_info = {context_id: (row, sequences[row][offset:end], offset, span_start, span_end)
+                    for context_id, row, offset, end, span_start, span_end in contexts[CONTEXT_COLUMNS].itertuples(index=False)}
+
+    windows = {row: {} for row in contexts["Row"].tolist()}
+    wildtype_indexes = {}
+    peptide_rows = {}
+    n_windows = 0
+    for fields in rows:
+        pos, peptide, context_id = fields[0], fields[1], fields[2]
+        row, region, offset, span_start, span_end = context_info[context_id]
+        region_start = _window_start(region, peptide, int(pos))
+        start = offset + region_start
+        if region_start < 0 or not spans_mutation(start, start + len(peptide), span_start, span_end):
+            continue
+
+        if row not in wildtype_indexes:
+            wildtype_sequence = _wildtype_sequence(mutated_peptides_df, row, sequences)
+            wildtype_indexes[row] = (wildtype_sequence, build_wildtype_index(wildtype_sequence, min_length))
+        wildtype_sequence, wildtype_index = wildtype_indexes[row]
+        if peptide_in_wildtype(peptide, wildtype_sequence, wildtype_index, min_length):
+            continue
+
+        n_windows += 1
+        windows[row].setdefault(peptide, start)
+        peptide_rows.setdefault(peptide, fields)
+
+    # One row per distinct peptide, numbered like a .pep run
+    write_xls_table(output_xls_file, alleles, common, group, summary,
+                    [[str(i)] + fields[1:] for i, fields in enumerate(peptide_rows.values())])
+    print(f"{n_windows} of {len(rows)} predicted windows span a mutation and are absent from the wildtype; "
+          f"{len(peptide_rows)} distinct peptides saved to: {output_xls_file}")
+
+    # Same window columns as the generator output, so the peptide map is built the usual way
+    mapped_df = mutated_peptides_df.copy()
+    had_windows = mapped_df["peptide_starts"].notna().to_numpy()
+    start_arrays, length_arrays = empty_windows(len(mapped_df))
+    for row, peptides in windows.items():
+        start_arrays[row], length_arrays[row] = window_arrays(list(peptides.values()), [len(p) for p in peptides])
+    mapped_df["peptide_starts"] = pd.Series([s if keep else None for s, keep in zip(start_arrays, had_windows)],
+                                            index=mapped_df.index, dtype=object)
+    mapped_df["peptide_lengths"] = pd.Series([l if keep else None for l, keep in zip(length_arrays, had_windows)],
+                                             index=mapped_df.index, dtype=object)
+    return mapped_df
@@ -0,0 +1,222 @@
+import numpy as np
+import pandas as pd
+
+# Columns NetMHCIIpan writes once per peptide before the per-allele groups
+COMMON_COLUMNS = ["Pos", "Peptide", "ID", "Target"]
+
+# Per-peptide summary columns NetMHCIIpan appends after the last allele group
+SUMMARY_COLUMNS = ["Ave", "NB"]
+
+
+def read_xls_table(xls_file):
+    """
+    Read a NetMHCIIpan -xls output file.
+
+    The file has two header lines: the allele names (at the first column of each
+    allele group) and the column names.
+
+    Returns:
+        tuple: (alleles, header, rows) where rows are lists of tab-separated fields.
+    """
+    with open(xls_file, "r") as f:
+        first_line = f.readline().rstrip("\n").split("\t")
+        header = f.readline().rstrip("\n").split("\t")
+        rows = [line.rstrip("\n").split("\t") for line in f if line.strip()]
+
+    alleles = [name for name in first_line if name.strip()]
+    return alleles, header, rows
+
+
+def read_xls_header(xls_file):
+    """Read only the two header lines of a NetMHCIIpan -xls file; returns (alleles, header)."""
+    with open(xls_file, "r") as f:
+        first_line = f.readline().rstrip("\n").split("\t")
+        header = f.readline().rstrip("\n").split("\t")
+    return [name for name in first_line if name.strip()], header
+
+
+def split_xls_header(header, n_alleles):
+    """
+    Split an xls header into (common, per-allele group, summary) column names.
+
+    The group columns are the ones repeated once per allele between the common
+    and summary columns.
+    """
+    n_summary = 0
+    while n_summary < len(SUMMARY_COLUMNS) and header[len(header) - 1 - n_summary] in SUMMARY_COLUMNS:
+        n_summary += 1
+
+    common = header[:len(COMMON_COLUMNS)]
+    groups = header[len(COMMON_COLUMNS):len(header) - n_summary]
+    if n_alleles == 0 or len(groups) % n_alleles:
+        raise ValueError(f"Cannot split {len(groups)} allele columns into {n_alleles} allele groups.")
+
+    group_width = len(groups) // n_alleles
+    return common, groups[:group_width], header[len(header) - n_summary:]
+
+
+def write_xls_table(xls_file, alleles, common, group, summary, rows):
+    """Write rows back out in NetMHCIIpan's two-header-line -xls layout."""
+    first_line = [""] * len(common)
+    for allele in alleles:
+        first_line += [allele] + [""] * (len(group) - 1)
+
+    with open(xls_file, "w") as f:
+        f.write("\t".join(first_line).rstrip("\t") + "\n")
+        f.write("\t".join(common + group * len(alleles) + summary) + "\n")
+        for row in rows:
+            f.write("\t".join(row) + "\n")
+
+
+def _renumber_positions(rows, offset):
+    """Shift the Pos column by offset when the shard numbered its peptides sequentially."""
+    positions = [row[0] for row in rows]
+    if not all(pos.isdigit() for pos in positions):
+        return rows
+    values = np.array(positions, dtype=np.int64)
+    if len(values) and not np.array_equal(values, values[0] + np.arange(len(values))):
+        return rows
+    return [[str(pos + offset)] + row[1:] for pos, row in zip(values.tolist(), rows)]
+
+
+def decimals(value):
+    """Number of decimals NetMHCIIpan printed a value with ('0.1234' -> 4)."""
+    return len(value.split(".")[1]) if "." in value else 0
+
+
+def _merge_summaries(summary, group_summaries):
+    """
+    Combine the summary columns of one peptide across allele-group runs.
+
+    NB (number of binders, counted by each run with its own -rankW) adds up and Ave
+    is averaged weighted by allele count, printed with the runs' own precision;
+    a single group's values are passed through untouched.
+    """
+    if len(group_summaries) == 1:
+        return list(group_summaries[0][1])
+
+    merged = []
+    total_alleles = sum(n for n, _ in group_summaries)
+    for i, column in enumerate(summary):
+        if column == "NB":
+            merged.append(str(sum(int(float(values[i])) for _, values in group_summaries)))
+        else:
+            average = sum(n * float(values[i]) for n, values in group_summaries) / total_alleles
+            merged.append(f"{average:.{decimals(group_summaries[0][1][i])}f}")
+    return merged
+
+
+def stitch_xls_shards(shard_files, output_file):
+    """
+    Stitch NetMHCIIpan -xls outputs of peptide shards x allele groups into one file.
+
+    Parameters:
+        shard_files (list): One list per peptide shard (in input order), each holding the
+            xls files of that shard's allele groups (in allele order).
+        output_file (str): Path of the stitched xls file.
+
+    The allele groups of a shard are joined column-wise (rows must list the same
+    peptides) and the shards are then concatenated row-wise, so the result has the
+    same layout as a single NetMHCIIpan run over all peptides and alleles.
+    """
+    all_alleles = None
+    layout = None
+    stitched_rows = []
+
+    for group_files in shard_files:
+        shard_alleles = []
+        shard_rows = None
+        summaries = []
+
+        for xls_file in group_files:
+            alleles, header, rows = read_xls_table(xls_file)
+            common, group, summary = split_xls_header(header, len(alleles))
+            group_start, group_end = len(common), len(header) - len(summary)
+
+            if layout is None:
+                layout = (common, group, summary)
+            elif (common, group, summary) != layout:
+                raise ValueError(f"Unexpected column layout in NetMHCIIpan output: {xls_file}")
+
+            if shard_rows is None:
+                shard_rows = [row[:group_start] for row in rows]
+            elif [row[1] for row in rows] != [row[1] for row in shard_rows]:
+                raise ValueError(f"Peptide order differs between allele groups of one shard: {xls_file}")
+            for stitched, row in zip(shard_rows, rows):
+                stitched.extend(row[group_start:group_end])
+
+            summaries.append((len(alleles), [row[group_end:] for row in rows]))
+            shard_alleles.extend(alleles)
+
+        if all_alleles is None:
+            all_alleles = shard_alleles
+        elif shard_alleles != all_alleles:
+            raise ValueError("Peptide shards were run against different alleles.")
+
+        shard_rows = shard_rows or []
+        for i, row in enumerate(shard_rows):
+            row.extend(_merge_summaries(layout[2], [(n, values[i]) for n, values in summaries]))
+
+        stitched_rows.extend(_renumber_positions(shard_rows, len(stitched_rows)))
+
+    if layout is None:
+        raise ValueError("No NetMHCIIpan shard outputs to stitch.")
+
+    common, group, summary = layout
+    write_xls_table(output_file, all_alleles, common, group, summary, stitched_rows)
+
+
+def iter_xls_long(xls_file, rank_threshold=5, chunksize=200000):
+    """
+    Stream a NetMHCIIpan -xls file as long (one row per peptide and allele) record batches.
+
+    The two header lines are parsed here, the data is read in chunks and, for every
+    allele group, only rows with Rank <= rank_threshold are kept before the group is
+    melted, so non-binding (peptide, allele) pairs are never materialised.
+
+    Parameters:
+        xls_file (str): Path of the NetMHCIIpan -xls output.
+        rank_threshold (float): Keep rows whose Rank (last column of each group) is <= this value.
+        chunksize (int): Number of file rows read per chunk.
+
+    Yields:
+        pd.DataFrame: Columns = common columns + ['Allele'] + allele group columns
+        (e.g. Pos, Peptide, ID, Target, Allele, Core, Inverted, Score, Rank).
+    """
+    alleles, header = read_xls_header(xls_file)
+    common, group, _ = split_xls_header(header, len(alleles))
+
+    for chunk in pd.read_csv(xls_file, sep="\t", skiprows=2, header=None, chunksize=chunksize):
+        frames = []
+        for i, allele in enumerate(alleles):
+            start = len(common) + i * len(group)
+            rank = pd.to_numeric(chunk[start + len(group) - 1], errors="coerce")
+            binding = chunk.loc[rank <= rank_threshold, list(range(len(common))) + list(range(start, start + len(group)))]
+            if binding.empty:
+                continue
+            binding.columns = common + group
+            binding.insert(len(common), "Allele", allele)
+            frames.append(binding)
+        if frames:
+            yield pd.concat(frames, ignore_index=True)
+
+
+def read_xls_long(xls_file, rank_threshold=5, chunksize=200000):
+    """
+    Read the binding (Rank <= rank_threshold) rows of a NetMHCIIpan -xls file in long format.
+
+    Returns:
+        tuple: (alleles, long DataFrame) with rows grouped by allele in file order.
+    """
+    alleles, header = read_xls_header(xls_file)
+    common, group, _ = split_xls_header(header, len(alleles))
+
+    batches = list(iter_xls_long(xls_file, rank_threshold, chunksize))
+    if not batches:
+        return alleles, pd.DataFrame(columns=common + ["Allele"] + group)
+
+    long_df = pd.concat(batches, ignore_index=True)
+    # Chunks interleave alleles; restore allele order while keeping file order within each allele
+    order = {allele: i for i, allele in enumerate(alleles)}
+    long_df = long_df.sort_values("Allele", key=lambda col: col.map(order), kind="stable", ignore_index=True)
+    return alleles, long_df
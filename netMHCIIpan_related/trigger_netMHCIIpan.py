@@ -1,30 +1,251 @@
 import os
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
+from netMHCIIpan_related.netMHCIIpan_xls import (decimals, stitch_xls_shards, read_xls_table, split_xls_header,
+                                                  write_xls_table)
+from netMHCIIpan_related.context_fasta import write_context_fasta, map_context_predictions
+from pipeline_related.metrics import run_command
+from pipeline_related.prediction_cache import check_all_predicted, partition_cached, tool_version
 
-def trigger_netMHCIIpan(netmhciipan_path, annovar_outputs_dir):
+# NetMHCIIpan's default %Rank threshold for weak binders (-rankW), which its NB column counts
+DEFAULT_RANK_WEAK = 5
+
+
+def split_pep_file(pep_file, shard_dir, n_shards):
     """
-    Function to trigger NetMHCIIpan with the .pep file generated from ANNOVER output.
+    Split a .pep file into at most n_shards contiguous, evenly sized peptide chunks.
+
+    Returns:
+        list: Paths of the non-empty shard files, in input order.
+    """
+    with open(pep_file, "r") as f:
+        peptides = [line.strip() for line in f if line.strip()]
+
+    n_shards = max(1, min(n_shards, len(peptides)))
+    shard_size, remainder = divmod(len(peptides), n_shards)
+
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_files = []
+    start = 0
+    for shard in range(n_shards):
+        end = start + shard_size + (1 if shard < remainder else 0)
+        shard_file = os.path.join(shard_dir, f"shard_{shard}.pep")
+        with open(shard_file, "w") as f:
+            f.writelines(f"{peptide}\n" for peptide in peptides[start:end])
+        shard_files.append(shard_file)
+        start = end
+
+    return shard_files
+
+
+def split_fasta_file(fasta_file, shard_dir, n_shards):
+    """
+    Split a FASTA file into at most n_shards contiguous, evenly sized chunks of records.
+
+    Returns:
+        list: Paths of the non-empty shard files, in input order.
+    """
+    records = []
+    with open(fasta_file, "r") as f:
+        for line in f:
+            if line.startswith(">"):
+                records.append(line)
+            elif records:
+                records[-1] += line
+
+    n_shards = max(1, min(n_shards, len(records)))
+    shard_size, remainder = divmod(len(records), n_shards)
+
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_files = []
+    start = 0
+    for shard in range(n_shards):
+        end = start + shard_size + (1 if shard < remainder else 0)
+        shard_file = os.path.join(shard_dir, f"shard_{shard}.fasta")
+        with open(shard_file, "w") as f:
+            f.writelines(records[start:end])
+        shard_files.append(shard_file)
+        start = end
+
+    return shard_files
+
+
+def input_options(lengths=None, rank_weak=DEFAULT_RANK_WEAK):
+    """
+    NetMHCIIpan input options: peptide input (-inptype 1), or FASTA input (-inptype 0)
+    cut into peptides of every length in the (min, max) lengths range, and the
+    weak-binder %Rank threshold (-rankW) its NB column counts.
+    """
+    if lengths is None:
+        return f"-inptype 1 -rankW {rank_weak}"
+    return (f"-inptype 0 -length {','.join(str(length) for length in range(lengths[0], lengths[1] + 1))} "
+            f"-rankW {rank_weak}")
+
+
+def run_netMHCIIpan_sharded(netmhciipan_executable, pep_file, alleles, output_file, output_xls_file,
+                            n_shards=1, alleles_per_job=None, n_workers=1, lengths=None,
+                            rank_weak=DEFAULT_RANK_WEAK):
+    """
+    Run NetMHCIIpan as peptide-shard x allele-group jobs on a bounded worker pool.
 
     Parameters:
-    - netmhciipan_path: Path to the NetMHCIIpan executable.
-    - annovar_outputs_dir: Path to the 'annovar_outputs' directory where .pep file is located.
+    - netmhciipan_executable: Path to the netMHCIIpan executable.
+    - pep_file: Input .pep file (one peptide per line), or FASTA file when lengths is given.
+    - alleles: List of alleles to predict.
+    - output_file: Path of the combined plain-text output.
+    - output_xls_file: Path of the stitched -xls output.
+    - n_shards: Number of peptide (or FASTA record) chunks.
+    - alleles_per_job: Number of alleles per job (None runs all alleles in each job).
+    - n_workers: Maximum number of NetMHCIIpan processes running at once.
+    - lengths: (min, max) peptide lengths of a FASTA input (None = .pep input).
+    - rank_weak: Weak-binder %Rank threshold (-rankW) of every job.
+    """
+    shard_dir = os.path.join(os.path.dirname(output_xls_file), "shards")
+    split = split_pep_file if lengths is None else split_fasta_file
+    pep_shards = split(pep_file, shard_dir, n_shards)
+
+    alleles_per_job = alleles_per_job or len(alleles)
+    allele_groups = [alleles[i:i + alleles_per_job] for i in range(0, len(alleles), alleles_per_job)]
+
+    # One job per (peptide shard, allele group)
+    jobs = []
+    for shard_index, shard_file in enumerate(pep_shards):
+        for group_index, group in enumerate(allele_groups):
+            prefix = os.path.join(shard_dir, f"shard_{shard_index}_alleles_{group_index}")
+            jobs.append((shard_file, group, f"{prefix}.out", f"{prefix}.xls"))
+
+    def run_job(job):
+        shard_file, group, job_output, job_xls = job
+        command = (f"{netmhciipan_executable} {input_options(lengths, rank_weak)} -f {shard_file} > {job_output} "
+                   f"-a {','.join(group)} -xls -xlsfile {job_xls}")
+        print(f"Executing NetMHCIIpan command:\n{command}")
+        run_command(command, "netMHCIIpan", input_file=shard_file, output_file=job_xls, alleles=len(group))
+
+    print(f"Running {len(jobs)} NetMHCIIpan jobs ({len(pep_shards)} peptide shards x "
+          f"{len(allele_groups)} allele groups) on {n_workers} workers.")
+    with ThreadPoolExecutor(max_workers=max(1, n_workers)) as executor:
+        list(executor.map(run_job, jobs))
+
+    # Stitch the -xls outputs back into one file with the usual two header lines
+    xls_files = [[job[3] for job in jobs[i:i + len(allele_groups)]]
+                 for i in range(0, len(jobs), len(allele_groups))]
+    stitch_xls_shards(xls_files, output_xls_file)
+
+    # Concatenate the plain-text outputs in job order
+    with open(output_file, "w") as combined:
+        for job in jobs:
+            with open(job[2], "r") as f:
+                combined.write(f.read())
+
+
+def _summary_values(summary, group, group_values, rank_weak=DEFAULT_RANK_WEAK, ave_decimals=4):
+    """
+    Recompute NetMHCIIpan's per-peptide summary columns from the allele groups.
+
+    Ave is the mean Score over alleles (printed with ave_decimals, as NetMHCIIpan
+    printed it) and NB the number of alleles with Rank <= rank_weak.
     """
+    values = []
+    for column in summary:
+        if column == "Ave" and "Score" in group:
+            scores = [float(fields[group.index("Score")]) for fields in group_values]
+            values.append(f"{sum(scores) / len(scores):.{ave_decimals}f}")
+        elif column == "NB" and "Rank" in group:
+            values.append(str(sum(float(fields[group.index("Rank")]) <= rank_weak for fields in group_values)))
+        else:
+            values.append("NA")
+    return values
+
+
+def run_netMHCIIpan_cached(cache, version, pep_file, alleles, output_xls_file, run_predictions,
+                           rank_weak=DEFAULT_RANK_WEAK):
+    """
+    Serve NetMHCIIpan results from the prediction cache and predict only the misses.
+
+    NetMHCIIpan's own summary columns (Ave, NB) are cached for the allele list and
+    -rankW they were predicted with; other peptides get them recomputed.
+
+    Parameters:
+    - cache: PredictionCache instance.
+    - version: Tool version key (see tool_version).
+    - pep_file: Input .pep file.
+    - alleles: List of alleles to predict.
+    - output_xls_file: Path of the rebuilt -xls output covering every peptide.
+    - run_predictions: Function (pep_file, xls_file) running NetMHCIIpan on a .pep file.
+    - rank_weak: Weak-binder %Rank threshold (-rankW) run_predictions uses.
+
+    Returns:
+        int: Number of peptides sent to NetMHCIIpan (0 when every peptide was cached).
+    """
+    tool = "netMHCIIpan"
+    with open(pep_file, "r") as f:
+        peptides = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+    cached, missing = partition_cached(cache, tool, version, alleles, peptides)
+    summary_key = f"summary:{','.join(alleles)}:rankW={rank_weak}"
+    summaries = cache.lookup(tool, version, summary_key, peptides)
+
+    if missing:
+        work_dir = os.path.join(os.path.dirname(output_xls_file), "cache_misses")
+        os.makedirs(work_dir, exist_ok=True)
+        miss_pep_file = os.path.join(work_dir, "cache_misses.pep")
+        miss_xls_file = os.path.join(work_dir, "cache_misses.xls")
+        with open(miss_pep_file, "w") as f:
+            f.writelines(f"{peptide}\n" for peptide in missing)
+        run_predictions(miss_pep_file, miss_xls_file)
+
+        # Cache (ID, Target, allele group fields) per peptide and allele
+        miss_alleles, header, rows = read_xls_table(miss_xls_file)
+        common, group, summary = split_xls_header(header, len(miss_alleles))
+        cache.set_metadata(tool, version, "layout", [common, group, summary])
+        cache.set_metadata(tool, version, "pos_base", int(rows[0][0]) if rows and rows[0][0].isdigit() else 0)
+        summary_start = len(header) - len(summary)
+        if rows and "Ave" in summary:
+            cache.set_metadata(tool, version, "ave_decimals", decimals(rows[0][summary_start + summary.index("Ave")]))
+        for i, allele in enumerate(miss_alleles):
+            start = len(common) + i * len(group)
+            payloads = {row[1]: "\t".join(row[2:len(common)] + row[start:start + len(group)]) for row in rows}
+            cache.store(tool, version, allele, payloads)
+            cached.setdefault(allele, {}).update(payloads)
+        if summary:
+            new_summaries = {row[1]: "\t".join(row[summary_start:]) for row in rows}
+            cache.store(tool, version, summary_key, new_summaries)
+            summaries.update(new_summaries)
+
+    check_all_predicted(tool, cached, alleles, peptides)
+    layout = cache.get_metadata(tool, version, "layout")
+    if layout is None:
+        raise ValueError("The prediction cache has no NetMHCIIpan output layout; run once without the cache.")
+    common, group, summary = layout
+    pos_base = cache.get_metadata(tool, version, "pos_base") or 0
+    ave_decimals = cache.get_metadata(tool, version, "ave_decimals")
+    ave_decimals = 4 if ave_decimals is None else ave_decimals
+
+    # Rebuild the full table in .pep order from cached and new results
+    rows = []
+    for i, peptide in enumerate(peptides):
+        payloads = [cached[allele][peptide].split("\t") for allele in alleles]
+        group_values = [fields[len(common) - 2:] for fields in payloads]
+        row = [str(i + pos_base), peptide] + payloads[0][:len(common) - 2]
+        for fields in group_values:
+            row.extend(fields)
+        if peptide in summaries:
+            rows.append(row + summaries[peptide].split("\t"))
+        else:
+            rows.append(row + _summary_values(summary, group, group_values, rank_weak, ave_decimals))
+    write_xls_table(output_xls_file, alleles, common, group, summary, rows)
+    return len(missing)
+
+
+def _netmhciipan_executable(netmhciipan_path):
     # Validate NetMHCIIpan path
     netmhciipan_executable = os.path.join(netmhciipan_path, "netMHCIIpan")
     if not os.path.isfile(netmhciipan_executable):
         raise ValueError(f"NetMHCIIpan executable not found in folder: {netmhciipan_path}")
+    return netmhciipan_executable
 
-    # Define the .pep file and validate its existence
-    pep_file = os.path.join(annovar_outputs_dir, "mutated_peptide_sequences.pep")
-    if not os.path.isfile(pep_file):
-        raise FileNotFoundError(f"No file named 'mutated_peptide_sequences.pep' found in {annovar_outputs_dir}")
-
-    # Create the netMHCIIpan_outputs folder
-    base_dir = os.path.dirname(annovar_outputs_dir)  # Parent directory of annovar_outputs
-    netmhciipan_outputs_dir = os.path.join(base_dir, "netMHCIIpan_outputs")
-    os.makedirs(netmhciipan_outputs_dir, exist_ok=True)  # Create the folder if it doesn't exist
 
+def _default_alleles():
     # Locate the alleleList_net.txt file in the script folder
     script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     allele_file_path = os.path.join(script_dir, "alleleList_net.txt")
@@ -36,17 +257,143 @@ def trigger_netMHCIIpan(netmhciipan_path, annovar_outputs_dir):
         alleles = [line.strip() for line in allele_file if line.strip()]  # Strip whitespace and ignore empty lines
     if not alleles:
         raise ValueError("No alleles found in 'alleleList_net.txt'. Please ensure the file contains valid allele entries.")
+    return alleles
+
+
+def _default_output_dir(annovar_outputs_dir):
+    base_dir = os.path.dirname(annovar_outputs_dir)  # Parent directory of annovar_outputs
+    return os.path.join(base_dir, "netMHCIIpan_outputs")
+
+
+def trigger_netMHCIIpan(netmhciipan_path, annovar_outputs_dir, n_shards=1, alleles_per_job=None, n_workers=1,
+                        cache=None, alleles=None, pep_file=None, output_dir=None, rank_weak=DEFAULT_RANK_WEAK):
+    """
+    Function to trigger NetMHCIIpan with the .pep file generated from ANNOVER output.
+
+    Parameters:
+    - netmhciipan_path: Path to the NetMHCIIpan executable.
+    - annovar_outputs_dir: Path to the 'annovar_outputs' directory where .pep file is located.
+    - n_shards: Number of peptide chunks to split the .pep file into (1 = single run).
+    - alleles_per_job: Number of alleles per NetMHCIIpan job (None = all alleles in one job).
+    - n_workers: Maximum number of NetMHCIIpan processes running at once.
+    - cache: Optional PredictionCache; only peptides missing from it are sent to NetMHCIIpan.
+    - alleles: Alleles to predict (default: read from alleleList_net.txt).
+    - pep_file: Input .pep file (default: 'mutated_peptide_sequences.pep' in annovar_outputs_dir).
+    - output_dir: Output folder (default: 'netMHCIIpan_outputs' next to annovar_outputs_dir).
+    - rank_weak: Weak-binder %Rank threshold passed as -rankW (counted in the NB column).
+
+    Returns:
+        str: Path of the -xls output file.
+    """
+    netmhciipan_executable = _netmhciipan_executable(netmhciipan_path)
+
+    # Define the .pep file and validate its existence
+    if pep_file is None:
+        pep_file = os.path.join(annovar_outputs_dir, "mutated_peptide_sequences.pep")
+    if not os.path.isfile(pep_file):
+        raise FileNotFoundError(f"No file named '{os.path.basename(pep_file)}' found in {os.path.dirname(pep_file)}")
+
+    # Create the netMHCIIpan_outputs folder
+    if output_dir is None:
+        output_dir = _default_output_dir(annovar_outputs_dir)
+    netmhciipan_outputs_dir = output_dir
+    os.makedirs(netmhciipan_outputs_dir, exist_ok=True)  # Create the folder if it doesn't exist
+
+    if alleles is None:
+        alleles = _default_alleles()
+    if not alleles:
+        raise ValueError("No alleles found in 'alleleList_net.txt'. Please ensure the file contains valid allele entries.")
     alleles_str = ",".join(alleles)
 
     # Define the output file in the new directory
     output_file = os.path.join(netmhciipan_outputs_dir, "mutated_peptide_sequences.pep.out")
     output_xls_file = os.path.join(netmhciipan_outputs_dir, "NetMHCIIpan_out.txt")
 
-    # Construct the NetMHCIIpan command
-    command = f"{netmhciipan_executable} -inptype 1 -f {pep_file} > {output_file} -a {alleles_str} -xls -xlsfile {output_xls_file}"
+    def run_predictions(run_pep_file, run_xls_file):
+        if n_shards > 1 or (alleles_per_job and alleles_per_job < len(alleles)):
+            run_netMHCIIpan_sharded(netmhciipan_executable, run_pep_file, alleles, output_file, run_xls_file,
+                                    n_shards=n_shards, alleles_per_job=alleles_per_job, n_workers=n_workers,
+                                    rank_weak=rank_weak)
+        else:
+            # Construct the NetMHCIIpan command
+            command = f"{netmhciipan_executable} {input_options(rank_weak=rank_weak)} -f {run_pep_file} > {output_file} -a {alleles_str} -xls -xlsfile {run_xls_file}"
+
+            # Print and execute the command
+            print(f"Executing NetMHCIIpan command:\n{command}")
+            run_command(command, "netMHCIIpan", input_file=run_pep_file, output_file=run_xls_file, alleles=len(alleles))
+
+    if cache is not None:
+        n_predicted = run_netMHCIIpan_cached(cache, tool_version(netmhciipan_path, ("netMHCIIpan",)), pep_file,
+                                             alleles, output_xls_file, run_predictions, rank_weak)
+        # The plain-text output only exists for the peptides NetMHCIIpan actually ran on
+        if not n_predicted:
+            if os.path.exists(output_file):
+                os.remove(output_file)  # From an earlier run; it would not match this one
+            print(f"NetMHCIIpan prediction completed. Every peptide was served from the cache, so NetMHCIIpan was "
+                  f"not run and no plain-text output was written. Output saved to: {output_xls_file}")
+        else:
+            print(f"NetMHCIIpan prediction completed. Output saved to: {output_xls_file} "
+                  f"(plain-text output of the {n_predicted} predicted peptides: {output_file})")
+        return output_xls_file
+
+    run_predictions(pep_file, output_xls_file)
+    print(f"NetMHCIIpan prediction completed. Output saved to: {output_file}")
+    return output_xls_file
+
+
+def trigger_netMHCIIpan_contexts(netmhciipan_path, annovar_outputs_dir, mutated_peptides_df, lengths=(12, 25),
+                                 n_shards=1, alleles_per_job=None, n_workers=1, alleles=None, output_dir=None,
+                                 rank_weak=DEFAULT_RANK_WEAK):
+    """
+    Run NetMHCIIpan on one mutant context region per variant record instead of a .pep file.
+
+    The regions are written as FASTA and NetMHCIIpan slides its own windows of every length
+    in `lengths` over them (-inptype 0), so the peptides are never listed beforehand. The
+    windows that span a mutation and are absent from the wildtype are then mapped back
+    (see context_fasta.map_context_predictions) into the usual -xls output. The prediction
+    cache works per peptide and is not used here.
+
+    Parameters:
+    - netmhciipan_path: Path to the NetMHCIIpan executable.
+    - annovar_outputs_dir: Path to the 'annovar_outputs' directory; the FASTA file is written there.
+    - mutated_peptides_df: Generator output (after any expression pre-filter); its records with
+      peptides get a region.
+    - lengths: (min, max) peptide lengths.
+    - n_shards: Number of FASTA record chunks (1 = single run).
+    - alleles_per_job: Number of alleles per NetMHCIIpan job (None = all alleles in one job).
+    - n_workers: Maximum number of NetMHCIIpan processes running at once.
+    - alleles: Alleles to predict (default: read from alleleList_net.txt).
+    - output_dir: Output folder (default: 'netMHCIIpan_outputs' next to annovar_outputs_dir).
+    - rank_weak: Weak-binder %Rank threshold passed as -rankW (counted in the NB column).
+
+    Returns:
+        tuple: (path of the -xls output file, copy of mutated_peptides_df holding the mapped-back windows).
+    """
+    netmhciipan_executable = _netmhciipan_executable(netmhciipan_path)
+    if output_dir is None:
+        output_dir = _default_output_dir(annovar_outputs_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    if alleles is None:
+        alleles = _default_alleles()
+
+    fasta_file = os.path.join(annovar_outputs_dir, "mutated_context_regions.fasta")
+    contexts = write_context_fasta(mutated_peptides_df, fasta_file, max_length=lengths[1])
+
+    output_file = os.path.join(output_dir, "mutated_context_regions.fasta.out")
+    context_xls_file = os.path.join(output_dir, "NetMHCIIpan_context_out.txt")
+    output_xls_file = os.path.join(output_dir, "NetMHCIIpan_out.txt")
 
-    # Print and execute the command
-    print(f"Executing NetMHCIIpan command:\n{command}")
-    subprocess.run(command, shell=True, check=True)
+    if n_shards > 1 or (alleles_per_job and alleles_per_job < len(alleles)):
+        run_netMHCIIpan_sharded(netmhciipan_executable, fasta_file, alleles, output_file, context_xls_file,
+                                n_shards=n_shards, alleles_per_job=alleles_per_job, n_workers=n_workers,
+                                lengths=lengths, rank_weak=rank_weak)
+    else:
+        command = (f"{netmhciipan_executable} {input_options(lengths, rank_weak)} -f {fasta_file} > {output_file} "
+                   f"-a {','.join(alleles)} -xls -xlsfile {context_xls_file}")
+        print(f"Executing NetMHCIIpan command:\n{command}")
+        run_command(command, "netMHCIIpan", input_file=fasta_file, output_file=context_xls_file, alleles=len(alleles))
 
+    mapped_df = map_context_predictions(context_xls_file, mutated_peptides_df, contexts, output_xls_file,
+                                        min_length=lengths[0])
     print(f"NetMHCIIpan prediction completed. Output saved to: {output_file}")
+    return output_xls_file, mapped_df
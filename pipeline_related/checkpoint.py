@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+
+def path_hash(path, block_size=1 << 20):
+    """
+    Hash a file's contents, or a directory's file names and contents (recursively).
+
+    Returns:
+        str: SHA-256 hex digest, or None when the path does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file_name in sorted(files):
+                file_path = os.path.join(root, file_name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                digest.update(path_hash(file_path).encode())
+        return digest.hexdigest()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PipelineCheckpoint:
+    """
+    Manifest of finished pipeline stages and saved prompt answers, for resuming a run.
+
+    A stage's fingerprint covers its parameters, the hashes of its input files and the
+    fingerprints of the stages it depends on. A finished stage records that fingerprint,
+    the hashes of its output files and its pickled return value; on the next run it is
+    skipped when the fingerprint is unchanged and its outputs are still as it left them.
+
+    Parameters:
+        checkpoint_dir (str): Folder holding 'manifest.json' and one '<stage>.pkl' per stage.
+        resume (bool): False discards the previous manifest and starts afresh.
+    """
+
+    def __init__(self, checkpoint_dir, resume=True):
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.checkpoint_dir = checkpoint_dir
+        self.manifest_file = os.path.join(checkpoint_dir, "manifest.json")
+        self._lock = threading.Lock()
+        self.manifest = {"answers": {}, "stages": {}}
+        if resume and os.path.isfile(self.manifest_file):
+            with open(self.manifest_file, "r") as f:
+                self.manifest = json.load(f)
+
+    def _save_manifest(self):
+        temp_file = f"{self.manifest_file}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(temp_file, self.manifest_file)
+
+    # ------------------- Prompt answers -------------------
+
+    def get_answer(self, key):
+        """Return a saved prompt answer (None if absent)."""
+        with self._lock:
+            return self.manifest["answers"].get(key)
+
+    def set_answer(self, key, value):
+        """Save a (JSON-serialisable) prompt answer."""
+        with self._lock:
+            self.manifest["answers"][key] = value
+            self._save_manifest()
+
+    def answer(self, key, prompt, is_valid=None):
+        """
+        Offer a saved prompt answer for reuse, or ask with prompt() and save the reply.
+
+        The saved answer is shown and kept only when the user confirms it (Enter), since
+        the manifest lives in the working folder and may come from a run on other inputs.
+
+        Parameters:
+            key (str): Name of the answer in the manifest.
+            prompt (callable): Function asking the user and returning the answer.
+            is_valid (callable): Optional check a saved answer must pass to be offered (e.g. os.path.isfile).
+        """
+        saved = self.get_answer(key)
+        if saved is not None and (is_valid is None or is_valid(saved)):
+            reply = input(f"Saved answer for {key}: {saved}\n"
+                          f"Press Enter to keep it, or type 'n' to enter a new one: ").strip().lower()
+            if reply in ("", "y", "yes"):
+                return saved
+        value = prompt()
+        if value is not None:
+            self.set_answer(key, value)
+        return value
+
+    # ------------------- Stages -------------------
+
+    def fingerprint(self, name, spec, dependency_fingerprints):
+        """
+        Fingerprint a stage run.
+
+        Parameters:
+            name (str): Stage name.
+            spec (dict): 'params' (JSON-serialisable), 'inputs' (file or folder paths) and 'outputs'.
+            dependency_fingerprints (dict): Dependency stage name -> fingerprint.
+        """
+        key = {
+            "stage": name,
+            "params": spec.get("params", {}),
+            "inputs": {path: path_hash(path) for path in spec.get("inputs", [])},
+            "dependencies": dependency_fingerprints,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+    def is_current(self, name, fingerprint):
+        """True if the stage finished with this fingerprint and its outputs are unchanged since."""
+        with self._lock:
+            entry = self.manifest["stages"].get(name)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return False
+        if not os.path.isfile(os.path.join(self.checkpoint_dir, f"{name}.pkl")):
+            return False
+        return all(path_hash(path) == digest for path, digest in entry["outputs"].items())
+
+    def load_result(self, name):
+        """Return the pickled return value of a finished stage."""
+        return pd.read_pickle(os.path.join(self.checkpoint_dir, f"{name}.pkl"))
+
+    def save(self, name, fingerprint, result, outputs):
+        """Record a finished stage: its fingerprint, output hashes and pickled return value."""
+        pd.to_pickle(result, os.path.join(self.checkpoint_dir, f"{name}.pkl"))
+        entry = {"fingerprint": fingerprint, "outputs": {path: path_hash(path) for path in outputs}}
+        with self._lock:
+            self.manifest["stages"][name] = entry
+            self._save_manifest()
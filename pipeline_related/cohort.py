@@ -0,0 +1,294 @@
+import csv
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from annovar_related.trigger_annovar import trigger_annovar
+from annovar_related.fasta_to_df import fasta_to_dataframe
+from annovar_related.variant_table import build_variant_table
+from annovar_related.drop_imme_stopgain import filter_immediate_stopgain
+from annovar_related.mut_pep_generator import mut_pep_generator
+from annovar_related.extract_gene_name import extract_gene_names_from_dynamic_file
+from annovar_related.pep_file_generator import save_mutated_peptides_to_pep
+from annovar_related.peptide_map import build_peptide_variant_map, unique_peptides
+from annovar_related.peptide_npz import save_mutated_peptides_npz
+
+from netMHCIIpan_related.trigger_netMHCIIpan import trigger_netMHCIIpan
+from netMHCIIpan_related.netMHCIIpan_postprocess import process_netMHCIIpan_results_by_allele
+
+from MixMHC2pred_related.trigger_mixMHC2pred import trigger_MixMHC2pred
+from MixMHC2pred_related.mixMHC2pred_postprocess import process_MixMHC2pred_results
+
+from expression_related.expression_store import ExpressionStore, DEFAULT_SAMPLE_COLUMNS
+from expression_related.expression_prefilter import prefilter_unexpressed_peptides
+
+from pipeline_related.metrics import measure, describe_size
+from pipeline_related.prediction_cache import PredictionCache
+
+# Manifest columns every sample must fill in; the others are optional
+REQUIRED_MANIFEST_COLUMNS = ["sample", "vcf", "expression_file", "tpm_threshold"]
+OPTIONAL_MANIFEST_COLUMNS = ["expression_columns", "netmhciipan_alleles", "mixmhc2pred_alleles"]
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_allele_spec(spec, default_allele_file):
+    """
+    Resolve a manifest allele entry: a file with one allele per line, a comma-separated
+    list, or empty for the default allele list file.
+    """
+    spec = (spec or "").strip()
+    allele_file = spec or default_allele_file
+    if os.path.isfile(allele_file):
+        with open(allele_file, "r") as f:
+            return [line.strip() for line in f if line.strip()]
+    if not spec:
+        raise FileNotFoundError(f"Default allele list not found: {default_allele_file}")
+    return [allele.strip() for allele in spec.split(",") if allele.strip()]
+
+
+def read_cohort_manifest(manifest_file):
+    """
+    Read a cohort manifest (CSV, one row per sample).
+
+    Columns: sample, vcf, expression_file, tpm_threshold and optionally expression_columns
+    (';'-separated sample columns of the expression file) and netmhciipan_alleles /
+    mixmhc2pred_alleles (allele list file or comma-separated alleles; default: the
+    alleleList_net.txt / alleleList_mix.txt of the script folder).
+
+    Returns:
+        list: One dict per sample with parsed alleles, expression columns and threshold.
+    """
+    with open(manifest_file, "r", newline="") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        raise ValueError(f"The cohort manifest has no samples: {manifest_file}")
+
+    missing = [col for col in REQUIRED_MANIFEST_COLUMNS if col not in rows[0]]
+    if missing:
+        raise ValueError(f"The cohort manifest is missing column(s) {missing}: {manifest_file}")
+
+    samples = []
+    for row in rows:
+        name = row["sample"].strip()
+        if not os.path.isfile(row["vcf"]):
+            raise FileNotFoundError(f"VCF file of sample '{name}' not found: {row['vcf']}")
+        expression_columns = [col.strip() for col in (row.get("expression_columns") or "").split(";") if col.strip()]
+        samples.append({
+            "sample": name,
+            "vcf": row["vcf"],
+            "expression_file": row["expression_file"],
+            "expression_columns": expression_columns or DEFAULT_SAMPLE_COLUMNS,
+            "tpm_threshold": float(row["tpm_threshold"]),
+            "netMHCIIpan_alleles": read_allele_spec(row.get("netmhciipan_alleles"),
+                                                    os.path.join(SCRIPT_DIR, "alleleList_net.txt")),
+            "MixMHC2pred_alleles": read_allele_spec(row.get("mixmhc2pred_alleles"),
+                                                    os.path.join(SCRIPT_DIR, "alleleList_mix.txt")),
+        })
+
+    names = [sample["sample"] for sample in samples]
+    if len(set(names)) != len(names):
+        raise ValueError("Sample names in the cohort manifest must be unique.")
+    return samples
+
+
+class ExpressionLoader:
+    """Load each expression file once per cohort and hand out per-sample column selections."""
+
+    def __init__(self):
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def load(self, expression_file, sample_columns):
+        with self._lock:
+            if expression_file not in self._stores:
+                # Parsed with the first sample's columns; each sample then selects its own
+                self._stores[expression_file] = ExpressionStore.load(expression_file, sample_columns)
+            store = self._stores[expression_file]
+        return ExpressionStore(store.gene_index, store.samples, store.matrix, sample_columns)
+
+
+def prepare_sample(sample, annovar_path, sample_dir, expression_loader, prefilter=False, annovar_options=None,
+                   peptide_options=None):
+    """
+    Run one sample up to its .pep file: ANNOVAR, peptide generation, gene names and pre-filter.
+
+    Adds 'dir', 'annovar_outputs_dir', 'peptides', 'peptide_map', 'expression' and 'pep_file' to sample.
+    Each step is recorded as a metrics 'stage' with the sample name (see pipeline_related.metrics).
+    """
+    name = sample["sample"]
+    annovar_outputs_dir = os.path.join(sample_dir, "annovar_outputs")
+    print(f"[sample {name}] Running ANNOVAR......")
+    with measure("stage", "annovar", sample=name):
+        fasta_path = trigger_annovar(sample["vcf"], annovar_path, output_dir=annovar_outputs_dir, **(annovar_options or {}))
+
+    with measure("stage", "variants", profile=True, sample=name) as record:
+        mutation_df = filter_immediate_stopgain(build_variant_table(fasta_to_dataframe(fasta_path)))
+        record["outputs"] = describe_size(mutation_df)
+    with measure("stage", "peptides", profile=True, sample=name) as record:
+        mutated_peptides_df_with_genes = extract_gene_names_from_dynamic_file(
+            vcf_file_path=sample["vcf"],
+            output_dir=annovar_outputs_dir,
+            mutated_peptides_df=mut_pep_generator(mutation_df, coverage_file=os.path.join(sample_dir, "frameshift_core_coverage.csv"),
+                                                  **(peptide_options or {}))
+        )
+        save_mutated_peptides_npz(mutated_peptides_df_with_genes, os.path.join(sample_dir, "mutated_peptides_with_genes.npz"))
+        record["outputs"] = describe_size(mutated_peptides_df_with_genes)
+
+    expression = expression_loader.load(sample["expression_file"], sample["expression_columns"])
+    if prefilter:
+        n_alleles = len(sample["netMHCIIpan_alleles"]) + len(sample["MixMHC2pred_alleles"])
+        with measure("stage", "expressed_peptides", profile=True, sample=name) as record:
+            mutated_peptides_df_with_genes = prefilter_unexpressed_peptides(mutated_peptides_df_with_genes, expression.tpm,
+                                                                            n_alleles=n_alleles)
+            record["outputs"] = describe_size(mutated_peptides_df_with_genes)
+
+    with measure("stage", "pep_file", profile=True, sample=name) as record:
+        peptide_map = build_peptide_variant_map(mutated_peptides_df_with_genes)
+        save_mutated_peptides_to_pep(mutated_peptides_df_with_genes, annovar_outputs_dir, peptide_map)
+        record["outputs"] = describe_size(peptide_map)
+
+    sample.update({
+        "dir": sample_dir,
+        "annovar_outputs_dir": annovar_outputs_dir,
+        "peptides": mutated_peptides_df_with_genes,
+        "peptide_map": peptide_map,
+        "expression": expression,
+        "pep_file": os.path.join(annovar_outputs_dir, "mutated_peptide_sequences.pep"),
+    })
+    print(f"[sample {name}] {len(unique_peptides(peptide_map))} peptides ready for prediction.")
+    return sample
+
+
+def cohort_batches(samples, allele_key):
+    """
+    Group alleles by the set of samples typed for them.
+
+    Returns:
+        list: (alleles, peptides) batches; each batch's peptides are the unique peptides of
+        the samples sharing those alleles, in sample then generation order.
+    """
+    allele_samples = {}
+    for index, sample in enumerate(samples):
+        for allele in sample[allele_key]:
+            allele_samples.setdefault(allele, []).append(index)
+
+    sample_set_alleles = {}
+    for allele, indices in allele_samples.items():
+        sample_set_alleles.setdefault(tuple(indices), []).append(allele)
+
+    batches = []
+    for indices, alleles in sample_set_alleles.items():
+        peptides = list(dict.fromkeys(
+            peptide for index in indices for peptide in unique_peptides(samples[index]["peptide_map"])))
+        batches.append((alleles, peptides))
+    return batches
+
+
+def predict_cohort(samples, tool, trigger, cohort_dir):
+    """
+    Run one predictor over the whole cohort in as few batches as possible.
+
+    Every batch covers the peptides of all samples sharing a set of alleles, so the
+    predictor starts once per batch rather than once per sample; the results land in
+    the prediction cache the trigger is bound to, from which the per-sample outputs
+    are rebuilt.
+
+    Parameters:
+        samples (list): Prepared samples (see prepare_sample).
+        tool (str): 'netMHCIIpan' or 'MixMHC2pred'.
+        trigger (callable): trigger(alleles, pep_file, output_dir) running the predictor with the cache.
+        cohort_dir (str): Folder for the batch .pep files and outputs.
+    """
+    batches = cohort_batches(samples, f"{tool}_alleles")
+    sample_peptides = [unique_peptides(sample["peptide_map"]) for sample in samples]
+    n_cohort_peptides = len(set().union(*map(set, sample_peptides)))
+    print(f"{tool}: {len(batches)} cohort batch(es) instead of {len(samples)} per-sample runs; "
+          f"{n_cohort_peptides} distinct peptides across {sum(map(len, sample_peptides))} sample peptides.")
+
+    for index, (alleles, peptides) in enumerate(batches):
+        batch_dir = os.path.join(cohort_dir, tool, f"batch_{index}")
+        os.makedirs(batch_dir, exist_ok=True)
+        pep_file = os.path.join(batch_dir, "cohort_peptides.pep")
+        with open(pep_file, "w") as f:
+            f.writelines(f"{peptide}\n" for peptide in peptides)
+        with measure("stage", tool, batch=index, alleles=len(alleles), peptides=len(peptides)):
+            trigger(alleles, pep_file, batch_dir)
+
+
+def run_cohort(manifest_file, annovar_path, netmhciipan_path, mixmhc2pred_path, output_dir, max_samples=2,
+               cache_path=None, netmhciipan_options=None, prefilter=False, annovar_options=None,
+               peptide_options=None):
+    """
+    Run the whole pipeline for every sample of a cohort manifest, without prompts.
+
+    Samples are prepared (ANNOVAR to .pep file) and post-processed concurrently, at most
+    max_samples at a time. The predictors run once per cohort batch (see predict_cohort);
+    each sample's predictor outputs are then rebuilt from the prediction cache and
+    post-processed as in a single-sample run. Results go to output_dir/<sample>/.
+
+    Parameters:
+        manifest_file (str): Cohort manifest CSV (see read_cohort_manifest).
+        annovar_path (str): ANNOVAR folder.
+        netmhciipan_path (str): NetMHCIIpan folder.
+        mixmhc2pred_path (str): MixMHC2pred folder.
+        output_dir (str): Cohort output folder.
+        max_samples (int): Maximum number of samples processed at once.
+        cache_path (str): Prediction cache database (default: output_dir/prediction_cache/predictions.sqlite).
+        netmhciipan_options (dict): Extra trigger_netMHCIIpan arguments (n_shards, alleles_per_job, n_workers).
+        annovar_options (dict): Extra trigger_annovar arguments (shard_by, block_size, n_workers).
+        peptide_options (dict): Extra mut_pep_generator arguments (n_workers, window_mode, min_core_coverage).
+        prefilter (bool): Drop peptides of unexpressed genes before prediction.
+    """
+    samples = read_cohort_manifest(manifest_file)
+    netmhciipan_options = netmhciipan_options or {}
+    cache = PredictionCache(cache_path or os.path.join(output_dir, "prediction_cache", "predictions.sqlite"))
+    expression_loader = ExpressionLoader()
+
+    # Step 1: Prepare the samples concurrently
+    with ThreadPoolExecutor(max_workers=max(1, max_samples)) as executor:
+        samples = list(executor.map(
+            lambda sample: prepare_sample(sample, annovar_path, os.path.join(output_dir, sample["sample"]),
+                                          expression_loader, prefilter, annovar_options, peptide_options),
+            samples))
+
+    # Step 2: One predictor batch per allele-sharing sample set; both predictors run concurrently
+    cohort_dir = os.path.join(output_dir, "cohort_batches")
+
+    def trigger_net(alleles, pep_file, batch_dir, annovar_outputs_dir=None):
+        return trigger_netMHCIIpan(netmhciipan_path, annovar_outputs_dir or batch_dir, cache=cache, alleles=alleles,
+                                   pep_file=pep_file, output_dir=batch_dir, **netmhciipan_options)
+
+    def trigger_mix(alleles, pep_file, batch_dir, annovar_outputs_dir=None):
+        return trigger_MixMHC2pred(mixmhc2pred_path, annovar_outputs_dir or batch_dir, cache=cache, alleles=alleles,
+                                   pep_file=pep_file, output_dir=batch_dir)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        predictions = [executor.submit(predict_cohort, samples, "netMHCIIpan", trigger_net, cohort_dir),
+                       executor.submit(predict_cohort, samples, "MixMHC2pred", trigger_mix, cohort_dir)]
+        for future in predictions:
+            future.result()
+
+    # Step 3: Split the results back per sample (served from the cache) and post-process
+    def finish_sample(sample):
+        name = sample["sample"]
+        net_dir = os.path.join(sample["dir"], "netMHCIIpan_outputs")
+        with measure("stage", "netMHCIIpan_postprocess", profile=True, sample=name):
+            net_xls = trigger_net(sample["netMHCIIpan_alleles"], sample["pep_file"], net_dir, sample["annovar_outputs_dir"])
+            process_netMHCIIpan_results_by_allele(net_xls, os.path.join(net_dir, "allele_results"), sample["peptides"],
+                                                  sample["expression_file"], sample["tpm_threshold"], sample["peptide_map"],
+                                                  expression_store=sample["expression"])
+
+        mix_dir = os.path.join(sample["dir"], "MixMHC2pred_outputs")
+        with measure("stage", "MixMHC2pred_postprocess", profile=True, sample=name):
+            mix_out = trigger_mix(sample["MixMHC2pred_alleles"], sample["pep_file"], mix_dir, sample["annovar_outputs_dir"])
+            process_MixMHC2pred_results(mix_out, os.path.join(mix_dir, "allele_results"), sample["peptides"],
+                                        sample["expression_file"], sample["tpm_threshold"], sample["peptide_map"],
+                                        expression_store=sample["expression"])
+        print(f"[sample {name}] Done. Results are in: {sample['dir']}")
+
+    with ThreadPoolExecutor(max_workers=max(1, max_samples)) as executor:
+        list(executor.map(finish_sample, samples))
+
+    print(f"Prediction cache statistics: {cache.stats()}")
+    cache.close()
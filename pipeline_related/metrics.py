@@ -0,0 +1,236 @@
+import cProfile
+import itertools
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from annovar_related.peptide_windows import count_windows
+
+# Optional per-stage profilers: None, 'cprofile' (one .prof file per stage) or 'tracemalloc'
+PROFILERS = (None, "cprofile", "tracemalloc")
+
+# Number of allocation sites listed per stage with the 'tracemalloc' profiler
+TOP_ALLOCATIONS = 10
+
+# Recorder used by measure() and run_command(); None records nothing
+_active_recorder = None
+
+
+def _mib(kib):
+    # ru_maxrss is in KiB on Linux
+    return round(kib / 1024, 3)
+
+
+def count_lines(path, block_size=1 << 20):
+    """Number of lines in a file (0 when it does not exist)."""
+    if not os.path.isfile(path):
+        return 0
+    n_lines = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            n_lines += block.count(b"\n")
+    return n_lines
+
+
+def describe_size(value):
+    """
+    Row and peptide counts of a stage input or result, for the metrics file.
+
+    Returns:
+        dict: 'rows' for DataFrames and lists, plus 'peptides' for peptide tables
+        (generator output or peptide map); empty when the value has no size.
+    """
+    if isinstance(value, pd.DataFrame):
+        size = {"rows": len(value)}
+        if "peptide_starts" in value.columns:
+            size["peptides"] = count_windows(value)
+        elif "Peptide" in value.columns:
+            size["peptides"] = int(value["Peptide"].nunique())
+        return size
+    if isinstance(value, (list, tuple, dict)):
+        return {"rows": len(value)}
+    return {}
+
+
+class MetricsRecorder:
+    """
+    Append-only JSON-lines record of timed pipeline steps.
+
+    Every step ('stage', 'command', ...) writes one line when it ends, with its wall and
+    CPU time, the rusage of child processes, the process's peak RSS, its status and
+    any counts the caller added. Stages run on threads, so the CPU time is that of the
+    step's own thread; the children_* fields of a step count every child process that
+    ended while it ran, including those of concurrent steps (commands run through
+    run_command record their own child exactly instead).
+
+    Parameters:
+        metrics_file (str): JSON-lines file the records are appended to.
+        profile (str): None, 'cprofile' or 'tracemalloc' (see PROFILERS), applied to the
+            steps measured with profile=True.
+        profile_dir (str): Folder of the cProfile outputs (default: '<metrics_file>_profiles').
+    """
+
+    def __init__(self, metrics_file, profile=None, profile_dir=None):
+        if profile not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profile}'; use one of {PROFILERS}.")
+        os.makedirs(os.path.dirname(os.path.abspath(metrics_file)), exist_ok=True)
+        self.metrics_file = metrics_file
+        self.profile = profile
+        self.profile_dir = profile_dir or f"{os.path.splitext(metrics_file)[0]}_profiles"
+        self.run_id = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        self._profile_numbers = itertools.count(1)
+        if profile == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def write(self, record):
+        """Append one record to the metrics file."""
+        line = json.dumps(record, default=str)
+        with self._lock, open(self.metrics_file, "a") as f:
+            f.write(line + "\n")
+
+    @contextmanager
+    def _profiled(self, name, record):
+        """Run the body under the configured profiler and add its results to record."""
+        if self.profile == "cprofile":
+            # One cProfile at a time: newer Pythons allow a single active profiler per process
+            if not self._profile_lock.acquire(blocking=False):
+                record["profile_skipped"] = "another step was being profiled"
+                yield
+                return
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    os.makedirs(self.profile_dir, exist_ok=True)
+                    profile_file = os.path.join(self.profile_dir, f"{name}.{self.run_id}.{next(self._profile_numbers)}.prof")
+                    profiler.dump_stats(profile_file)
+                    record["profile_file"] = profile_file
+            finally:
+                self._profile_lock.release()
+        elif self.profile == "tracemalloc":
+            # The peak covers every thread, so concurrent steps share it
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            try:
+                yield
+            finally:
+                record["traced_peak_mib"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 3)
+                statistics = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ALLOCATIONS]
+                record["top_allocations"] = [f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} "
+                                             f"{stat.size / 2 ** 20:.3f} MiB" for stat in statistics]
+        else:
+            yield
+
+    @contextmanager
+    def measure(self, kind, name, profile=False, **fields):
+        """
+        Time the body and write its record; yields the record so the caller can add counts.
+
+        Parameters:
+            kind (str): Step kind, e.g. 'stage' or 'command'.
+            name (str): Step name.
+            profile (bool): Run the body under the recorder's profiler (if any).
+            fields: Extra fields of the record (e.g. sample name).
+        """
+        record = {"run": self.run_id, "kind": kind, "name": name,
+                  "started": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), **fields}
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        record["status"] = "ok"
+        try:
+            with self._profiled(name, record) if profile else _no_profile():
+                yield record
+        except BaseException as error:
+            record["status"] = "error"
+            record["error"] = f"{type(error).__name__}: {error}"
+            raise
+        finally:
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            record["wall_seconds"] = round(time.perf_counter() - wall_start, 6)
+            record["cpu_seconds"] = round(time.thread_time() - cpu_start, 6)
+            record.setdefault("children_user_seconds", round(children.ru_utime - children_before.ru_utime, 6))
+            record.setdefault("children_system_seconds", round(children.ru_stime - children_before.ru_stime, 6))
+            record["peak_rss_mib"] = _mib(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+            self.write(record)
+
+
+@contextmanager
+def _no_profile():
+    yield
+
+
+def start_recording(metrics_file, profile=None, profile_dir=None):
+    """Create a MetricsRecorder and make measure() and run_command() record to it."""
+    global _active_recorder
+    _active_recorder = MetricsRecorder(metrics_file, profile=profile, profile_dir=profile_dir)
+    print(f"Recording stage metrics to: {metrics_file}" + (f" (profiler: {profile})" if profile else ""))
+    return _active_recorder
+
+
+@contextmanager
+def measure(kind, name, profile=False, **fields):
+    """MetricsRecorder.measure on the active recorder; records nothing (yields a scratch dict) without one."""
+    if _active_recorder is None:
+        yield {}
+        return
+    with _active_recorder.measure(kind, name, profile=profile, **fields) as record:
+        yield record
+
+
+def _exit_code(status):
+    # os.waitstatus_to_exitcode needs Python 3.9
+    return os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+
+def run_command(command, name, input_file=None, output_file=None, **fields):
+    """
+    Run a shell command like subprocess.run(command, shell=True, check=True), recording it as a 'command' step.
+
+    The child is reaped with os.wait4, so its CPU times and peak RSS are exactly its own
+    (and those of the processes it waited for), even when several commands run at once.
+
+    Parameters:
+        command (str): Shell command.
+        name (str): Step name (e.g. 'netMHCIIpan').
+        input_file (str): Optional file whose line count is recorded as 'input_lines'.
+        output_file (str): Optional file whose line count is recorded as 'output_lines' afterwards.
+        fields: Extra fields of the record.
+    """
+    if _active_recorder is None:
+        subprocess.run(command, shell=True, check=True)
+        return
+
+    with measure("command", name, command=command, **fields) as record:
+        if input_file is not None:
+            record["input_lines"] = count_lines(input_file)
+        process = subprocess.Popen(command, shell=True)
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        process.returncode = _exit_code(status)
+        record["exit_code"] = process.returncode
+        record["children_user_seconds"] = round(usage.ru_utime, 6)
+        record["children_system_seconds"] = round(usage.ru_stime, 6)
+        record["child_peak_rss_mib"] = _mib(usage.ru_maxrss)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        if output_file is not None:
+            record["output_lines"] = count_lines(output_file)
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Scratch folders a tool writes into while running; left out of its fingerprint
+SCRATCH_FOLDERS = {"tmp", "temp", "__pycache__"}
+
+
+class PredictionCache:
+    """
+    Persistent on-disk cache of predictor results, keyed by (tool, version, allele, peptide).
+
+    Each entry holds the tool's output fields for one peptide and allele as a
+    tab-separated payload. Entries carry a last-used timestamp; when the cache
+    grows beyond max_entries the least recently used entries are evicted.
+    Hit/miss counts are kept per tool, both for this session and across runs.
+
+    Parameters:
+        db_path (str): Path of the SQLite database file (created if missing).
+        max_entries (int): Maximum number of cached (peptide, allele) results (None = unlimited).
+    """
+
+    def __init__(self, db_path, max_entries=None):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.session_stats = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "tool TEXT, version TEXT, allele TEXT, peptide TEXT, payload TEXT, last_used REAL, "
+                "PRIMARY KEY (tool, version, allele, peptide))"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata (tool TEXT, version TEXT, key TEXT, value TEXT, "
+                "PRIMARY KEY (tool, version, key))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS stats (tool TEXT PRIMARY KEY, hits INTEGER, misses INTEGER)"
+            )
+
+    def lookup(self, tool, version, allele, peptides):
+        """
+        Fetch the cached payloads of peptides for one allele.
+
+        Returns:
+            dict: Peptide -> payload for every cached peptide (misses are absent).
+        """
+        found = {}
+        now = time.time()
+        peptides = list(peptides)
+        with self._lock, self._connection:
+            for start in range(0, len(peptides), 500):
+                batch = peptides[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT peptide, payload FROM predictions WHERE tool = ? AND version = ? AND allele = ? "
+                    f"AND peptide IN ({placeholders})",
+                    [tool, version, allele] + batch,
+                ).fetchall()
+                found.update(rows)
+                self._connection.execute(
+                    f"UPDATE predictions SET last_used = ? WHERE tool = ? AND version = ? AND allele = ? "
+                    f"AND peptide IN ({placeholders})",
+                    [now, tool, version, allele] + batch,
+                )
+        return found
+
+    def store(self, tool, version, allele, payloads):
+        """Insert or replace the payloads (peptide -> payload) of one allele, then evict if needed."""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)",
+                [(tool, version, allele, peptide, payload, now) for peptide, payload in payloads.items()],
+            )
+        self.evict()
+
+    def evict(self):
+        """Drop the least recently used entries beyond max_entries."""
+        if self.max_entries is None:
+            return
+        with self._lock, self._connection:
+            (count,) = self._connection.execute("SELECT COUNT(*) FROM predictions").fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                self._connection.execute(
+                    "DELETE FROM predictions WHERE rowid IN "
+                    "(SELECT rowid FROM predictions ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+
+    def get_metadata(self, tool, version, key):
+        """Return a JSON metadata value stored for a tool version (None if absent)."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM metadata WHERE tool = ? AND version = ? AND key = ?", (tool, version, key)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_metadata(self, tool, version, key, value):
+        """Store a JSON-serialisable metadata value for a tool version."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)", (tool, version, key, json.dumps(value))
+            )
+
+    def use_version(self, tool, version):
+        """
+        Record the version key a tool is used with, warning when it differs from the previous run's.
+
+        Results are keyed by version, so those of an earlier version are never served again;
+        they stay in the database until they are evicted.
+        """
+        previous = self.get_metadata(tool, "", "current_version")
+        if previous is not None and previous != version:
+            with self._lock:
+                (stale,) = self._connection.execute(
+                    "SELECT COUNT(*) FROM predictions WHERE tool = ? AND version = ?", (tool, previous)
+                ).fetchone()
+            print(f"Warning: {tool} changed since the cache was last used ({previous} -> {version}); "
+                  f"its {stale} earlier cached results will not be used.")
+        self.set_metadata(tool, "", "current_version", version)
+
+    def record(self, tool, hits, misses):
+        """Add (peptide, allele) hit and miss counts to the session and persistent statistics."""
+        session = self.session_stats.setdefault(tool, {"hits": 0, "misses": 0})
+        session["hits"] += hits
+        session["misses"] += misses
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR IGNORE INTO stats VALUES (?, 0, 0)", (tool,))
+            self._connection.execute(
+                "UPDATE stats SET hits = hits + ?, misses = misses + ? WHERE tool = ?", (hits, misses, tool)
+            )
+
+    def stats(self):
+        """
+        Return cache statistics.
+
+        Returns:
+            dict: 'entries' (cached results), 'session' and 'total' (per-tool hits/misses).
+        """
+        with self._lock:
+            (entries,) = self._connection.execute("SELECT COUNT(*) FROM predictions").fetchone()
+            total = {
+                tool: {"hits": hits, "misses": misses}
+                for tool, hits, misses in self._connection.execute("SELECT tool, hits, misses FROM stats")
+            }
+        return {"entries": entries, "session": self.session_stats, "total": total}
+
+    def close(self):
+        self._connection.close()
+
+
+def tool_version(tool_path, executables=()):
+    """
+    Version key of an installed predictor: its folder name plus a fingerprint of its files.
+
+    The executables (and scripts) named in `executables` are hashed by content; every other
+    file in the folder (models, allele data, ...) apart from SCRATCH_FOLDERS contributes its
+    relative path, size and modification time, so upgrading or editing the tool in place gives a new key and the
+    cached predictions of the old one are no longer served.
+
+    Parameters:
+        tool_path (str): Install folder of the tool (e.g. '.../netMHCIIpan-4.3').
+        executables (tuple): File names in tool_path to hash by content.
+
+    Returns:
+        str: e.g. 'netMHCIIpan-4.3:3f2a9c0d1b7e4a55'.
+    """
+    digest = hashlib.sha256()
+    for name in executables:
+        digest.update(name.encode())
+        with open(os.path.join(tool_path, name), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+
+    for folder, subfolders, files in os.walk(tool_path):
+        subfolders[:] = sorted(subfolder for subfolder in subfolders if subfolder.lower() not in SCRATCH_FOLDERS)
+        for name in sorted(files):
+            path = os.path.join(folder, name)
+            relative_path = os.path.relpath(path, tool_path)
+            if relative_path in executables or not os.path.isfile(path):
+                continue
+            status = os.stat(path)
+            digest.update(f"{relative_path}\0{status.st_size}\0{status.st_mtime_ns}\n".encode())
+
+    return f"{os.path.basename(os.path.normpath(tool_path))}:{digest.hexdigest()[:16]}"
+
+
+def partition_cached(cache, tool, version, alleles, peptides):
+    """
+    Split peptides into cached results and peptides that still need predicting.
+
+    A peptide is a miss if any allele lacks a cached result for it, since the
+    predictors are run once per peptide over all alleles.
+
+    Returns:
+        tuple: (cached, missing) with cached = {allele: {peptide: payload}} and
+        missing = list of peptides in input order.
+    """
+    cache.use_version(tool, version)
+    cached = {allele: cache.lookup(tool, version, allele, peptides) for allele in alleles}
+    missing = [peptide for peptide in peptides if any(peptide not in cached[allele] for allele in alleles)]
+
+    hits = sum(len(found) for found in cached.values())
+    cache.record(tool, hits, len(alleles) * len(peptides) - hits)
+    print(f"{tool} cache: {len(peptides) - len(missing)} of {len(peptides)} peptides fully cached, "
+          f"{len(missing)} to predict.")
+    return cached, missing
+
+
+def check_all_predicted(tool, cached, alleles, peptides):
+    """
+    Raise if the predictor left any peptide without a result after the misses were predicted.
+
+    A predictor can drop or rename peptides it does not accept (e.g. an unsupported
+    length or residue), and the rebuilt output would otherwise fail half-written.
+    """
+    unpredicted = [peptide for peptide in peptides if any(peptide not in cached.get(allele, {}) for allele in alleles)]
+    if unpredicted:
+        examples = ", ".join(unpredicted[:5])
+        raise ValueError(f"{tool} returned no prediction for {len(unpredicted)} peptide(s), e.g. {examples}. "
+                         f"It may have skipped them for their length or residues; remove them from the .pep file "
+                         f"or run {tool} without the prediction cache.")
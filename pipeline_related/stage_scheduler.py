@@ -0,0 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from pipeline_related.metrics import measure, describe_size
+
+
+def validate_stages(stages):
+    """
+    Check that every dependency is a known stage and that the stages form a DAG.
+
+    Parameters:
+        stages (dict): Stage name -> (function, list of dependency names[, checkpoint spec]).
+    """
+    for name, (_, dependencies, *_) in stages.items():
+        for dependency in dependencies:
+            if dependency not in stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'.")
+
+    # Kahn's algorithm: if some stages are never freed there is a cycle
+    remaining = {name: set(dependencies) for name, (_, dependencies, *_) in stages.items()}
+    while remaining:
+        ready = [name for name, dependencies in remaining.items() if not dependencies]
+        if not ready:
+            raise ValueError(f"Stage dependencies contain a cycle: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(ready)
+
+
+def _run_stage(name, function, inputs, spec, checkpoint, fingerprints):
+    """Run one stage (recorded as a metrics 'stage' step with its input and output sizes)."""
+    with measure("stage", name, profile=True) as record:
+        record["inputs"] = {dependency: describe_size(value) for dependency, value in inputs.items()}
+        result, skipped = _run_or_resume_stage(name, function, inputs, spec, checkpoint, fingerprints)
+        record["skipped"] = skipped
+        record["outputs"] = describe_size(result)
+    return result, skipped
+
+
+def _run_or_resume_stage(name, function, inputs, spec, checkpoint, fingerprints):
+    """Run one stage, or load its result from the checkpoint when its inputs are unchanged."""
+    if checkpoint is None or spec is None:
+        return function(inputs), False
+
+    stage_spec = spec(inputs)
+    dependency_fingerprints = {dependency: fingerprints[dependency] for dependency in inputs if dependency in fingerprints}
+    fingerprint = checkpoint.fingerprint(name, stage_spec, dependency_fingerprints)
+    fingerprints[name] = fingerprint
+
+    if checkpoint.is_current(name, fingerprint):
+        return checkpoint.load_result(name), True
+
+    result = function(inputs)
+    checkpoint.save(name, fingerprint, result, stage_spec.get("outputs", []))
+    return result, False
+
+
+def run_stages(stages, max_workers=None, checkpoint=None):
+    """
+    Run pipeline stages as soon as their dependencies have finished.
+
+    Each stage function is called with one argument: a dict holding the return value
+    of every stage it depends on. Stages run on a thread pool, so independent stages
+    (e.g. the two predictors, which spend their time in external processes) overlap.
+
+    With a PipelineCheckpoint, stages given a checkpoint spec are skipped when they
+    finished before with the same parameters, input files and upstream stages; their
+    saved return value is used instead. The spec is a function of the stage's inputs
+    returning {'params': {...}, 'inputs': [paths], 'outputs': [paths]}. Stages without
+    a spec (e.g. interactive prompts) always run.
+
+    When metrics are being recorded (see pipeline_related.metrics.start_recording), every
+    stage writes a 'stage' record with its timings and input/output row counts.
+
+    Parameters:
+        stages (dict): Stage name -> (function, list of dependency names[, checkpoint spec]).
+        max_workers (int): Maximum number of stages running at once (default: number of stages).
+        checkpoint (PipelineCheckpoint): Optional checkpoint used to skip unchanged stages.
+
+    Returns:
+        dict: Stage name -> return value of the stage function.
+
+    If a stage raises, no new stages are started, the running ones are allowed to
+    finish and the first exception is re-raised.
+    """
+    validate_stages(stages)
+
+    results = {}
+    fingerprints = {}
+    pending = dict(stages)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers or max(1, len(stages))) as executor:
+        while pending or running:
+            # Launch every stage whose dependencies are all done
+            for name in [name for name, (_, dependencies, *_) in pending.items()
+                         if all(dependency in results for dependency in dependencies)]:
+                function, dependencies, *spec = pending.pop(name)
+                inputs = {dependency: results[dependency] for dependency in dependencies}
+                print(f"[stage] {name} started")
+                future = executor.submit(_run_stage, name, function, inputs, spec[0] if spec else None,
+                                         checkpoint, fingerprints)
+                running[future] = name
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    wait(running)
+                    raise error
+                results[name], skipped = future.result()
+                print(f"[stage] {name} skipped (unchanged since the last run)" if skipped
+                      else f"[stage] {name} finished")
+
+    return results
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the pipeline packages from the script folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from netMHCIIpan_related.allele_results import write_allele_results
+
+SHARED = "KLMNPQRSTVWY"
+
+
+def _record(variant_id, transcript_id, gene, sequence, starts):
+    return {"Variant ID": variant_id, "Transcript ID": transcript_id, "Gene Name": gene,
+            "cDNA Change": "c.1A>G", "Protein Change": "p.M1V", "Mutation Type": "protein-altering",
+            "Description": "NA", "Protein Sequence": sequence,
+            "peptide_starts": np.array(starts, dtype=np.int32),
+            "peptide_lengths": np.full(len(starts), len(SHARED), dtype=np.uint8)}
+
+
+def test_shared_peptide_is_reported_for_every_originating_gene_and_variant(tmp_path):
+    # The same peptide comes from two variants of GENE1 and one of GENE2
+    mutated_peptides_df = pd.DataFrame([
+        _record("line1", "NM_1", "GENE1", "AA" + SHARED, [2]),
+        _record("line2", "NM_1", "GENE1", SHARED + "CC", [0]),
+        _record("line3", "NM_2", "GENE2", "D" + SHARED, [1]),
+    ])
+    long_df = pd.DataFrame({"Peptide": [SHARED], "Allele": ["DRB1_0101"], "Rank": [1.0]})
+
+    write_allele_results(long_df, ["DRB1_0101"], str(tmp_path), mutated_peptides_df,
+                         pd.Series({"GENE1": 5.0, "GENE2": 20.0}), tpm_threshold=10,
+                         leading_cols=["Peptide"], trailing_cols=["Rank"])
+
+    results = pd.read_csv(tmp_path / "DRB1_0101_results.csv")
+    assert results[["Gene Name", "Variant ID", "Gene Expression", "Considered Target"]].values.tolist() == [
+        ["GENE1", "line1", 5.0, 0], ["GENE1", "line2", 5.0, 0], ["GENE2", "line3", 20.0, 1]]
+    assert results["Cluster"].notna().all()
@@ -0,0 +1,50 @@
+from annovar_related.annovar_merge import merge_annotation_tables, split_avinput
+
+AVINPUT = [
+    ["1", "100", "100", "A", "G"],
+    ["2", "200", "200", "C", "T"],
+    ["1", "300", "300", "G", "-"],
+    ["X", "400", "400", "T", "A"],
+    ["2", "500", "501", "AC", "-"],
+    ["1", "600", "600", "C", "G"],
+]
+HEADER = "Chr\tStart\tEnd\tRef\tAlt\tFunc.refGene\tGene.refGene\n"
+# ANNOVAR leaves invalid input out of its tables
+DROPPED = {"400"}
+
+
+def _multianno_row(fields):
+    return "\t".join(fields + ["exonic", f"GENE{fields[1]}"]) + "\n"
+
+
+def _variant_function_row(fields):
+    return "\t".join(["exonic", f"GENE{fields[1]}"] + fields) + "\n"
+
+
+def test_sharded_tables_merge_in_avinput_order(tmp_path):
+    avinput = tmp_path / "sample.avinput"
+    avinput.write_text("".join("\t".join(fields + ["0.5"]) + "\n" for fields in AVINPUT))
+    shards = split_avinput(str(avinput), str(tmp_path / "shards"), shard_by="chromosome", block_size=2)
+    assert len(shards) == 3
+
+    multianno, variant_function = [], []
+    for i, (shard_avinput, line_numbers) in enumerate(shards):
+        rows = [line.rstrip("\n").split("\t")[:5] for line in open(shard_avinput)]
+        rows = [fields for fields in rows if fields[1] not in DROPPED]
+        multianno_file = tmp_path / f"shard_{i}.hg19_multianno.txt"
+        multianno_file.write_text(HEADER + "".join(_multianno_row(fields) for fields in rows))
+        variant_function_file = tmp_path / f"shard_{i}.refGene.variant_function"
+        variant_function_file.write_text("".join(_variant_function_row(fields) for fields in rows))
+        multianno.append((str(multianno_file), shard_avinput, line_numbers))
+        variant_function.append((str(variant_function_file), shard_avinput, line_numbers))
+
+    expected = [fields for fields in AVINPUT if fields[1] not in DROPPED]
+    assert merge_annotation_tables(multianno, str(tmp_path / "merged.txt"))
+    assert (tmp_path / "merged.txt").read_text() == HEADER + "".join(_multianno_row(f) for f in expected)
+    assert merge_annotation_tables(variant_function, str(tmp_path / "merged.vf"), key_column=2, has_header=False)
+    assert (tmp_path / "merged.vf").read_text() == "".join(_variant_function_row(f) for f in expected)
+
+    # Shards without the table (e.g. a table_annovar.pl build that skips it) write nothing
+    assert not merge_annotation_tables([(str(tmp_path / "missing.txt"), shards[0][0], shards[0][1])],
+                                       str(tmp_path / "none.txt"))
+    assert not (tmp_path / "none.txt").exists()
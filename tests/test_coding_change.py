@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from annovar_related.coding_change import MISSING_FIELD, run_coding_change
+from annovar_related.coding_change_validation import (compare_coding_change_outputs, validate_coding_change,
+                                                      write_synthetic_reference)
+from annovar_related.fasta_to_df import fasta_to_dataframe
+
+# coding_change.pl output of write_synthetic_reference(seed=0), recorded with an ANNOVAR installation
+REFERENCE_FASTA = os.path.join(os.path.dirname(__file__), "data", "coding_change_pl_reference.fasta")
+
+
+def test_missing_protein_change_keeps_header_fields_in_place(tmp_path):
+    paths = write_synthetic_reference(str(tmp_path), n_transcripts=5, n_variants=20, seed=1)
+
+    # Drop the protein change (':p.' part) of every annotation
+    with open(paths["exonic_variant_function"]) as f:
+        lines = [line.split("\t") for line in f]
+    for fields in lines:
+        fields[2] = ",".join(annotation.rsplit(":", 1)[0] for annotation in fields[2].strip(",").split(",")) + ","
+    with open(paths["exonic_variant_function"], "w") as f:
+        f.writelines("\t".join(fields) for fields in lines)
+
+    fasta = run_coding_change(paths["exonic_variant_function"], paths["refgene"], paths["mrna"],
+                              str(tmp_path / "python.fasta"))
+    mutants = fasta_to_dataframe(fasta)
+    mutants = mutants[mutants["Mutation Type"] != "WILDTYPE"]
+
+    assert len(mutants)
+    assert (mutants["Protein Change"] == MISSING_FIELD).all()
+    assert mutants["cDNA Change"].str.startswith("c.").all()
+    assert mutants["Mutation Type"].isin(["protein-altering", "immediate-stopgain"]).all()
+
+
+def test_python_engine_matches_coding_change_pl(tmp_path):
+    annovar_path = os.environ.get("ANNOVAR_PATH")
+    if annovar_path:
+        differences = validate_coding_change(annovar_path, str(tmp_path))
+    elif os.path.exists(REFERENCE_FASTA):
+        paths = write_synthetic_reference(str(tmp_path))
+        python_fasta = run_coding_change(paths["exonic_variant_function"], paths["refgene"], paths["mrna"],
+                                         str(tmp_path / "coding_change_py.fasta"))
+        differences = compare_coding_change_outputs(REFERENCE_FASTA, python_fasta)
+    else:
+        pytest.skip("the Python coding_change engine is experimental and unvalidated: set ANNOVAR_PATH or record "
+                    "tests/data/coding_change_pl_reference.fasta")
+
+    assert differences.empty, differences.head(20).to_string()
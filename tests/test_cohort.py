@@ -0,0 +1,23 @@
+import pytest
+
+from pipeline_related.cohort import ExpressionLoader, read_cohort_manifest
+
+
+def test_samples_select_their_own_expression_columns(tmp_path):
+    expression_file = tmp_path / "cohort_expression.csv"
+    expression_file.write_text("gene_name,tpm_A,tpm_B\nGENE1,1.0,10.0\nGENE2,0.0,4.0\n")
+    for name in ("A", "B"):
+        (tmp_path / f"{name}.vcf").write_text("")
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text("sample,vcf,expression_file,expression_columns,tpm_threshold\n"
+                        f"A,{tmp_path / 'A.vcf'},{expression_file},tpm_A,1\n"
+                        f"B,{tmp_path / 'B.vcf'},{expression_file},tpm_B;tpm_A,1\n")
+
+    loader = ExpressionLoader()
+    tpm = {sample["sample"]: loader.load(sample["expression_file"], sample["expression_columns"]).tpm
+           for sample in read_cohort_manifest(str(manifest))}
+
+    assert tpm["A"].to_dict() == {"GENE1": 1.0, "GENE2": 0.0}
+    assert tpm["B"].to_dict() == {"GENE1": 5.5, "GENE2": 2.0}
+    with pytest.raises(ValueError, match="tpm_C"):
+        loader.load(str(expression_file), ["tpm_C"])
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from annovar_related.coding_change import MISSING_FIELD
+from annovar_related.drop_imme_stopgain import filter_immediate_stopgain
+from annovar_related.fasta_to_df import fasta_to_dataframe
+from annovar_related.mut_pep_generator import WINDOW_MODES, mut_pep_generator
+from annovar_related.variant_table import build_variant_table
+from annovar_related.wildtype_index import build_wildtype_index, peptide_in_wildtype, windows_in_wildtype
+from benchmark_related.synthetic_data import write_synthetic_annovar_outputs
+
+
+@pytest.fixture(scope="module")
+def variant_table(tmp_path_factory):
+    files = write_synthetic_annovar_outputs(str(tmp_path_factory.mktemp("annovar_outputs")), 200, protein_length=200)
+    return filter_immediate_stopgain(build_variant_table(fasta_to_dataframe(files["fasta"])))
+
+
+@pytest.mark.parametrize("window_mode", WINDOW_MODES)
+def test_worker_count_does_not_change_peptides(variant_table, window_mode, tmp_path):
+    single = mut_pep_generator(variant_table, window_mode=window_mode, n_workers=1,
+                               coverage_file=str(tmp_path / "single.csv"))
+    parallel = mut_pep_generator(variant_table, window_mode=window_mode, n_workers=4,
+                                 coverage_file=str(tmp_path / "parallel.csv"))
+
+    for column in ["peptide_starts", "peptide_lengths"]:
+        assert single[column].isna().tolist() == parallel[column].isna().tolist()
+        for a, b in zip(single[column].dropna(), parallel[column].dropna()):
+            np.testing.assert_array_equal(a, b)
+    if window_mode == "tile":
+        pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "single.csv"), pd.read_csv(tmp_path / "parallel.csv"))
+
+
+def test_unparsable_protein_change_is_skipped(variant_table, capsys):
+    expected = mut_pep_generator(variant_table)
+    altering = variant_table.index[variant_table["Mutation Class"].notna()]
+    missing = variant_table.copy()
+    missing.loc[altering[:2], "Protein Change"] = MISSING_FIELD
+
+    peptides = mut_pep_generator(missing)
+
+    assert "skipped 2 protein-altering records" in capsys.readouterr().out
+    assert peptides.loc[altering[:2], "peptide_starts"].isna().all()
+    for index in altering[2:]:
+        np.testing.assert_array_equal(peptides.at[index, "peptide_starts"], expected.at[index, "peptide_starts"])
+        np.testing.assert_array_equal(peptides.at[index, "peptide_lengths"], expected.at[index, "peptide_lengths"])
+
+
+def test_window_mask_matches_peptide_lookup():
+    rng = np.random.default_rng(0)
+    # A small alphabet and a copied stretch give repeated anchors and long wildtype matches
+    wildtype = "".join(rng.choice(list("ACDE"), 300))
+    mutant = wildtype[:120] + "W" + wildtype[121:200] + wildtype[40:90] + "".join(rng.choice(list("ACDE"), 60))
+    starts = rng.integers(0, len(mutant) - 8, 2000)
+    ends = np.minimum(starts + rng.integers(8, 26, 2000), len(mutant))
+
+    mask = windows_in_wildtype(mutant, starts, ends, wildtype, anchor_length=12)
+
+    wildtype_index = build_wildtype_index(wildtype, 12)
+    expected = [peptide_in_wildtype(mutant[start:end], wildtype, wildtype_index, 12)
+                for start, end in zip(starts.tolist(), ends.tolist())]
+    assert mask.tolist() == expected
+    assert 0 < mask.sum() < len(mask)
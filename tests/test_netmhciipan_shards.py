@@ -0,0 +1,37 @@
+from benchmark_related.fake_predictors import FAKE_NETMHCIIPAN_PATH, ensure_executable
+from netMHCIIpan_related.netMHCIIpan_xls import read_xls_table
+from netMHCIIpan_related.trigger_netMHCIIpan import trigger_netMHCIIpan
+from pipeline_related.prediction_cache import PredictionCache
+
+ALLELES = ["DRB1_0101", "DRB1_0301", "DRB1_0401"]
+PEPTIDES = ["AAAAKLLLLMNPQ", "CDEFGHIKLMNPQRS", "WYWYWYWYWYWYWYW", "MNPQRSTVWYACDEF",
+            "KLMNPQRSTVWYA", "GHIKLMNPQRSTV", "PQRSTVWYACDEFGH"]
+
+
+def _run(tmp_path, name, **options):
+    annovar_outputs_dir = tmp_path / "annovar_outputs"
+    annovar_outputs_dir.mkdir(exist_ok=True)
+    (annovar_outputs_dir / "mutated_peptide_sequences.pep").write_text("".join(f"{p}\n" for p in PEPTIDES))
+    return trigger_netMHCIIpan(FAKE_NETMHCIIPAN_PATH, str(annovar_outputs_dir), alleles=ALLELES, rank_weak=20,
+                               output_dir=str(tmp_path / name), **options)
+
+
+def test_sharded_run_matches_single_run(tmp_path):
+    ensure_executable()
+    single = open(_run(tmp_path, "single")).read()
+
+    assert open(_run(tmp_path, "peptide_shards", n_shards=3, n_workers=2)).read() == single
+
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+    _run(tmp_path, "cache_fill", cache=cache, n_shards=3)
+    assert open(_run(tmp_path, "cache_hits", cache=cache)).read() == single
+    cache.close()
+
+    # Allele groups average the groups' rounded scores, so Ave may differ in its last digit
+    _, header, expected = read_xls_table(_run(tmp_path, "single"))
+    _, _, rows = read_xls_table(_run(tmp_path, "allele_groups", n_shards=2, alleles_per_job=1))
+    ave = header.index("Ave")
+    assert [row[:ave] + row[ave + 1:] for row in rows] == [row[:ave] + row[ave + 1:] for row in expected]
+    for row, expected_row in zip(rows, expected):
+        assert len(row[ave]) == len(expected_row[ave])
+        assert abs(float(row[ave]) - float(expected_row[ave])) <= 1e-4
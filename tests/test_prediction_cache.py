@@ -0,0 +1,72 @@
+import pytest
+
+from benchmark_related.fake_predictors import (FAKE_MIXMHC2PRED_PATH, FAKE_NETMHCIIPAN_PATH, ensure_executable,
+                                               write_netmhciipan_xls)
+from MixMHC2pred_related.mixMHC2pred_output import read_mix_table
+from MixMHC2pred_related.trigger_mixMHC2pred import trigger_MixMHC2pred
+from netMHCIIpan_related.trigger_netMHCIIpan import run_netMHCIIpan_cached, trigger_netMHCIIpan
+from pipeline_related.prediction_cache import PredictionCache
+
+ALLELES = ["DRB1_0101", "DRB1_0301"]
+PEPTIDES = ["AAAAKLLLLMNPQ", "CDEFGHIKLMNPQRS", "WYWYWYWYWYWYWYW"]
+
+
+def _run(tmp_path, cache):
+    annovar_outputs_dir = tmp_path / "annovar_outputs"
+    annovar_outputs_dir.mkdir(exist_ok=True)
+    (annovar_outputs_dir / "mutated_peptide_sequences.pep").write_text("".join(f"{p}\n" for p in PEPTIDES))
+    return trigger_netMHCIIpan(FAKE_NETMHCIIPAN_PATH, str(annovar_outputs_dir), cache=cache, alleles=ALLELES,
+                               output_dir=str(tmp_path / "netMHCIIpan_outputs"))
+
+
+def test_all_cache_hits_rebuild_output_without_running_netmhciipan(tmp_path, capsys):
+    ensure_executable()
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+    plain_text_output = tmp_path / "netMHCIIpan_outputs" / "mutated_peptide_sequences.pep.out"
+
+    xls_file = _run(tmp_path, cache)
+    first_output = open(xls_file).read()
+    assert plain_text_output.exists()
+    capsys.readouterr()
+
+    xls_file = _run(tmp_path, cache)
+    assert open(xls_file).read() == first_output
+    assert not plain_text_output.exists()
+    assert "NetMHCIIpan was not run" in capsys.readouterr().out
+    assert cache.stats()["session"]["netMHCIIpan"] == {"hits": len(PEPTIDES) * len(ALLELES),
+                                                        "misses": len(PEPTIDES) * len(ALLELES)}
+    cache.close()
+
+
+def test_peptide_dropped_by_the_predictor_is_reported(tmp_path):
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+    pep_file = tmp_path / "peptides.pep"
+    pep_file.write_text("".join(f"{p}\n" for p in PEPTIDES))
+
+    def run_predictions(run_pep_file, xls_file):
+        # A predictor skipping the last peptide (as NetMHCIIpan does for unsupported input)
+        kept_pep_file = tmp_path / "kept.pep"
+        kept_pep_file.write_text("".join(open(run_pep_file).readlines()[:-1]))
+        write_netmhciipan_xls(str(kept_pep_file), ALLELES, xls_file)
+
+    with pytest.raises(ValueError, match=f"no prediction for 1 peptide.*{PEPTIDES[-1]}"):
+        run_netMHCIIpan_cached(cache, "fake", str(pep_file), ALLELES, str(tmp_path / "out.xls"), run_predictions)
+    cache.close()
+
+
+def test_rebuilt_mixmhc2pred_preamble_names_the_rebuilt_run(tmp_path):
+    ensure_executable()
+    cache = PredictionCache(str(tmp_path / "cache.sqlite"))
+    annovar_outputs_dir = tmp_path / "annovar_outputs"
+    annovar_outputs_dir.mkdir()
+    pep_file = annovar_outputs_dir / "mutated_peptide_sequences.pep"
+    pep_file.write_text("".join(f"{p}\n" for p in PEPTIDES))
+
+    for _ in range(2):
+        output_file = trigger_MixMHC2pred(FAKE_MIXMHC2PRED_PATH, str(annovar_outputs_dir), cache=cache,
+                                          alleles=["DRB1_01_01"])
+        preamble, _, rows = read_mix_table(output_file)
+        assert not any("cache_misses" in line for line in preamble)
+        assert any(str(pep_file) in line for line in preamble)
+        assert [row[0] for row in rows] == PEPTIDES
+    cache.close()